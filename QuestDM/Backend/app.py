@@ -1,12 +1,43 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, g
+import os
+import sys
 from flask_cors import CORS
 import ollama
+import httpx
 import re
 import json
-import traceback
-from tinydb import TinyDB, Query
+import logging
+from tinydb.storages import JSONStorage
+from compressed_storage import MessageCompressor, resolve_codec
 import time 
-
+import threading
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from turn_log import TurnLogStore
+from prompt_renderer import PromptRenderer, normalize_characters
+from name_index import LockedTinyDB, NameIndex, TemplateIndex, WriteThroughCachingMiddleware
+from session_locks import StoryLocks
+from session_cache import SessionCache
+from sse import FrameCoalescer, sse_frame
+from think_stream import REASONING, ThinkTagSplitter
+import scheduler
+from scheduler import ModelScheduler, QueueFull
+from story_listing import StoryListing
+from json_repair import repair_json
+from log_config import configure_logging
+import metrics
+from llm_cache import LLMCache
+from model_catalog import ModelCatalog
+from model_loader import ModelLoader, parse_keep_alive
+from session_trace import TraceRecorder
+from context_budget import (
+    assemble_context, count_tokens, estimate_text_tokens, pack_pieces,
+    pinned_prefix_length, select_recent, truncate_text
+)
+
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
@@ -16,56 +47,210 @@ app.debug = True
 current_model = "llama3.2-vision:latest"
 model_accuracy_threshold = 3     
 current_context_size = 4096      
-
-conversations = {} 
-llm_conversations = {}  
-
-db = TinyDB('stories.json',encoding='utf-8', ensure_ascii=False)
+context_token_budget = None
+response_token_reserve = 1024
+summary_keep_ratio = 0.3
+summary_input_token_cap = None
+summary_max_levels = 8
+structured_summaries = True
+structured_output_unsupported = set()
+keep_reasoning_in_memory = True
+
+last_turn_stats = {}
+active_turns = {}
+story_locks = StoryLocks(on_release=lambda doc_id: apply_template_updates(doc_id))
+# How long /chat, /load_story, /edit_story and /delete_story wait for a running turn.
+story_busy_timeout = 1
+model_scheduler = ModelScheduler(
+    limit=int(os.environ.get("OLLAMA_NUM_PARALLEL", 1)),
+    max_queue=int(os.environ.get("QUESTDM_MAX_QUEUE", 32)),
+    max_wait=float(os.environ.get("QUESTDM_MAX_QUEUE_WAIT", 30))
+)
+queue_poll_interval = 1.0
+disconnect_poll_interval = 0.25
+sse_flush_ms = int(os.environ.get("QUESTDM_SSE_FLUSH_MS", 30))
+sse_flush_bytes = int(os.environ.get("QUESTDM_SSE_FLUSH_BYTES", 1024))
+MAX_SSE_FLUSH_MS = 500
+MAX_SSE_FLUSH_BYTES = 64 * 1024
+history_page_size = 50
+
+db = LockedTinyDB('stories.json', storage=WriteThroughCachingMiddleware(JSONStorage), encoding='utf-8', ensure_ascii=False)
 stories_table = db.table('stories')
 character_creation_table = db.table('character_creation')
 story_creation_table = db.table('story_creation')
-StoryQuery = Query()
+story_index = NameIndex(story_creation_table)
+character_index = NameIndex(character_creation_table)
+character_templates = TemplateIndex()
+
+# QUESTDM_STORAGE_COMPRESSION=auto|gzip|zstd stores each story's message
+# arrays as a compressed blob from the story's next compaction on; unset, they
+# stay plain JSON. Compressed stories are read back whatever the setting.
+turn_log = TurnLogStore(story_creation_table, 'story_logs', compressor=MessageCompressor(
+    resolve_codec(os.environ.get("QUESTDM_STORAGE_COMPRESSION")),
+    int(os.environ["QUESTDM_STORAGE_COMPRESSION_LEVEL"]) if os.environ.get("QUESTDM_STORAGE_COMPRESSION_LEVEL") else None
+))
+llm_cache = LLMCache(
+    'llm_cache',
+    max_entries=int(os.environ.get("QUESTDM_LLM_CACHE_ENTRIES", 512)),
+    max_bytes=int(os.environ.get("QUESTDM_LLM_CACHE_MB", 64)) * 1024 * 1024
+)
+model_catalog = ModelCatalog(ollama, ttl=float(os.environ.get("QUESTDM_MODEL_CATALOG_TTL", 300)))
+model_catalog.start_refresher()
+model_loader = ModelLoader(ollama)
+# keep_alive of model calls for stories without their own (None: Ollama's default).
+default_keep_alive = parse_keep_alive(os.environ.get("QUESTDM_KEEP_ALIVE"))
+# Set QUESTDM_TRACE to a file path to record the session for
+# benchmarks/replay.py.
+trace_recorder = TraceRecorder(os.environ["QUESTDM_TRACE"]) if os.environ.get("QUESTDM_TRACE") else None
+TRACED_ROUTES = (
+    '/chat', '/chat/cancel', '/load_story', '/load_history', '/get_stories', '/list_stories',
+    '/create_story', '/edit_story', '/delete_story', '/get_characters', '/create_character',
+    '/edit_character', '/delete_character', '/set_model', '/invalidate_models', '/update_settings'
+)
+
+def session_pinned(story_name):
+    # A turn or load in progress holds the story lock, and a queued summary
+    # must find the same memory list when it is applied.
+    doc_id = story_index.doc_id(story_name)
+    return (doc_id is not None and story_locks.locked(doc_id)) or story_name in summary_jobs
+
+def flush_session(story_name):
+    # The session's changes are already in the turn log. Folding them into
+    # TinyDB frees the log's in-memory copy too, but rewrites the database,
+    # so it is left to the background compactor.
+    doc_id = story_index.doc_id(story_name)
+    logger.debug("Evicted in-memory session of story '%s'", story_name)
+    if doc_id is not None:
+        turn_log.request_compaction(doc_id)
+        turn_log.compact(doc_id)
+
+sessions = SessionCache(
+    max_entries=int(os.environ.get("QUESTDM_SESSION_CACHE_ENTRIES", 64)),
+    max_bytes=int(os.environ.get("QUESTDM_SESSION_CACHE_MB", 256)) * 1024 * 1024,
+    pinned=session_pinned,
+    on_evict=flush_session
+)
+conversations = sessions.view("conversation_history")
+llm_conversations = sessions.view("llm_memory")
+context_windows = sessions.view("context_window")
+
+turn_log.start_compactor()
+
+story_listing = StoryListing()
+for _doc in story_creation_table.all():
+    _story = turn_log.project(_doc, ('name', 'last_activity', 'characters'))
+    story_listing.track(_doc.doc_id, _story)
+    character_templates.track(_doc.doc_id, _story.get('characters'))
+
+LISTING_FIELDS = ('name', 'description', 'genre', 'mode', 'characters', 'last_activity', 'current_summary')
+DEFAULT_LISTING_FIELDS = ('name', 'description', 'genre', 'mode', 'characters', 'last_activity')
+MAX_LISTING_LIMIT = 200
+HEAVY_STORY_FIELDS = ('conversation_history', 'llm_memory', 'log_segment')
 
 last_story_summary = ""
 
-def construct_summary_prompt(conversation_text, current_story=None):
+def prompt_token_budget():
+    """Tokens the prompt may use: the context budget minus the room reserved for the reply."""
+    budget = min(context_token_budget or current_context_size, current_context_size)
+    return max(256, budget - response_token_reserve)
+
+def summary_input_cap():
+    """Hard cap on the input tokens of a single summarization call."""
+    return min(summary_input_token_cap or prompt_token_budget(), prompt_token_budget())
+
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+summary_jobs = {}
+summary_lock = threading.Lock()
+
+SUMMARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "character_creation": {
+            "type": "object",
+            "additionalProperties": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "race": {"type": "string"},
+                    "class": {"type": "string"},
+                    "backstory": {"type": "string"},
+                    "status": {"type": "string"}
+                },
+                "required": ["name", "race", "class", "backstory", "status"]
+            }
+        }
+    },
+    "required": ["summary", "character_creation"]
+}
+
+def construct_summary_prompt(conversation_text, current_story=None, character_budget=None, structured=False):
     """
     Constructs a prompt for the LLM to summarize the story and update characters.
     
     Args:
         conversation_text (str): The conversation history to summarize
         current_story (dict, optional): The current story object with existing characters
+        character_budget (int, optional): Token budget for the inlined character details;
+            characters that appear in the conversation text are included first
+        structured (bool): Output is constrained to SUMMARY_SCHEMA by Ollama, so the
+            prompt leaves out the JSON formatting instructions
         
     Returns:
         list: List of prompt messages for the LLM
     """
-    print("DEBUG: Constructing summary prompt with conversation of length:", len(conversation_text))
+    logger.debug("Constructing summary prompt with conversation of length: %s", len(conversation_text))
     
     existing_characters = {}
     if current_story and 'characters' in current_story:
-        existing_characters = current_story['characters']
-        if not isinstance(existing_characters, dict):
-            if isinstance(existing_characters, list):
-                char_dict = {}
-                for char in existing_characters:
-                    if isinstance(char, dict) and 'name' in char:
-                        char_dict[char['name']] = char
-                existing_characters = char_dict
-            else:
-                existing_characters = {}
+        existing_characters = normalize_characters(current_story['characters'])
     
     character_context = "CURRENT CHARACTERS:\n"
     if existing_characters:
-        for char_name, char_info in existing_characters.items():
+        ordered_characters = sorted(
+            existing_characters.items(),
+            key=lambda item: item[0] not in conversation_text
+        )
+        used_tokens = 0
+        omitted = []
+        for char_name, char_info in ordered_characters:
             if isinstance(char_info, dict):
                 char_context = f"- {char_name}:\n"
                 for key, value in char_info.items():
                     if key != 'template_origin' and value:  
                         char_context += f"  {key}: {value}\n"
+                char_tokens = estimate_text_tokens(char_context)
+                if character_budget is not None and used_tokens + char_tokens > character_budget:
+                    omitted.append(char_name)
+                    continue
                 character_context += char_context
+                used_tokens += char_tokens
+        if omitted:
+            omitted_names = truncate_text(", ".join(omitted), max(16, character_budget - used_tokens))
+            character_context += f"- Also tracked, details omitted: {omitted_names}\n"
     else:
         character_context += "No existing characters tracked.\n"
     
+    if structured:
+        return [
+            {
+                "role": "system",
+                "content": (
+                    "Summarize the conversation history of a D&D story. Return a detailed summary of the story so far "
+                    "and a character_creation object keyed by character name.\n\n"
+                    f"{character_context}\n"
+                    "- Keep every existing character exactly as given; never drop or rename one\n"
+                    "- Update existing characters and add new ones (including minor NPCs) only from the conversation\n"
+                    "- If an unnamed character is now named, add them under the new name with their prior details\n"
+                    "- Use \"Unknown\" for a race or class that is not known; status is their current state and location"
+                )
+            },
+            {
+                "role": "user",
+                "content": conversation_text
+            }
+        ]
+
     return [
         {
             "role": "system",
@@ -181,6 +366,47 @@ dnd_mode_prompt = {
 }
 
 
+prompt_renderer = PromptRenderer({'dnd': dnd_mode_prompt, 'novel': novel_mode_prompt})
+
+
+def refresh_prompt_prefix(llm_conv, prompts):
+    """
+    Puts the current system prompts at the head of an LLM memory.
+
+    Entries whose text has not changed are left alone, so an unchanged story
+    keeps a byte-identical prompt prefix from turn to turn.
+    """
+    for i, prompt in enumerate(prompts):
+        current = llm_conv[i]
+        if current.get("role") != prompt["role"] or current.get("content") != prompt["content"]:
+            llm_conv[i] = prompt
+
+
+def turn_stats_from_chunk(chunk, prompt_tokens_estimate):
+    """
+    Extracts Ollama's timing counters from the final chunk of a stream.
+
+    A ``prompt_eval_count`` well below ``prompt_tokens_estimate`` means Ollama
+    reused its KV cache for the unchanged part of the prompt.
+    """
+    def millis(name):
+        value = chunk.get(name) or 0
+        return round(value / 1e6, 1)
+
+    eval_count = chunk.get("eval_count") or 0
+    eval_ms = millis("eval_duration")
+    return {
+        "prompt_eval_count": chunk.get("prompt_eval_count") or 0,
+        "prompt_tokens_estimate": prompt_tokens_estimate,
+        "prompt_eval_ms": millis("prompt_eval_duration"),
+        "eval_count": eval_count,
+        "eval_ms": eval_ms,
+        "load_ms": millis("load_duration"),
+        "total_ms": millis("total_duration"),
+        "tokens_per_second": round(eval_count / (eval_ms / 1000), 2) if eval_ms else 0
+    }
+
+
 def merge_conversation(existing_conversation, new_conversation):
     seen_messages = {json.dumps(msg, sort_keys=True) for msg in existing_conversation}
     for msg in new_conversation:
@@ -190,14 +416,69 @@ def merge_conversation(existing_conversation, new_conversation):
 
 
 
+def valid_summary_json(data):
+    """Returns ``data`` if it has the summary/character_creation shape, else None."""
+    if not isinstance(data, dict) or not isinstance(data.get("summary"), str):
+        return None
+    if "character_creation" not in data or data["character_creation"] is None:
+        data["character_creation"] = {}
+    if not isinstance(data["character_creation"], dict):
+        return None
+    return data
+
+def response_content(response, default=""):
+    if hasattr(response, "message"):
+        return response.message.content or default
+    if isinstance(response, dict):
+        return response.get("message", {}).get("content", default)
+    return default
+
+def summary_parses(text):
+    """True if ``text`` yields a valid summary without asking the model to repair it."""
+    try:
+        return valid_summary_json(repair_json(text)) is not None
+    except ValueError:
+        return False
+
+def cached_model_call(priority, messages, model=None, format=None, accept=summary_parses):
+    """
+    Runs one non-streaming model call through the scheduler and llm_cache.
+
+    A request that was answered before (same model, messages, options and
+    format) is served from the cache without touching the model. Only
+    replies that ``accept`` approves are stored, so a retry after a bad
+    reply really asks the model again.
+
+    Returns:
+        str: The reply's text ("" if the model returned nothing)
+    """
+    model = model or current_model
+    options = {"num_ctx": current_context_size}
+    key = llm_cache.key(model, messages, options, format)
+    content = llm_cache.get(key)
+    if content is not None:
+        logger.debug("Model reply served from cache (%s)", key[:12])
+        return content
+
+    kwargs = {"format": format} if format is not None else {}
+    if default_keep_alive is not None:
+        kwargs["keep_alive"] = default_keep_alive
+    with model_scheduler.slot(priority):
+        started = time.perf_counter()
+        response = ollama.chat(model=model, messages=messages, stream=False, options=options, **kwargs)
+    if trace_recorder:
+        trace_recorder.model_call(started, model, messages, options, format, response)
+    content = response_content(response)
+    if content and accept(content):
+        llm_cache.put(key, content)
+    return content
+
 def process_summary_json(summary_text):
    
     
-    print("\n" + "="*50)
-    print("DEBUG: Starting JSON parsing process")
-    print(f"DEBUG: Raw summary text preview: {summary_text[:150]}...")
-    print(f"DEBUG: Summary text length: {len(summary_text)} characters")
-    print("="*50 + "\n")
+    logger.debug("Starting JSON parsing process")
+    logger.debug("Raw summary text preview: %s...", summary_text[:150])
+    logger.debug("Summary text length: %s characters", len(summary_text))
 
     default_result = {
         "summary": "Summarization failed, this doesn't happen very often, you are on your own LLM. Continue the story naturally using the limited context you have. When dealing with characters whose background you're uncertain about, use dialogue to reconstruct history - have characters say things like 'Remember what we've been through together?' or 'After all that happened in the forest, I still can't believe we made it out.' This will encourage the player to mention past events in their response, helping you rebuild the narrative context. NPCs can also ask questions like 'How did you solve that problem with the dragon again?' to prompt the player to recount important story elements while maintaining the illusion of continuity.",
@@ -210,27 +491,27 @@ def process_summary_json(summary_text):
         for prefix in ["SUMMARY:", "Here's the summary:", "JSON:", "Output:"]:
             if text.strip().startswith(prefix):
                 text = text[len(prefix):].strip()
-                print(f"DEBUG: Removed prefix: '{prefix}'")
+                logger.debug("Removed prefix: '%s'", prefix)
         
         if "```" in text:
             text = re.sub(r'```(?:json)?\n?([\s\S]*?)\n?```', r'\1', text)
-            print("DEBUG: Removed markdown code blocks")
+            logger.debug("Removed markdown code blocks")
         
         first_brace = text.find('{')
         last_brace = text.rfind('}')
         if first_brace != -1 and last_brace != -1:
             text = text[first_brace:last_brace+1]
-            print(f"DEBUG: Extracted JSON between braces (chars {first_brace}-{last_brace})")
+            logger.debug("Extracted JSON between braces (chars %s-%s)", first_brace, last_brace)
         
         result = text.strip()
         if result != original_text:
-            print(f"DEBUG: Cleaned text preview: {result[:100]}...")
+            logger.debug("Cleaned text preview: %s...", result[:100])
         
         return result
 
 
     try:
-        print("\nDEBUG: ATTEMPTING METHOD 1 - Ask LLM to fix malformed JSON")
+        logger.debug("ATTEMPTING METHOD 1 - Parse, repair locally, then ask LLM to fix malformed JSON")
         start_time = time.time()
         import ollama
         
@@ -242,16 +523,16 @@ def process_summary_json(summary_text):
             data = json.loads(cleaned_text)
             if "summary" in data and "character_creation" in data:
                 if isinstance(data["summary"], str) and isinstance(data["character_creation"], dict):
-                    print(f"DEBUG: JSON is already valid, no repair needed")
-                    print(f"DEBUG: Found summary of length: {len(data['summary'])} chars")
-                    print(f"DEBUG: Found {len(data['character_creation'])} characters")
+                    logger.debug("JSON is already valid, no repair needed")
+                    logger.debug("Found summary of length: %s chars", len(data['summary']))
+                    logger.debug("Found %s characters", len(data['character_creation']))
                     if data['character_creation']:
-                        print(f"DEBUG: Characters: {', '.join(list(data['character_creation'].keys()))}")
+                        logger.debug("Characters: %s", ', '.join(list(data['character_creation'].keys())))
                     end_time = time.time()
-                    print(f"DEBUG: Direct parsing succeeded in {end_time-start_time:.3f}s")
+                    logger.debug("Direct parsing succeeded in %.3fs", end_time-start_time)
                     return data
         except json.JSONDecodeError as json_err:
-            print(f"DEBUG: JSON is invalid, attempting repair. Error: {json_err}")
+            logger.debug("JSON is invalid, attempting repair. Error: %s", json_err)
             error_position = json_err.pos
             error_msg = str(json_err)
             surrounding_text = cleaned_text[max(0, error_position-30):min(len(cleaned_text), error_position+30)]
@@ -264,9 +545,23 @@ def process_summary_json(summary_text):
                 f"{surrounding_text[:min(30, error_position)]}^{surrounding_text[min(30, error_position):]}\n\n"
             )
         except Exception as e:
-            print(f"DEBUG: Error during direct parsing: {str(e)}")
+            logger.debug("Error during direct parsing: %s", e)
             error_details = f"Error during parsing: {str(e)}\n\n"
 
+        # Most malformed output (trailing commas, single quotes, unquoted keys,
+        # stray quotes, truncation) is fixed locally before paying for an LLM call.
+        try:
+            data = valid_summary_json(repair_json(summary_text))
+            if data is not None:
+                end_time = time.time()
+                logger.debug("Local JSON repair succeeded in %.3fs", end_time-start_time)
+                logger.debug("Found summary of length: %s chars", len(data['summary']))
+                logger.debug("Found %s characters", len(data['character_creation']))
+                return data
+            logger.debug("Local JSON repair did not produce a summary object")
+        except ValueError as repair_err:
+            logger.warning("Local JSON repair failed: %s", repair_err)
+
 
         global current_model
         global current_context_size
@@ -279,7 +574,7 @@ def process_summary_json(summary_text):
         while attempt < max_attempts:
             attempt += 1
             try:
-                print(f"DEBUG: LLM repair attempt {attempt}/{max_attempts}")
+                logger.debug("LLM repair attempt %s/%s", attempt, max_attempts)
                 
                 fix_prompt = [
                     {
@@ -341,107 +636,75 @@ def process_summary_json(summary_text):
                 if attempt > 1 and last_error:
                     fix_prompt[1]["content"] += f"\n\nPrevious attempt failed with error: {last_error}"
                 
-                print(f"DEBUG: Sending JSON repair request to model (attempt {attempt})")
-                response = ollama.chat(
-                    model=current_model,
-                    messages=fix_prompt,
-                    stream=False,
-                    options={"num_ctx": current_context_size}
-                )
+                logger.debug("Sending JSON repair request to model (attempt %s)", attempt)
+                fixed_json_text = cached_model_call(scheduler.REPAIR, fix_prompt)
                 
-                if hasattr(response, "message"):
-                    fixed_json_text = response.message.content
-                elif isinstance(response, dict):
-                    fixed_json_text = response.get("message", {}).get("content", "")
-                else:
-                    fixed_json_text = ""
+                logger.debug("Received fixed JSON of length: %s chars", len(fixed_json_text))
+                logger.debug("Fixed JSON preview: %s...", fixed_json_text[:100])
                 
-                print(f"DEBUG: Received fixed JSON of length: {len(fixed_json_text)} chars")
-                print(f"DEBUG: Fixed JSON preview: {fixed_json_text[:100]}...")
-                
-                cleaned_fixed_json = clean_text(fixed_json_text)
-                data = json.loads(cleaned_fixed_json)
+                data = repair_json(clean_text(fixed_json_text))
                 
                 if "summary" in data and "character_creation" in data:
                     if isinstance(data["summary"], str) and isinstance(data["character_creation"], dict):
                         end_time = time.time()
-                        print(f"DEBUG: Method 1 (LLM fix) SUCCEEDED on attempt {attempt} in {end_time-start_time:.3f}s")
-                        print(f"DEBUG: Found summary of length: {len(data['summary'])} chars")
-                        print(f"DEBUG: Found {len(data['character_creation'])} characters")
+                        logger.debug("Method 1 (LLM fix) SUCCEEDED on attempt %s in %.3fs", attempt, end_time-start_time)
+                        logger.debug("Found summary of length: %s chars", len(data['summary']))
+                        logger.debug("Found %s characters", len(data['character_creation']))
                         if data['character_creation']:
-                            print(f"DEBUG: Characters: {', '.join(list(data['character_creation'].keys()))}")
+                            logger.debug("Characters: %s", ', '.join(list(data['character_creation'].keys())))
+                        metrics.registry.observe("questdm_repair_attempts", attempt, model=current_model)
                         return data
                     else:
                         raise ValueError("Invalid data structure from LLM fix (wrong types)")
                 else:
                     raise ValueError("Missing required fields in LLM-fixed JSON")
                     
-            except json.JSONDecodeError as json_err:
-                print(f"DEBUG: Attempt {attempt} - JSON decode error: {json_err}")
+            except (json.JSONDecodeError, ValueError) as json_err:
+                logger.debug("Attempt %s - JSON decode error: %s", attempt, json_err)
                 last_error = f"JSON decode error: {json_err}"
                 if attempt == max_attempts:
-                    print(f"DEBUG: All {max_attempts} LLM repair attempts failed with JSON decode errors")
+                    logger.warning("All %s LLM repair attempts failed with JSON decode errors", max_attempts)
             except Exception as e:
-                print(f"DEBUG: Attempt {attempt} - Error: {str(e)}")
+                logger.debug("Attempt %s - Error: %s", attempt, e)
                 last_error = str(e)
                 if attempt == max_attempts:
-                    print(f"DEBUG: All {max_attempts} LLM repair attempts failed")
+                    logger.warning("All %s LLM repair attempts failed", max_attempts)
         
-        print(f"DEBUG: Method 1 (LLM fix) exhausted all {max_attempts} attempts")
+        logger.warning("Method 1 (LLM fix) exhausted all %s attempts", max_attempts)
+        metrics.registry.observe("questdm_repair_attempts", attempt, model=current_model)
         
     except Exception as e:
-        print(f"DEBUG: Method 1 (LLM fix) overall process failed: {str(e)}")
-        print(f"DEBUG: Traceback: {traceback.format_exc()}")
+        logger.warning("Method 1 (LLM fix) overall process failed: %s", e)
+        logger.debug("Traceback of the failure above", exc_info=True)
     
 
     try:
-        print("\nDEBUG: ATTEMPTING METHOD 2 - Regex extraction fallback")
+        logger.debug("ATTEMPTING METHOD 2 - Salvage from partially repaired JSON")
         start_time = time.time()
         result = default_result.copy()
-        cleaned_text = clean_text(summary_text)
-        
-        print("DEBUG: Extracting summary field...")
-        summary_pattern = r'"summary"\s*:\s*"((?:\\"|[^"])*)"'
-        summary_match = re.search(summary_pattern, cleaned_text, re.DOTALL)
-        if summary_match:
-            summary = summary_match.group(1)
-            
-            summary = summary.replace('\\"', '"').replace('\\\\', '\\')
+        result["character_creation"] = {}
+        try:
+            partial = repair_json(summary_text)
+        except ValueError:
+            partial = None
+        if not isinstance(partial, dict):
+            partial = {}
+
+        summary = partial.get("summary")
+        if isinstance(summary, str) and summary.strip():
             result["summary"] = summary
-            print(f"DEBUG: Successfully extracted summary ({len(summary)} chars)")
+            logger.debug("Salvaged summary (%s chars)", len(summary))
         else:
-     
-            print("DEBUG: Looking for any summary-like content...")
-            summary_lines = re.findall(r'summary.*?["\']([^"\']+)["\']', summary_text, re.IGNORECASE | re.DOTALL)
-            if summary_lines:
-                result["summary"] = summary_lines[0]
-                print(f"DEBUG: Found possible summary: {summary_lines[0][:50]}...")
-            else:
-      
-                fallback_summary = summary_text[:min(200, len(summary_text))]
-                if len(summary_text) > 200:
-                    fallback_summary += "..."
-                result["summary"] = fallback_summary
-                print(f"DEBUG: Using fallback summary: {fallback_summary[:50]}...")
-        
-        print("DEBUG: Extracting character_creation section...")
-        char_section_pattern = r'"character_creation"\s*:\s*{([\s\S]*?)}'
-        char_section_match = re.search(char_section_pattern, cleaned_text, re.DOTALL)
-        
-        if char_section_match:
-            char_section = char_section_match.group(1)
-            print(f"DEBUG: Found character_creation section ({len(char_section)} chars)")
-            
-            char_pattern = r'"([^"]+)"\s*:\s*{([^{}]*)(?:{[^{}]*}[^{}]*)*?}'
-            char_matches = list(re.finditer(char_pattern, char_section))
-            print(f"DEBUG: Found {len(char_matches)} potential character entries")
-            
-            for char_match in char_matches:
-                char_name = char_match.group(1).replace('\\', '').strip()
-                char_content = char_match.group(2)
-                
-                print(f"DEBUG: Processing character: {char_name}")
-                
+            fallback_summary = summary_text[:min(200, len(summary_text))]
+            if len(summary_text) > 200:
+                fallback_summary += "..."
+            result["summary"] = fallback_summary
+            logger.debug("Using fallback summary: %s...", fallback_summary[:50])
+
+        char_section = partial.get("character_creation")
+        if isinstance(char_section, dict):
+            for char_name, char in char_section.items():
+                logger.debug("Processing character: %s", char_name)
                 char_data = {
                     "name": char_name,
                     "race": "Unknown",
@@ -449,32 +712,27 @@ def process_summary_json(summary_text):
                     "backstory": "",
                     "status": ""
                 }
-                
-                for field in ["name", "race", "class", "backstory", "status"]:
-                    field_pattern = fr'"{field}"\s*:\s*"((?:\\"|[^"])*)"'
-                    field_match = re.search(field_pattern, char_content, re.DOTALL)
-                    if field_match:
-                        value = field_match.group(1).replace('\\"', '"').replace('\\\\', '\\')
-                        char_data[field] = value
-                        print(f"DEBUG:   - Found {field}: {value[:30]}..." if len(value) > 30 else f"DEBUG:   - Found {field}: {value}")
-                
+                if isinstance(char, dict):
+                    for field in ["name", "race", "class", "backstory", "status"]:
+                        if isinstance(char.get(field), str) and char[field]:
+                            char_data[field] = char[field]
                 result["character_creation"][char_name] = char_data
-            
-            print(f"DEBUG: Successfully extracted {len(result['character_creation'])} characters")
+
+            logger.debug("Successfully extracted %s characters", len(result['character_creation']))
         else:
-            print("DEBUG: Could not find character_creation section with regex")
+            logger.debug("Could not find a character_creation section")
             
   
-            print("DEBUG: Looking for character names in text...")
+            logger.debug("Looking for character names in text...")
             char_matches = re.findall(r'(?:name|character)["\'\s:]+([A-Z][a-zA-Z\s]+)', summary_text)
-            print(f"DEBUG: Found {len(char_matches)} potential character names")
+            logger.debug("Found %s potential character names", len(char_matches))
             
             for char_name in char_matches:
                 char_name = char_name.strip()
                 if not char_name:
                     continue
                 
-                print(f"DEBUG: Processing potential character: {char_name}")    
+                logger.debug("Processing potential character: %s", char_name)    
                 char_data = {
                     "name": char_name,
                     "race": "Unknown",
@@ -490,446 +748,863 @@ def process_summary_json(summary_text):
                     field_match = re.search(fr'{field}["\'\s:]+([A-Za-z]+)', char_vicinity, re.IGNORECASE)
                     if field_match:
                         char_data[field] = field_match.group(1)
-                        print(f"DEBUG:   - Found {field}: {field_match.group(1)}")
+                        logger.debug("- Found %s: %s", field, field_match.group(1))
                 
                 result["character_creation"][char_name] = char_data
         
         end_time = time.time()
-        print(f"DEBUG: Method 2 (regex extraction) completed in {end_time-start_time:.3f}s")
-        print(f"DEBUG: Created summary of length: {len(result['summary'])} chars")
-        print(f"DEBUG: Extracted {len(result['character_creation'])} characters")
+        logger.debug("Method 2 (salvage) completed in %.3fs", end_time-start_time)
+        logger.debug("Created summary of length: %s chars", len(result['summary']))
+        logger.debug("Extracted %s characters", len(result['character_creation']))
         if result['character_creation']:
-            print(f"DEBUG: Characters: {', '.join(list(result['character_creation'].keys()))}")
+            logger.debug("Characters: %s", ', '.join(list(result['character_creation'].keys())))
         
      
         return result
     except Exception as e:
-        print(f"DEBUG: Method 2 (regex extraction) failed: {str(e)}")
-        print(f"DEBUG: Traceback: {traceback.format_exc()}")
+        logger.warning("Method 2 (salvage) failed: %s", e)
+        logger.debug("Traceback of the failure above", exc_info=True)
     
 
-    print("\nDEBUG: ALL PARSING METHODS FAILED, using raw text fallback")
+    logger.warning("ALL PARSING METHODS FAILED, using raw text fallback")
     default_result["summary"] = summary_text[:min(200, len(summary_text))]
     if len(summary_text) > 200:
         default_result["summary"] += "..."
     
-    print("="*50)
-    print(f"DEBUG: Returning fallback summary: {default_result['summary'][:50]}...")
-    print("DEBUG: No characters extracted")
-    print("="*50 + "\n")
+    logger.debug("Returning fallback summary: %s...", default_result['summary'][:50])
+    logger.debug("No characters extracted")
     
     return default_result
 
-def summarize_and_save(story_name, threshold=None):
-    if threshold is None:
-        threshold = model_accuracy_threshold
-    
-    print(f"DEBUG: Starting summarization check for story '{story_name}'")
-    llm_conv = llm_conversations.get(story_name, [])
-    
+def merge_characters(existing, updates):
+    """
+    Merges characters returned by a summarization call into the known roster.
 
-    story = story_creation_table.get(StoryQuery.name == story_name)
-    if not story:
-        print(f"DEBUG: Story '{story_name}' not found in database")
-        return llm_conv
+    Existing characters are never dropped and keep any field the update
+    leaves empty, so the roster survives however many calls it passes through.
+    """
+    merged = dict(existing)
+    for char_name, char_info in (updates or {}).items():
+        if not isinstance(char_info, dict):
+            continue
+        updated = dict(merged.get(char_name) or {})
+        updated.update({key: value for key, value in char_info.items() if value})
+        merged[char_name] = updated
+    return merged
 
-    if len(llm_conv) < 3:
-        print("DEBUG: Not enough messages for summarization (< 3)")
-        return llm_conv
 
-    has_summary = (
-        len(llm_conv) > 3 and
-        llm_conv[3]["role"] == "assistant" and
-        "SUMMARY:" in llm_conv[3]["content"]
-    )
+def request_structured_summary(text, characters, character_budget):
+    """
+    Runs one summarization call constrained to SUMMARY_SCHEMA.
+
+    Returns:
+        dict or None: The summary JSON, or None if the output did not match the schema
+    """
+    summarization_prompt = construct_summary_prompt(text, {'characters': characters}, character_budget, structured=True)
+    logger.debug("Sending structured summarization request to model: %s", current_model)
+    new_summary = cached_model_call(scheduler.SUMMARIZATION, summarization_prompt, format=SUMMARY_SCHEMA)
+    logger.debug("Received structured summary response of length: %s", len(new_summary))
+    try:
+        return valid_summary_json(repair_json(new_summary))
+    except ValueError:
+        return None
+
+def request_summary(text, characters, character_budget):
+    """
+    Runs one summarization call and returns the parsed summary JSON. Models
+    that fail schema-constrained output fall back to prose plus JSON repair.
+    """
+    model = current_model
+    structured_error = None
+    if structured_summaries and model not in structured_output_unsupported:
+        try:
+            data = request_structured_summary(text, characters, character_budget)
+            if data is not None:
+                return data
+            logger.debug("Structured output from %s did not match the summary schema", model)
+            structured_output_unsupported.add(model)
+        except Exception as e:
+            logger.warning("Structured summarization failed for %s: %s", model, e)
+            structured_error = e
+
+    summarization_prompt = construct_summary_prompt(text, {'characters': characters}, character_budget)
     
-    print(f"DEBUG: Has existing summary: {has_summary}")
+    logger.debug("Sending summarization request to model: %s", model)
+    new_summary = cached_model_call(scheduler.SUMMARIZATION, summarization_prompt, model=model)
+    if structured_error is not None:
+        # The plain call worked, so it was the format parameter that failed.
+        logger.debug("Disabling structured summaries for %s", model)
+        structured_output_unsupported.add(model)
+
+    new_summary = new_summary or "Failed to generate summary."
     
-    if has_summary:
-
-        messages_after_summary = llm_conv[4:]
-        user_messages_after_summary = [msg for msg in messages_after_summary if msg["role"] == "user"]
-        
-        print(f"DEBUG: Messages since last summary: {len(messages_after_summary)}")
-        print(f"DEBUG: User messages since last summary: {len(user_messages_after_summary)}")
-        
+    logger.debug("Received raw summary response of length: %s", len(new_summary))
+    
+    return process_summary_json(new_summary)
 
-        if len(user_messages_after_summary) < threshold:
-            print(f"DEBUG: Not enough new messages for re-summarization ({len(user_messages_after_summary)} < {threshold})")
-            return llm_conv
 
-        print(f"DEBUG: Threshold reached, re-summarizing {len(user_messages_after_summary)} new user messages")
+def summarize_hierarchically(pieces, story):
+    """
+    Summarizes a transcript of any length without exceeding the summarizer's input cap.
 
-        existing_summary = llm_conv[3]["content"].replace("SUMMARY:", "", 1).strip()
-        
+    The transcript pieces (messages, and the previous summary if any) are
+    packed into chunks that fit the cap and summarized in order, carrying
+    the character roster forward from chunk to chunk. If that yields more
+    than one summary, the chunk summaries are merged level by level the same
+    way until a single summary remains.
 
-        new_content = "\n\n".join(
-            f"{msg['role'].upper()}: {msg['content']}" for msg in messages_after_summary
-        )
-        
+    Args:
+        pieces (list): Transcript pieces, oldest first
+        story (dict): The story, for its current characters
 
-        conversation_text = f"PREVIOUS SUMMARY: {existing_summary}\n\n{new_content}"
-    else:
+    Returns:
+        dict: ``summary`` text and the merged ``character_creation`` roster
+    """
+    cap = summary_input_cap()
+    character_budget = cap // 4
+    prompt_overhead = count_tokens(construct_summary_prompt("", None))
+    chunk_budget = max(128, cap - prompt_overhead - character_budget - 32)
+    summary_tokens = chunk_budget // 4
+    summary_words = max(50, int(summary_tokens / 1.3))
+    characters = normalize_characters(story.get('characters', {}))
+
+    level = 0
+    while True:
+        batches = pack_pieces(pieces, chunk_budget)
+        logger.debug("Summarization level %s: %s pieces in %s chunks", level, len(pieces), len(batches))
+        summaries = []
+        for batch in batches:
+            if level > 0 and len(batch) == 1:
+                summaries.append(batch[0])
+                continue
+            if level == 0:
+                text = "\n\n".join(batch)
+            else:
+                text = (
+                    "The following are consecutive partial summaries of the story, oldest first. "
+                    "Merge them into one summary.\n\n" + "\n\n".join(batch)
+                )
+            text += f"\n\nKeep the summary under {summary_words} words."
+            result = request_summary(text, characters, character_budget)
+            characters = merge_characters(characters, result.get("character_creation"))
+            summaries.append(truncate_text(result.get("summary", ""), summary_tokens))
+
+        level += 1
+        if len(summaries) == 1:
+            return {"summary": summaries[0], "character_creation": characters}
+        if level >= summary_max_levels:
+            logger.debug("Reached %s summarization levels, truncating the remainder", summary_max_levels)
+            merged = truncate_text(" ".join(summaries), summary_tokens)
+            return {"summary": merged, "character_creation": characters}
+        pieces = summaries
+
+
+def summarize_and_save(story_name, threshold=None, llm_conv=None):
+    """
+    Summarizes a snapshot of a story's LLM memory.
 
-        messages_to_summarize = llm_conv[3:]
-        user_messages_to_summarize = [msg for msg in messages_to_summarize if msg["role"] == "user"]
-        
-        print(f"DEBUG: Total non-system messages: {len(messages_to_summarize)}")
-        print(f"DEBUG: User messages: {len(user_messages_to_summarize)}")
-        
+    Runs on the summarizer worker, so it never touches the in-memory
+    conversations; the result is swapped in by apply_pending_summary().
 
-        if len(user_messages_to_summarize) < threshold:
-            print(f"DEBUG: Not enough messages for first summarization ({len(user_messages_to_summarize)} < {threshold})")
-            return llm_conv
-            
- 
-        print(f"DEBUG: Threshold reached, creating first summary for {len(user_messages_to_summarize)} user messages")
-        
+    Args:
+        story_name (str): Name of the story to summarize
+        threshold (int, optional): Number of recent messages to keep verbatim
+        llm_conv (list, optional): Snapshot of the LLM memory to summarize
 
-        conversation_text = "\n\n".join(
-            f"{msg['role'].upper()}: {msg['content']}" for msg in messages_to_summarize
-        )
+    Returns:
+        dict: The new ``llm_memory`` plus the story fields to persist, or None
+        when there is nothing to summarize yet
+    """
+    if threshold is None:
+        threshold = model_accuracy_threshold
     
-
-    print(f"DEBUG: Constructing summary prompt with conversation text of length: {len(conversation_text)}")
-    summarization_prompt = construct_summary_prompt(conversation_text, story)
+    logger.debug("Starting summarization check for story '%s'", story_name)
+    if llm_conv is None:
+        llm_conv = list(llm_conversations.get(story_name, []))
     
-    print(f"DEBUG: Sending summarization request to model: {current_model}")
-    response = ollama.chat(
-        model=current_model,
-        messages=summarization_prompt,
-        stream=False,
-        options={"num_ctx": current_context_size}
+
+    story_doc = story_index.get(story_name)
+    if not story_doc:
+        logger.debug("Story '%s' not found in database", story_name)
+        return None
+    story = turn_log.materialize(story_doc)
+
+    if len(llm_conv) < 3:
+        logger.debug("Not enough messages for summarization (< 3)")
+        return None
+
+    pinned = pinned_prefix_length(llm_conv)
+    has_summary = pinned == 4
+    messages_to_summarize = llm_conv[pinned:]
+    recent_messages = select_recent(
+        messages_to_summarize,
+        int(prompt_token_budget() * summary_keep_ratio),
+        max_count=threshold
     )
     
+    logger.debug("Has existing summary: %s", has_summary)
+    logger.debug("Messages since last summary: %s, keeping %s verbatim", len(messages_to_summarize), len(recent_messages))
 
-    if hasattr(response, "message"):
-        new_summary = response.message.content
-    elif isinstance(response, dict):
-        new_summary = response.get("message", {}).get("content", "")
-    else:
-        new_summary = "Failed to generate summary."
-    
-    print(f"DEBUG: Received raw summary response of length: {len(new_summary)}")
+    if len(recent_messages) >= len(messages_to_summarize):
+        logger.debug("Nothing would be compressed, skipping summarization")
+        return None
+
+    summary_pieces = [f"{msg['role'].upper()}: {msg['content']}" for msg in messages_to_summarize]
+    if has_summary:
+        existing_summary = llm_conv[3]["content"].replace("SUMMARY:", "", 1).strip()
+        summary_pieces.insert(0, f"PREVIOUS SUMMARY: {existing_summary}")
     
 
-    processed_summary = process_summary_json(new_summary)
+    started = time.perf_counter()
+    processed_summary = summarize_hierarchically(summary_pieces, story)
+    metrics.registry.observe(
+        "questdm_summarization_seconds", time.perf_counter() - started,
+        model=current_model, story=story_doc.doc_id
+    )
     summary_text = processed_summary.get("summary", "")
     
-    print(f"DEBUG: Extracted summary text of length: {len(summary_text)}")
+    logger.debug("Extracted summary text of length: %s", len(summary_text))
 
     summary_message = {"role": "assistant", "content": f"SUMMARY: {summary_text}"}
     
 
-    recent_messages_to_keep = threshold
+    new_llm_conv = llm_conv[:3] + [summary_message] + recent_messages
     
-
-    new_llm_conv = llm_conv[:3] + [summary_message]
+    logger.debug("New conversation structure: %s messages total", len(new_llm_conv))
+    logger.debug("- System prompts: 3 messages")
+    logger.debug("- Summary: 1 message")
+    logger.debug("- Recent messages: %s messages", len(new_llm_conv) - 4)
     
 
-    if has_summary:
+    summary_fields = {
+        "current_summary": json.dumps(processed_summary)
+    }
+    if 'character_creation' in processed_summary and processed_summary['character_creation']:
+        logger.debug("Updating story with %s characters", len(processed_summary['character_creation']))
+        summary_fields['characters'] = processed_summary['character_creation']
 
-        if len(llm_conv) > 4 + recent_messages_to_keep:
+    return {"llm_memory": new_llm_conv, "fields": summary_fields}
 
-            new_llm_conv += llm_conv[-(recent_messages_to_keep):]
-            print(f"DEBUG: Keeping {recent_messages_to_keep} most recent messages in the new conversation")
-        else:
 
-            new_llm_conv += llm_conv[4:]
-            print(f"DEBUG: Keeping all {len(llm_conv) - 4} messages after the existing summary")
-    else:
+def schedule_summary(story_name, threshold=None):
+    """
+    Starts a background summarization of the story's current LLM memory,
+    unless one is already queued or running for that story.
+    """
+    with summary_lock:
+        if story_name in summary_jobs:
+            return
+        source = llm_conversations[story_name]
+        snapshot = list(source)
+        summary_jobs[story_name] = {
+            "future": summary_executor.submit(summarize_and_save, story_name, threshold, snapshot),
+            "source": source,
+            "covered": len(snapshot)
+        }
+        logger.debug("Scheduled background summarization for '%s' (%s messages)", story_name, len(snapshot))
 
-        if len(llm_conv) > 3 + recent_messages_to_keep:
 
-            new_llm_conv += llm_conv[-(recent_messages_to_keep):]
-            print(f"DEBUG: Keeping {recent_messages_to_keep} most recent messages for first summary")
-        else:
+def apply_pending_summary(story_name, doc_id):
+    """
+    Swaps a finished background summary into ``llm_conversations``.
 
-            new_llm_conv += llm_conv[3:]
-            print(f"DEBUG: Keeping all {len(llm_conv) - 3} messages after system prompts for first summary")
-    
-    print(f"DEBUG: New conversation structure: {len(new_llm_conv)} messages total")
-    print(f"DEBUG: - System prompts: 3 messages")
-    print(f"DEBUG: - Summary: 1 message")
-    print(f"DEBUG: - Recent messages: {len(new_llm_conv) - 4} messages")
-    
+    Called at a turn boundary. Messages appended after the snapshot was taken
+    are carried over behind the new summary.
 
-    if 'character_creation' in processed_summary and processed_summary['character_creation']:
-        print(f"DEBUG: Updating story with {len(processed_summary['character_creation'])} characters")
-        
+    Returns:
+        bool: True if the story's memory was replaced
+    """
+    with summary_lock:
+        job = summary_jobs.get(story_name)
+        if job is None or not job["future"].done():
+            return False
+        del summary_jobs[story_name]
 
-        story_creation_table.update(
-            {'characters': processed_summary['character_creation']},
-            StoryQuery.name == story_name
-        )
-    
+    try:
+        result = job["future"].result()
+    except Exception as e:
+        logger.warning("Background summarization failed for '%s': %s", story_name, e)
+        return False
+    if not result:
+        return False
+
+    current = llm_conversations.get(story_name)
+    if current is not job["source"]:
+        logger.debug("Discarding stale summary for '%s', memory was reloaded meanwhile", story_name)
+        return False
+
+    new_llm_conv = result["llm_memory"] + current[job["covered"]:]
+    llm_conversations[story_name] = new_llm_conv
+    turn_log.set(doc_id, llm_memory=new_llm_conv, **result["fields"])
+    if "characters" in result["fields"]:
+        prompt_renderer.bump(doc_id)
+        character_templates.track(doc_id, result["fields"]["characters"])
+    logger.debug("Summary applied, new conversation length: %s", len(new_llm_conv))
+    return True
+
+DISPLAY_ROLES = {"assistant": "DM", "user": "You"}
+
+def display_page(conversation, before=None, limit=None):
+    """
+    Returns one page of a conversation history in display form, newest page first.
 
-    story_creation_table.update(
-        {
-            "conversation_history": conversations.get(story_name, []),
-            "llm_memory": new_llm_conv,
-            "current_summary": json.dumps(processed_summary)
-        },
-        StoryQuery.name == story_name
+    Walks backwards from ``before`` and maps roles only for the messages that
+    end up on the page, so opening a long campaign never touches the rest of
+    its history.
+
+    Args:
+        conversation (list): The story's conversation_history
+        before (int, optional): History index to page back from (exclusive)
+        limit (int, optional): Maximum number of display messages
+
+    Returns:
+        tuple: (messages in chronological order, cursor for the previous page or None)
+    """
+    limit = limit or history_page_size
+    index = len(conversation) if before is None else max(0, min(before, len(conversation)))
+    page = []
+    while index > 0 and len(page) < limit:
+        index -= 1
+        msg = conversation[index]
+        role = DISPLAY_ROLES.get(msg.get("role"))
+        if role:
+            entry = {"role": role, "content": msg.get("content", "")}
+            if msg.get("interrupted"):
+                entry["interrupted"] = True
+            page.append(entry)
+    page.reverse()
+
+    cursor = None
+    for earlier in range(index - 1, -1, -1):
+        if conversation[earlier].get("role") in DISPLAY_ROLES:
+            cursor = index
+            break
+    return page, cursor
+
+
+def frame_coalescer(data):
+    """Builds the SSE coalescer for one /chat request, clamping client-supplied settings."""
+    def setting(name, default, upper):
+        try:
+            value = int(data.get(name, default))
+        except (TypeError, ValueError):
+            return default
+        return min(max(value, 0), upper)
+
+    return FrameCoalescer(
+        flush_ms=setting('flush_ms', sse_flush_ms, MAX_SSE_FLUSH_MS),
+        flush_bytes=max(1, setting('flush_bytes', sse_flush_bytes, MAX_SSE_FLUSH_BYTES))
     )
-    
-    return new_llm_conv
-
-def transform_conversation_for_display(conversation):
-    transformed = []
-    for msg in conversation:
-        if msg["role"] == "assistant":
-            new_msg = msg.copy()
-            new_msg["role"] = "DM"
-            transformed.append(new_msg)
-        elif msg["role"] == "user":
-            new_msg = msg.copy()
-            new_msg["role"] = "You"
-            transformed.append(new_msg)
-    return transformed
 
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    data = request.get_json()
-    story_name = data.get('story_name')
-    user_input = data.get('message')
-    
-    story = story_creation_table.get(StoryQuery.name == story_name)
-    if not story:
-        return jsonify({'error': f"Story '{story_name}' not found."}), 404
-    
-    if story['mode'] == 'dnd':
-        initial_prompt = dnd_mode_prompt
-    elif story['mode'] == 'novel':
-        initial_prompt = novel_mode_prompt
-    else:
-        return jsonify({'error': 'Invalid story mode.'}), 400
-    
-    if not user_input:
-        return jsonify({'error': 'No message provided.'}), 400
-    
-    story_details_prompt = {
-        "role": "system",
-        "content": (
-            f"Story Details:\n"
-            f"Name: {story.get('name', 'Unknown')}\n"
-            f"Description: {story.get('description', 'No description')}\n"
-            f"Genre: {story.get('genre', 'N/A')}\n"
-        )
-    }
-    
+class ChatTurn:
+    """
+    One chat turn between prepare_turn() and finish_turn(). Both /chat
+    routes pass the stream through ``feed()``, which returns the reasoning
+    and answer text to show for each chunk.
+    """
 
-    characters = story.get("characters", {})
-    if isinstance(characters, list):
-        char_dict = {}
-        for char in characters:
-            if isinstance(char, dict) and 'name' in char:
-                char_dict[char['name']] = char
-        characters = char_dict
-    
-    character_details = "Story Characters:\n"
-    for char_name, char in characters.items():
-        if isinstance(char, dict):
-            details = f"{char.get('name', 'Unknown')} (Race: {char.get('race', 'Unknown')}, Class: {char.get('class', 'Unknown')})\n"
-            if char.get('backstory'):
-                details += f"Backstory: {char.get('backstory')}\n"
-            if char.get('status'):
-                details += f"Status: {char.get('status')}\n"
-            
+    def __init__(self, story_name, doc_id, context_window, window_tokens, model, options, release, keep_alive=None):
+        self.story_name = story_name
+        self.doc_id = doc_id
+        self.context_window = context_window
+        self.window_tokens = window_tokens
+        self.model = model
+        self.options = options
+        self.keep_alive = keep_alive
+        self.release = release
+        self.ticket = None
+        self.stats = None
+        self.aborted = False
+        self.cancelled = threading.Event()
+        self.started_at = None
+        self.first_token_at = None
+        self._cancel_callbacks = []
+        self._chunks = []
+        self._answer = []
+        self._splitter = ThinkTagSplitter()
+
+    @property
+    def response(self):
+        """The raw reply streamed so far, reasoning tags included."""
+        return "".join(self._chunks)
+
+    def memory_text(self):
+        """The reply as it goes into llm_memory; see keep_reasoning_in_memory."""
+        answer = "".join(self._answer).strip()
+        if keep_reasoning_in_memory or not answer:
+            return self.response
+        return answer
+
+    def feed(self, chunk):
+        """
+        Takes one streamed chunk and returns (event, text) pairs to send for
+        it: event is "reasoning" for thought and None for the answer.
+        """
+        content = chunk.get("message", {}).get("content", "")
+        parts = []
+        if content:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self._chunks.append(content)
+            parts = self._splitter.feed(content)
+        if chunk.get("done"):
+            self.stats = turn_stats_from_chunk(chunk, self.window_tokens)
+            parts += self._splitter.finish()
+
+        pieces = []
+        for kind, text in parts:
+            if kind == REASONING:
+                pieces.append((REASONING, text))
+            else:
+                self._answer.append(text)
+                pieces.append((None, text))
+        return pieces
+
+    def cancel(self):
+        """Asks the route streaming this turn to stop and close its model stream."""
+        self.cancelled.set()
+        for callback in self._cancel_callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Registers a function to call when the turn is cancelled (runs now if it already was)."""
+        self._cancel_callbacks.append(callback)
+        if self.cancelled.is_set():
+            callback()
+
+    @property
+    def interrupted(self):
+        """True if the reply ended before the model finished it."""
+        return self.stats is None
+
+    def record_metrics(self):
+        labels = {"model": self.model, "story": self.doc_id}
+        if self.started_at is not None and self.first_token_at is not None:
+            metrics.registry.observe("questdm_time_to_first_token_seconds", self.first_token_at - self.started_at, **labels)
+        if self.stats and not self.aborted:
+            if self.stats["tokens_per_second"]:
+                metrics.registry.observe("questdm_tokens_per_second", self.stats["tokens_per_second"], **labels)
+            metrics.registry.observe("questdm_prompt_eval_tokens", self.stats["prompt_eval_count"], **labels)
+
+    def interrupted_frame(self):
+        return sse_frame({'content': '', 'interrupted': True})
+
+    def stats_frame(self):
+        return sse_frame({'content': '', 'stats': self.stats})
+
+    def queue_frame(self):
+        return sse_frame({'content': '', 'queue_position': self.ticket.position()})
+
+    def close(self):
+        """Gives back the turn's model slot and story lock; safe to call repeatedly."""
+        if active_turns.get(self.story_name) is self:
+            del active_turns[self.story_name]
+        self.ticket.release()
+        self.release()
+
+
+def prepare_turn(story_name, user_input):
+    """
+    Starts a chat turn: takes the story lock, queues the model call, appends
+    the player's message and assembles the context window.
 
-            advanced_info = []
-            for key, value in char.items():
-                if key not in ['name', 'race', 'class', 'backstory', 'status', 'template_origin'] and value:
-                    advanced_info.append(f"{key}: {value}")
-            if advanced_info:
-                details += "Advanced: " + ", ".join(advanced_info) + "\n"
-            
-            character_details += details + "\n"
+    The model call is queued only once the story lock is held, so a turn
+    that got a slot never waits on a lock held by a turn still queued behind
+    it. A full queue turns the request away before anything is written.
+
+    Returns:
+        tuple: (ChatTurn, None) on success, or (None, (error payload, status code)).
+        The caller must hand a returned turn to finish_turn(), or at least call
+        its ``close()``.
+    """
+    if not user_input:
+        return None, ({'error': 'No message provided.'}, 400)
+
+    story_doc = story_index.get(story_name)
+    if not story_doc:
+        return None, ({'error': f"Story '{story_name}' not found."}, 404)
+
+    # Turns of one story run one at a time; the lock is held until the reply
+    # has been persisted by finish_turn().
+    release_turn = story_locks.acquire(story_doc.doc_id, timeout=story_busy_timeout)
+    if release_turn is None:
+        return None, ({'error': f"A turn of story '{story_name}' is still running."}, 409)
+    ticket = None
+    try:
+        story_doc = story_creation_table.get(doc_id=story_doc.doc_id)
+        if not story_doc:
+            release_turn()
+            return None, ({'error': f"Story '{story_name}' not found."}, 404)
+        ticket = model_scheduler.submit(scheduler.INTERACTIVE)
+        with metrics.labels(model=current_model, story=story_doc.doc_id):
+            turn, error = start_turn(story_name, story_doc, user_input)
+    except QueueFull as e:
+        release_turn()
+        return None, ({'error': 'The model is busy, please try again shortly.', 'queued': e.queued}, 429)
+    except BaseException:
+        if ticket:
+            ticket.release()
+        release_turn()
+        raise
+    if error:
+        ticket.release()
+        release_turn()
+        return None, error
+    turn.ticket = ticket
+    turn.release = release_turn
+    active_turns[story_name] = turn
+    return turn, None
+
+def start_turn(story_name, story_doc, user_input):
+    """Appends the player's message and builds the turn (caller holds the story lock)."""
+    story = turn_log.materialize(story_doc)
+
+    if apply_pending_summary(story_name, story_doc.doc_id):
+        story = turn_log.materialize(story_doc)
     
-    character_prompt = {
-        "role": "system",
-        "content": character_details
-    }
+    initial_prompt, story_details_prompt, character_prompt = prompt_renderer.render(story_doc.doc_id, story)
+    if initial_prompt is None:
+        return None, ({'error': 'Invalid story mode.'}, 400)
     
 
     if story_name in llm_conversations and llm_conversations[story_name]:
 
-        llm_conversations[story_name][1] = story_details_prompt
-        llm_conversations[story_name][2] = character_prompt
-        print(f"DEBUG: Using existing in-memory conversation for story '{story_name}'")
+        refresh_prompt_prefix(llm_conversations[story_name], (initial_prompt, story_details_prompt, character_prompt))
+        logger.debug("Using existing in-memory conversation for story '%s'", story_name)
     else:
 
-        print(f"DEBUG: Loading conversation for story '{story_name}' from database")
+        logger.debug("Loading conversation for story '%s' from database", story_name)
         saved_llm_memory = story.get("llm_memory", [])
         if saved_llm_memory and len(saved_llm_memory) >= 3:
-            llm_conversations[story_name] = saved_llm_memory
-
-            llm_conversations[story_name][0] = initial_prompt
-            llm_conversations[story_name][1] = story_details_prompt
-            llm_conversations[story_name][2] = character_prompt
+            llm_conversations[story_name] = list(saved_llm_memory)
+            refresh_prompt_prefix(llm_conversations[story_name], (initial_prompt, story_details_prompt, character_prompt))
         else:
 
             llm_conversations[story_name] = [initial_prompt, story_details_prompt, character_prompt]
+            turn_log.set(story_doc.doc_id, llm_memory=llm_conversations[story_name])
     
 
     if story_name not in conversations:
-        conversations[story_name] = story.get("conversation_history", [])
+        conversations[story_name] = list(story.get("conversation_history", []))
         if not conversations[story_name]:
             conversations[story_name] = [initial_prompt, story_details_prompt, character_prompt]
+            turn_log.set(story_doc.doc_id, conversation_history=conversations[story_name])
     
 
     user_message = {"role": "user", "content": user_input}
     conversations[story_name].append(user_message)
     llm_conversations[story_name].append(user_message)
+    turn_log.append(story_doc.doc_id, "conversation_history", user_message)
+    turn_log.append(story_doc.doc_id, "llm_memory", user_message)
+    turn_time = time.time()
+    turn_log.set(story_doc.doc_id, last_activity=turn_time)
+    story_listing.touch(story_doc.doc_id, turn_time)
     
 
-    should_summarize = False
-    if len(llm_conversations[story_name]) >= 3:
-  
-        has_summary = (
-            len(llm_conversations[story_name]) > 3 and
-            llm_conversations[story_name][3]["role"] == "assistant" and
-            "SUMMARY:" in llm_conversations[story_name][3]["content"]
-        )
-        
-        if has_summary:
-            messages_after_summary = llm_conversations[story_name][4:]
-            user_messages = [msg for msg in messages_after_summary if msg["role"] == "user"]
-            should_summarize = len(user_messages) >= model_accuracy_threshold
-            
-            print(f"DEBUG: Found existing summary sandwich structure")
-            print(f"DEBUG: User messages since last summary: {len(user_messages)}/{model_accuracy_threshold}")
-        else:
+    prompt_budget = prompt_token_budget()
+    memory = llm_conversations[story_name]
+    previous_window = context_windows.get(story_name)
+    previous_start = previous_window[1] if previous_window and previous_window[0] is memory else None
+    context_window, window_tokens, memory_tokens, window_start = assemble_context(memory, prompt_budget, previous_start)
+    context_windows[story_name] = (memory, window_start)
 
-            messages_after_system = llm_conversations[story_name][3:]
-            user_messages = [msg for msg in messages_after_system if msg["role"] == "user"]
-            should_summarize = len(user_messages) >= model_accuracy_threshold
-            
-            print(f"DEBUG: No existing summary found")
-            print(f"DEBUG: Total user messages: {len(user_messages)}/{model_accuracy_threshold}")
-        
-        print(f"DEBUG: Should summarize: {should_summarize}")
-    
+    # Compress one exchange ahead of the budget so the summary is usually
+    # ready before the window actually has to start dropping messages.
+    expected_growth = count_tokens(llm_conversations[story_name][-2:])
+    should_summarize = memory_tokens + expected_growth > prompt_budget
+    logger.debug("Prompt tokens: %s in window, %s in memory, budget %s", window_tokens, memory_tokens, prompt_budget)
+    logger.debug("Should summarize: %s", should_summarize)
 
     if should_summarize:
-        print("DEBUG: Threshold reached, summarizing before generating response")
-        updated_conv = summarize_and_save(story_name)
-        
+        logger.debug("Token budget approaching, summarizing in the background")
+        schedule_summary(story_name)
     
-        if updated_conv:
-            llm_conversations[story_name] = updated_conv
-            print(f"DEBUG: Summarization complete, new conversation length: {len(llm_conversations[story_name])}")
+    return ChatTurn(
+        story_name, story_doc.doc_id, context_window, window_tokens,
+        current_model, {"num_ctx": current_context_size}, None,
+        keep_alive=story_keep_alive(story)
+    ), None
+
+def story_keep_alive(story):
+    """The story's own keep_alive policy, or default_keep_alive if it has none."""
+    keep_alive = story.get('keep_alive')
+    return default_keep_alive if keep_alive is None else keep_alive
+
+def finish_turn(turn):
+    """Persists the reply of a turn and releases its story lock."""
+    story_name = turn.story_name
+    try:
+        turn.record_metrics()
+        if turn.stats and not turn.aborted:
+            last_turn_stats[story_name] = turn.stats
+            logger.info("Turn finished", extra={"story": story_name, "model": turn.model, **turn.stats})
+        if turn.response:
+            logger.debug("Saving response for story: %s", story_name)
+            assistant_msg = {"role": "assistant", "content": turn.response}
+            if turn.interrupted:
+                # Kept so the player sees the reply was cut short; the model's
+                # memory gets the plain text.
+                assistant_msg["interrupted"] = True
+            memory_msg = {"role": "assistant", "content": turn.memory_text()}
+            conversations[story_name].append(assistant_msg)
+            llm_conversations[story_name].append(memory_msg)
             
-   
-            story_creation_table.update(
-                {
-                    "llm_memory": llm_conversations[story_name]
-                },
-                StoryQuery.name == story_name
-            )
-        else:
-            print("DEBUG: Summarization failed or returned empty conversation")
-        
-        print("DEBUG: Proceeding with response generation")
-    
+            with metrics.labels(model=turn.model):
+                turn_log.append(turn.doc_id, "conversation_history", assistant_msg)
+                turn_log.append(turn.doc_id, "llm_memory", memory_msg)
+    finally:
+        turn.close()
+    logger.debug("Stream complete for story: %s", story_name)
+
+
+@app.before_request
+def trace_request_start():
+    if trace_recorder and request.path in TRACED_ROUTES:
+        g.trace_started = time.perf_counter()
+
+@app.after_request
+def trace_request(response):
+    started = g.pop('trace_started', None)
+    if started is None:
+        return response
+    record = (
+        request.method, request.path, request.args.to_dict(),
+        request.get_json(silent=True), response.status_code, started
+    )
+    if response.is_streamed:
+        # A streamed reply is timed until its last frame is sent.
+        response.call_on_close(lambda: trace_recorder.http(*record))
+    else:
+        trace_recorder.http(*record)
+    return response
+
+
+# Building an SSL context takes tens of milliseconds; the per-turn clients share one.
+ollama_ssl_context = httpx.create_ssl_context()
+
+def turn_client():
+    """
+    Returns an Ollama client for one streamed turn and a function that shuts
+    its connection down. Unlike closing the stream, that also wakes a read
+    still waiting for the first chunk, so Ollama drops the prompt eval too.
+    """
+    sockets = []
+    hung_up = threading.Event()
+
+    def hang_up():
+        hung_up.set()
+        for sock in list(sockets):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def trace(event, info):
+        # httpcore's trace extension hands over each new connection.
+        if event == "connection.connect_tcp.complete":
+            sockets.append(info["return_value"].get_extra_info("socket"))
+            if hung_up.is_set():
+                hang_up()
+
+    def on_request(request):
+        request.extensions["trace"] = trace
+
+    return ollama.Client(verify=ollama_ssl_context, event_hooks={"request": [on_request]}), hang_up
+
+
+    return ollama.Client(event_hooks={"request": [on_request]}), hang_up
+
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    data = request.get_json()
+    turn, error = prepare_turn(data.get('story_name'), data.get('message'))
+    coalescer = frame_coalescer(data)
+    if error:
+        headers = {'Retry-After': '5'} if error[1] in (409, 429) else {}
+        return jsonify(error[0]), error[1], headers
+    # Under waitress (with channel_request_lookahead) this notices a closed
+    # connection between chunks instead of only on the next write.
+    waitress_disconnected = request.environ.get('waitress.client_disconnected')
+    client_disconnected = waitress_disconnected or (lambda: False)
+
+    def stopped():
+        if client_disconnected():
+            turn.aborted = True
+        return turn.aborted or turn.cancelled.is_set()
+
     def generate():
-        print("DEBUG: Starting stream for story:", story_name)
-        stream = ollama.chat(
-            model=current_model,
-            messages=llm_conversations[story_name],
-            stream=True,
-            options={"num_ctx": current_context_size}
-        )
-        
-        response_accumulated = ""
-        inside_think = False
-        think_buffer = ""
-        aborted = False
-        
+        logger.debug("Starting stream for story: %s", turn.story_name)
+        stream = None
+        client, hang_up = turn_client()
+        # /chat/cancel runs on another worker thread.
+        turn.on_cancel(hang_up)
+        done = threading.Event()
+
+        def watch_disconnect():
+            # stopped() only runs between chunks; this also covers the wait
+            # for the first one.
+            while not done.wait(disconnect_poll_interval):
+                if client_disconnected():
+                    turn.aborted = True
+                    hang_up()
+                    return
+
         try:
-            for chunk in stream:
-                content = chunk.get("message", {}).get("content", "")
-                if content:
-                    response_accumulated += content
-                
-                if content.lstrip().startswith("<think>"):
-                    inside_think = True
-                    think_buffer = content
-                    continue
-                
-                if inside_think:
-                    think_buffer += content
-                    if "</think>" in content:
-                        inside_think = False
-                        extracted_think = re.search(r"<think>(.*?)</think>", think_buffer, re.DOTALL)
-                        if extracted_think:
-                            for i in range(0, len(extracted_think.group(1)), 50):
-                                try:
-                                    yield f"data: {json.dumps({'content': extracted_think.group(1)[i:i+50]})}\n\n"
-                                except GeneratorExit:
-                                    print("DEBUG: Client aborted during <think> chunk.")
-                                    aborted = True
-                                    break
-                            if aborted:
-                                break
-                        think_buffer = ""
-                    continue
-                
-                try:
-                    yield f"data: {json.dumps({'content': content})}\n\n"
-                except GeneratorExit:
-                    print("DEBUG: Client aborted during regular chunk.")
-                    aborted = True
-                    break
+            while not turn.ticket.granted:
+                if stopped():
+                    return
+                yield turn.queue_frame()
+                turn.ticket.wait(queue_poll_interval)
+            if waitress_disconnected is not None:
+                threading.Thread(target=watch_disconnect, name="chat-disconnect", daemon=True).start()
+            turn.started_at = time.perf_counter()
+            try:
+                stream = client.chat(
+                    model=turn.model,
+                    messages=turn.context_window,
+                    stream=True,
+                    options=turn.options,
+                    keep_alive=turn.keep_alive
+                )
+                if trace_recorder:
+                    stream = trace_recorder.record_stream(stream, turn.model, turn.context_window, turn.options)
+                for chunk in stream:
+                    if stopped():
+                        logger.debug("Turn cancelled; closing the model stream for story: %s", turn.story_name)
+                        break
+                    for event, text in turn.feed(chunk):
+                        yield from coalescer.add(text, event)
+            except Exception:
+                # hang_up() makes the pending read fail.
+                if not stopped():
+                    raise
+            yield from coalescer.flush()
+            if turn.stats:
+                yield turn.stats_frame()
+            elif turn.cancelled.is_set():
+                yield turn.interrupted_frame()
         except GeneratorExit:
-            print("DEBUG: GeneratorExit caught; client disconnected.")
-            aborted = True
+            logger.debug("GeneratorExit caught; client disconnected.")
+            turn.aborted = True
         except Exception as e:
-            print("DEBUG: Exception in stream generator:", e)
+            logger.warning("Exception in stream generator: %s", e)
         finally:
-            if response_accumulated:
-                print("DEBUG: Saving response for story:", story_name)
-                assistant_msg = {"role": "assistant", "content": response_accumulated}
-                conversations[story_name].append(assistant_msg)
-                llm_conversations[story_name].append(assistant_msg)
-                
+            done.set()
+            # Closing the stream and the client ends the HTTP response, which
+            # is what makes Ollama stop generating.
+            if hasattr(stream, "close"):
+                stream.close()
+            client.close()
+            finish_turn(turn)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    # Releases the story if the client goes away before the stream starts.
+    response.call_on_close(turn.close)
+    return response
+
+
+@app.route('/chat/cancel', methods=['POST'])
+def cancel_chat():
+    """Stops the running turn of a story; its partial reply is kept, marked interrupted."""
+    data = request.get_json()
+    story_name = (data or {}).get('story_name')
+    turn = active_turns.get(story_name)
+    if turn is None:
+        return jsonify({'error': f"No turn of story '{story_name}' is running."}), 404
+    turn.cancel()
+    return jsonify({'message': f"Turn of story '{story_name}' cancelled.", 'cancelled': True})
 
-                story_creation_table.update(
-                    {
-                        "conversation_history": conversations[story_name],
-                        "llm_memory": llm_conversations[story_name]
-                    },
-                    StoryQuery.name == story_name
-                )
-                
-            print("DEBUG: Stream complete for story:", story_name)
 
-    return Response(generate(), mimetype='text/event-stream')
+@app.route('/turn_stats', methods=['GET'])
+def turn_stats():
+    story_name = request.args.get('story_name', '').strip()
+    if not story_name:
+        return jsonify({'error': 'Story name is required.'}), 400
+    stats = last_turn_stats.get(story_name)
+    if stats is None:
+        return jsonify({'error': f"No turn recorded for story '{story_name}' yet."}), 404
+    return jsonify({'story_name': story_name, 'stats': stats})
+
+
+@app.route('/queue_status', methods=['GET'])
+def queue_status():
+    """Model calls running and waiting in the scheduler."""
+    return jsonify(model_scheduler.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Latency and throughput histograms by model and story.
+
+    JSON by default; ``?format=prometheus`` (or an Accept header asking for
+    text/plain) returns the Prometheus text format for scraping.
+    """
+    def accepts(mimetype):
+        # Prometheus asks for "text/plain; version=0.0.4", which werkzeug's
+        # matching would not treat as text/plain.
+        return max((quality for value, quality in request.accept_mimetypes
+                    if value.split(';')[0].strip() in (mimetype, '*/*')), default=0)
+
+    if request.args.get('format') == 'prometheus' or accepts('text/plain') > accepts('application/json'):
+        return Response(metrics.registry.prometheus(), mimetype='text/plain; version=0.0.4')
+    return jsonify(metrics.registry.snapshot())
+
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters and size of the summarization and repair cache, and of the session cache."""
+    return jsonify({'llm_cache': llm_cache.stats(), 'sessions': sessions.stats()})
 
 
 @app.route('/list_models', methods=['GET'])
 def list_models():
+    """Lists the installed models from the model catalog (see ModelCatalog)."""
     try:
-        all_models_response = ollama.list()
-        models = getattr(all_models_response, 'models', None)
-        if models is None:
-            return jsonify({"error": "Unexpected response format from ollama.list()."}), 500
-        if not isinstance(models, list):
-            return jsonify({"error": "Unexpected type for 'models' attribute."}), 500
-        def serialize_model(model):
-            try:
-                model_name = getattr(model, 'model', 'N/A')
-                details = getattr(model, 'details', None)
-                parameter_size = getattr(details, 'parameter_size', 'N/A') if details else 'N/A'
-                return {"model_name": model_name, "parameter_size": parameter_size}
-            except Exception as e:
-                return {"model_name": getattr(model, 'model', 'N/A'), "parameter_size": 'N/A'}
-        models_list = [serialize_model(model) for model in models]
-        return jsonify(models_list), 200
+        return jsonify(model_catalog.models()), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/invalidate_models', methods=['POST'])
+def invalidate_models():
+    """Drops the cached model catalog and reloads it, e.g. after pulling or removing a model."""
+    model_catalog.invalidate()
+    try:
+        models = model_catalog.models()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({'message': 'Model catalog reloaded.', 'models': models})
+
+def story_busy(story_name):
+    # Answered at once: waiting out a streaming turn would tie up one of
+    # waitress's few worker threads for the whole reply.
+    return jsonify({'error': f"A turn of story '{story_name}' is still running."}), 409, {'Retry-After': '5'}
+
+def rename_sessions(old_name):
+    # In-memory state is keyed by story name. Dropping it makes the next turn
+    # reload the story under its new name; a summary still running for the
+    # old name is discarded when it finishes.
+    conversations.pop(old_name, None)
+    llm_conversations.pop(old_name, None)
+    context_windows.pop(old_name, None)
+    last_turn_stats.pop(old_name, None)
+    with summary_lock:
+        summary_jobs.pop(old_name, None)
+
+def update_story(doc_id, fields):
+    # Everything but the name goes through the turn log: a direct TinyDB
+    # update would be overwritten by a pending record of the same field
+    # (e.g. the characters of a summary) when the log is replayed.
+    fields = dict(fields)
+    name = fields.pop('name', None)
+    if name is not None and story_index.doc_id(name) != doc_id:
+        story_index.update({'name': name}, doc_id)
+    turn_log.set(doc_id, **fields)
+    if 'characters' in fields:
+        character_templates.track(doc_id, fields['characters'])
+
 @app.route('/create_story', methods=['POST'])
 def create_story():
     data = request.get_json()
@@ -941,31 +1616,33 @@ def create_story():
     
     if not story_name or not description or not genre or not mode:
         return jsonify({'error': 'Story name, description, genre, and mode are required.'}), 400
+    try:
+        keep_alive = parse_keep_alive(data.get('keep_alive'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     character_copies = {}
     for char_name in selected_characters:
-        char = character_creation_table.get(StoryQuery.name == char_name)
+        char = character_index.get(char_name)
         if char:
             char_copy = char.copy()
             char_copy['template_origin'] = char_name
             character_copies[char_name] = char_copy
 
-    existing_story = story_creation_table.get(StoryQuery.name == story_name)
+    existing_story = story_index.get(story_name)
     if existing_story:
-        story_creation_table.update(
-            {
-                'description': description or existing_story.get('description'),
-                'genre': genre or existing_story.get('genre'),
-                'mode': mode or existing_story.get('mode'),
-                'characters': character_copies,
-                'conversation_history': existing_story.get('conversation_history', []),
-                'llm_memory': existing_story.get('llm_memory', []),
-                'current_summary': existing_story.get('current_summary', '')
-            },
-            StoryQuery.name == story_name,
-        )
+        updated_fields = {
+            'description': description or existing_story.get('description'),
+            'genre': genre or existing_story.get('genre'),
+            'mode': mode or existing_story.get('mode'),
+            'characters': character_copies
+        }
+        if 'keep_alive' in data:
+            updated_fields['keep_alive'] = keep_alive
+        update_story(existing_story.doc_id, updated_fields)
+        prompt_renderer.bump(existing_story.doc_id)
         message = f"Story '{story_name}' updated successfully!"
-        updated_story = story_creation_table.get(StoryQuery.name == story_name)
+        updated_story = turn_log.materialize(story_index.get(story_name))
     else:
         new_story = {
             'name': story_name,
@@ -975,9 +1652,14 @@ def create_story():
             'characters': character_copies,
             'conversation_history': [],
             'llm_memory': [],
-            'current_summary': ''
+            'current_summary': '',
+            'keep_alive': keep_alive,
+            'last_activity': time.time()
         }
-        story_creation_table.insert(new_story)
+        doc_id = story_index.insert(new_story)
+        prompt_renderer.bump(doc_id)
+        story_listing.track(doc_id, new_story)
+        character_templates.track(doc_id, character_copies)
         message = f"Story '{story_name}' created successfully!"
         updated_story = new_story
     return jsonify({'message': message, 'story': updated_story})
@@ -989,81 +1671,68 @@ def load_story():
     if not story_name:
         return jsonify({'error': 'Story name is required.'}), 400
     
-    story = story_creation_table.get(StoryQuery.name == story_name)
-    if not story:
+    story_doc = story_index.get(story_name)
+    if not story_doc:
         return jsonify({'error': f"Story with the name '{story_name}' does not exist."}), 404
+    release_story = story_locks.acquire(story_doc.doc_id, timeout=story_busy_timeout)
+    if release_story is None:
+        return story_busy(story_name)
+    try:
+        story = turn_log.materialize(story_doc)
 
-    full_conversation = story.get("conversation_history", [])
-    conversations[story_name] = full_conversation.copy()
+        full_conversation = story.get("conversation_history", [])
+        # chat() reloads the display history lazily; dropping it here keeps a
+        # deleted and recreated story from inheriting a stale in-memory copy.
+        conversations.pop(story_name, None)
     
 
-    llm_memory = story.get("llm_memory", [])
+        llm_memory = story.get("llm_memory", [])
     
 
-    if story['mode'] == 'dnd':
-        initial_prompt = dnd_mode_prompt
-    elif story['mode'] == 'novel':
-        initial_prompt = novel_mode_prompt
-    else:
-        initial_prompt = dnd_mode_prompt 
+        initial_prompt, story_details_prompt, character_prompt = prompt_renderer.render(story_doc.doc_id, story)
+        initial_prompt = initial_prompt or dnd_mode_prompt
     
-    story_details_prompt = {
-        "role": "system",
-        "content": (
-            f"Story Details:\n"
-            f"Name: {story.get('name', 'Unknown')}\n"
-            f"Description: {story.get('description', 'No description')}\n"
-            f"Genre: {story.get('genre', 'N/A')}\n"
-        )
-    }
-    
-    characters = story.get("characters", {})
-    if isinstance(characters, list):
-        char_dict = {}
-        for char in characters:
-            if isinstance(char, dict) and 'name' in char:
-                char_dict[char['name']] = char
-        characters = char_dict
-    
-    character_details = "Story Characters:\n"
-    for char_name, char in characters.items():
-        if isinstance(char, dict):
-            details = f"{char.get('name', 'Unknown')} (Race: {char.get('race', 'Unknown')}, Class: {char.get('class', 'Unknown')})\n"
-            details += f"Backstory: {char.get('backstory', 'No backstory')}\n"
-            advanced_info = []
-            for key in char:
-                if key not in ['name', 'race', 'class', 'backstory']:
-                    advanced_info.append(f"{key}: {char[key]}")
-            if advanced_info:
-                details += "Advanced: " + ", ".join(advanced_info) + "\n"
-            character_details += details
-    
-    character_prompt = {
-        "role": "system",
-        "content": character_details
-    }
-    
-    if llm_memory:
-        if len(llm_memory) >= 3:
-            llm_memory[0] = initial_prompt
-            llm_memory[1] = story_details_prompt
-            llm_memory[2] = character_prompt
+        if llm_memory and len(llm_memory) >= 3:
             llm_conversations[story_name] = llm_memory.copy()
+            refresh_prompt_prefix(llm_conversations[story_name], (initial_prompt, story_details_prompt, character_prompt))
         else:
             llm_conversations[story_name] = [initial_prompt, story_details_prompt, character_prompt]
             if len(llm_memory) > 0:
                 llm_conversations[story_name].extend(llm_memory)
-    else:
-        llm_conversations[story_name] = [initial_prompt, story_details_prompt, character_prompt]
+            turn_log.set(story_doc.doc_id, llm_memory=llm_conversations[story_name])
+    finally:
+        release_story()
     
 
-    display_conversation = transform_conversation_for_display(full_conversation)
+    display_conversation, history_cursor = display_page(full_conversation)
     
     return jsonify({
-        'story': story,
-        'conversation': display_conversation
+        'story': {k: v for k, v in story.items() if k not in HEAVY_STORY_FIELDS},
+        'conversation': display_conversation,
+        'history_cursor': history_cursor
     })
 
+@app.route('/load_history', methods=['POST'])
+def load_history():
+    """Returns the page of display history before ``cursor`` (from /load_story or a previous page)."""
+    data = request.get_json()
+    story_name = data.get('name', '').strip()
+    if not story_name:
+        return jsonify({'error': 'Story name is required.'}), 400
+    try:
+        cursor = int(data.get('cursor'))
+        limit = int(data.get('limit') or history_page_size)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'An integer cursor is required.'}), 400
+
+    story_doc = story_index.get(story_name)
+    if not story_doc:
+        return jsonify({'error': f"Story with the name '{story_name}' does not exist."}), 404
+    history = turn_log.project(story_doc, ('conversation_history',)).get('conversation_history', [])
+
+    messages, history_cursor = display_page(history, before=cursor, limit=max(1, min(limit, 500)))
+    return jsonify({'conversation': messages, 'history_cursor': history_cursor})
+
 @app.route('/create_character', methods=['POST'])
 def create_character():
     data = request.get_json()
@@ -1091,18 +1760,59 @@ def create_character():
         if key in data:
             character_data[key] = data[key]
 
-    existing_character = character_creation_table.search(StoryQuery.name == new_character_name)
-    if existing_character:
+    if new_character_name in character_index:
         return jsonify({'error': f"A character with the name '{new_character_name}' already exists."}), 400
 
-    character_creation_table.insert(character_data)
+    character_index.insert(character_data)
     return jsonify({'message': 'Character created successfully!', 'character': character_data})
 
 @app.route('/get_stories', methods=['GET'])
 def get_stories():
-    all_stories = story_creation_table.all()
+    all_stories = [turn_log.materialize(story) for story in story_creation_table.all()]
     return jsonify({'stories': all_stories})
 
+@app.route('/list_stories', methods=['GET'])
+def list_stories():
+    """
+    Lists stories one page at a time without their conversation payloads.
+
+    Query parameters:
+        fields: Comma separated subset of LISTING_FIELDS (characters are listed by name)
+        sort: 'last_activity' (most recent first, default) or 'name'
+        limit: Page size, at most MAX_LISTING_LIMIT
+        cursor: The next_cursor of the previous page
+
+    Full stories are fetched with /load_story when one is opened.
+    """
+    fields = request.args.get('fields')
+    fields = tuple(f.strip() for f in fields.split(',') if f.strip()) if fields else DEFAULT_LISTING_FIELDS
+    unknown = [f for f in fields if f not in LISTING_FIELDS]
+    if unknown:
+        return jsonify({'error': f"Unknown or non-listable fields: {', '.join(unknown)}."}), 400
+
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer.'}), 400
+    limit = max(1, min(limit, MAX_LISTING_LIMIT))
+
+    try:
+        doc_ids, next_cursor = story_listing.page(
+            request.args.get('sort', 'last_activity'), request.args.get('cursor'), limit
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    stories = []
+    for doc_id in doc_ids:
+        story = turn_log.project(story_creation_table.get(doc_id=doc_id), fields)
+        if story is None:
+            continue
+        if 'characters' in story:
+            story['characters'] = list(normalize_characters(story['characters']))
+        stories.append(story)
+    return jsonify({'stories': stories, 'next_cursor': next_cursor})
+
 @app.route('/get_characters', methods=['GET'])
 def get_characters():
     all_characters = character_creation_table.all()
@@ -1115,48 +1825,98 @@ def edit_story():
     if not original_name:
         return jsonify({'error': 'Original story name is required.'}), 400
 
-    story = story_creation_table.get(StoryQuery.name == original_name)
-    if not story:
+    story_doc = story_index.get(original_name)
+    if not story_doc:
         return jsonify({'error': f"Story '{original_name}' not found."}), 404
+    new_name = (data.get('name') or original_name).strip()
+    # A turn or a summary of this story must not interleave with the edit.
+    release_story = story_locks.acquire(story_doc.doc_id, timeout=story_busy_timeout)
+    if release_story is None:
+        return story_busy(original_name)
+    try:
+        story = turn_log.materialize(story_creation_table.get(doc_id=story_doc.doc_id))
+        if story is None:
+            return jsonify({'error': f"Story '{original_name}' not found."}), 404
+        try:
+            keep_alive = parse_keep_alive(data.get('keep_alive', story.get('keep_alive')))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-    payload_characters = data.get('characters', {})
-
-    stored_characters = story.get('characters', {})
-    
+        payload_characters = data.get('characters', {})
 
-    if isinstance(stored_characters, list):
-        char_dict = {}
-        for char in stored_characters:
-            if isinstance(char, dict) and 'name' in char:
-                char_dict[char['name']] = char
-        stored_characters = char_dict
+        stored_characters = normalize_characters(story.get('characters', {}))
 
-    merged_characters = {}
+        merged_characters = {}
 
-    for char_name, char_payload in payload_characters.items():
-        if char_name in stored_characters:
-            merged_characters[char_name] = stored_characters[char_name]
-        else:
-            char = character_creation_table.get(StoryQuery.name == char_name)
-            if char:
-                char_copy = char.copy()
-                char_copy['template_origin'] = char_name
-                merged_characters[char_name] = char_copy
+        for char_name, char_payload in payload_characters.items():
+            if char_name in stored_characters:
+                merged_characters[char_name] = stored_characters[char_name]
             else:
-                merged_characters[char_name] = char_payload
-
-    updated_data = {
-        'name': data.get('name', story['name']),
-        'description': data.get('description', story['description']),
-        'genre': data.get('genre', story['genre']),
-        'mode': data.get('mode', story['mode']),
-        'characters': merged_characters,
-        'conversation_history': story.get('conversation_history', []),
-        'llm_memory': story.get('llm_memory', []),
-        'current_summary': story.get('current_summary', '')
-    }
-    story_creation_table.update(updated_data, StoryQuery.name == original_name)
-    return jsonify(updated_data)
+                char = character_index.get(char_name)
+                if char:
+                    char_copy = char.copy()
+                    char_copy['template_origin'] = char_name
+                    merged_characters[char_name] = char_copy
+                else:
+                    merged_characters[char_name] = char_payload
+
+        updated_data = {
+            'name': new_name,
+            'description': data.get('description', story['description']),
+            'genre': data.get('genre', story['genre']),
+            'mode': data.get('mode', story['mode']),
+            'characters': merged_characters,
+            'keep_alive': keep_alive
+        }
+        if new_name != original_name:
+            if new_name in story_index:
+                return jsonify({'error': f"A story with the name '{new_name}' already exists."}), 409
+            rename_sessions(original_name)
+        update_story(story_doc.doc_id, updated_data)
+        prompt_renderer.bump(story_doc.doc_id)
+        story_listing.track(story_doc.doc_id, updated_data)
+    finally:
+        release_story()
+    # The same light fields /load_story returns; history comes from /load_history.
+    return jsonify({k: v for k, v in {**story, **updated_data}.items() if k not in HEAVY_STORY_FIELDS})
+
+# doc_id -> {template name the story's copies came from: latest edit of it},
+# for stories that were busy when their templates were edited.
+template_updates = {}
+template_updates_lock = threading.Lock()
+
+def update_template_copies(doc_id, templates):
+    """Applies edited character templates, keyed by their previous name, to a story (caller holds the story lock)."""
+    story = turn_log.project(story_creation_table.get(doc_id=doc_id), ('characters',))
+    if story is None:
+        return
+    characters = {}
+    for char_name, char in normalize_characters(story.get('characters', {})).items():
+        template = templates.get(char.get('template_origin')) if isinstance(char, dict) else None
+        if template is not None:
+            # Fields the story added itself, like the status from summaries, stay.
+            char = {**char, **template, 'template_origin': template['name']}
+            char_name = template['name']
+        characters[char_name] = char
+    update_story(doc_id, {'characters': characters})
+    prompt_renderer.bump(doc_id)
+
+def apply_template_updates(doc_id):
+    """Applies a story's queued template edits if it is free; otherwise its lock's next release does."""
+    if doc_id not in template_updates:
+        return
+    release_story = story_locks.acquire(doc_id, timeout=0)
+    if release_story is None:
+        return
+    try:
+        with template_updates_lock:
+            templates = template_updates.pop(doc_id, None)
+        if templates:
+            update_template_copies(doc_id, templates)
+    except Exception as e:
+        logger.warning("Could not apply character template edits to story %s: %s", doc_id, e)
+    finally:
+        release_story()
 
 @app.route('/edit_character', methods=['PUT'])
 def edit_character():
@@ -1164,7 +1924,7 @@ def edit_character():
     original_name = data.get('originalName', '').strip() or data.get('name', '').strip()
     if not original_name:
         return jsonify({'error': 'Character name is required.'}), 400
-    character = character_creation_table.get(StoryQuery.name == original_name)
+    character = character_index.get(original_name)
     if not character:
         return jsonify({'error': f"Character '{original_name}' not found."}), 404
 
@@ -1184,7 +1944,20 @@ def edit_character():
         if key in data:
             updated_data[key] = data[key]
 
-    character_creation_table.update(updated_data, StoryQuery.name == original_name)
+    character_index.update(updated_data, character.doc_id)
+
+    with template_updates_lock:
+        # An earlier edit still queued for a busy story may be what renamed
+        # the template to original_name; the latest edit replaces it.
+        for templates in template_updates.values():
+            for origin, template in templates.items():
+                if template['name'] == original_name:
+                    templates[origin] = updated_data
+        for doc_id in character_templates.doc_ids(original_name):
+            template_updates.setdefault(doc_id, {})[original_name] = updated_data
+        doc_ids = list(template_updates)
+    for doc_id in doc_ids:
+        apply_template_updates(doc_id)
     return jsonify(updated_data)
 
 @app.route('/delete_character', methods=['DELETE'])
@@ -1193,10 +1966,10 @@ def delete_character():
     character_name = data.get('name', '').strip()
     if not character_name:
         return jsonify({'error': 'Character name is required.'}), 400
-    existing_character = character_creation_table.search(StoryQuery.name == character_name)
-    if not existing_character:
+    character = character_index.get(character_name)
+    if not character:
         return jsonify({'error': f"Character with the name '{character_name}' does not exist."}), 404
-    character_creation_table.remove(StoryQuery.name == character_name)
+    character_index.remove(character.doc_id)
     return jsonify({'message': f"Character '{character_name}' deleted successfully."})
 
 @app.route('/delete_story', methods=['DELETE'])
@@ -1205,24 +1978,41 @@ def delete_story():
     story_name = data.get('name', '').strip()
     if not story_name:
         return jsonify({'error': 'Story name is required.'}), 400
-    story = story_creation_table.get(StoryQuery.name == story_name)
+    story = story_index.get(story_name)
     if not story:
         return jsonify({'error': f"Story with the name '{story_name}' does not exist."}), 404
-    story_creation_table.remove(StoryQuery.name == story_name)
+    release_story = story_locks.acquire(story.doc_id, timeout=story_busy_timeout)
+    if release_story is None:
+        return story_busy(story_name)
+    try:
+        story_index.remove(story.doc_id)
+        turn_log.drop(story.doc_id)
+        prompt_renderer.forget(story.doc_id)
+        story_listing.remove(story.doc_id)
+        character_templates.remove(story.doc_id)
+        with template_updates_lock:
+            template_updates.pop(story.doc_id, None)
+        conversations.pop(story_name, None)
+        llm_conversations.pop(story_name, None)
+        context_windows.pop(story_name, None)
+    finally:
+        release_story()
+    story_locks.forget(story.doc_id)
     return jsonify({'message': f"Story '{story_name}' and its conversation history deleted successfully."})
 
 @app.route('/get_model', methods=['GET'])
 def get_model():
-    all_models_response = ollama.list()
-    models = getattr(all_models_response, 'models', None)
-    if models is None or not isinstance(models, list) or len(models) == 0:
+    try:
+        model_names = model_catalog.names()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if not model_names:
         return jsonify({'error': 'No models found.'}), 500
 
-    model_names = [getattr(m, 'model', None) for m in models if getattr(m, 'model', None)]
     global current_model
     if current_model not in model_names:
         current_model = model_names[0]
-        print(f"DEBUG: current_model not found; updated to {current_model}")
+        logger.debug("current_model not found; updated to %s", current_model)
 
     return jsonify({'model': current_model})
 
@@ -1234,16 +2024,48 @@ def set_model():
     model_name = data.get('model_name')
     if not model_name:
         return jsonify({'error': 'Model name is required.'}), 400
-    current_model = model_name
-    return jsonify({'message': f'Model updated to {model_name}', 'model': current_model}), 200
+    try:
+        known = model_catalog.get(model_name)
+        if known is None:
+            # The model may have been pulled since the catalog was loaded.
+            model_catalog.invalidate()
+            known = model_catalog.get(model_name)
+    except Exception as e:
+        return jsonify({'error': f"Could not list the installed models: {e}"}), 503
+    if known is None:
+        return jsonify({'error': f"Model '{model_name}' is not installed.", 'models': model_catalog.names()}), 400
+    previous_model, current_model = current_model, model_name
+    # Loads the new model now rather than in the next turn, after unloading
+    # the previous one so the two never compete for memory.
+    model_loader.switch(model_name, previous_model, default_keep_alive, {"num_ctx": current_context_size})
+    return jsonify({
+        'message': f'Model updated to {model_name}',
+        'model': current_model,
+        'status': model_loader.status(model_name)
+    }), 200
+
+
+@app.route('/model_status', methods=['GET'])
+def model_status():
+    """Reports the loader's state for the current model and what Ollama holds in memory."""
+    resident = model_loader.resident()
+    return jsonify({
+        'model': current_model,
+        **model_loader.status(current_model),
+        'resident': resident,
+        'loaded': None if resident is None else any(m['model'] == current_model for m in resident)
+    })
 
 
 @app.route('/update_settings', methods=['POST'])
 def update_settings():
-    global model_accuracy_threshold, current_context_size
+    global model_accuracy_threshold, current_context_size, context_token_budget, response_token_reserve
+    global keep_reasoning_in_memory
     data = request.get_json()
     new_accuracy = data.get('model_accuracy')
     new_context = data.get('context_size')
+    new_budget = data.get('context_budget')
+    new_reserve = data.get('response_reserve')
     if new_accuracy is not None:
         try:
             new_accuracy = int(new_accuracy)
@@ -1258,11 +2080,53 @@ def update_settings():
             current_context_size = new_context
         except ValueError:
             return jsonify({'error': 'Invalid context size value.'}), 400
+    if new_budget is not None:
+        try:
+            new_budget = int(new_budget)
+            if new_budget < 0:
+                return jsonify({'error': 'Context budget cannot be negative.'}), 400
+            context_token_budget = new_budget or None
+        except ValueError:
+            return jsonify({'error': 'Invalid context budget value.'}), 400
+    if new_reserve is not None:
+        try:
+            new_reserve = int(new_reserve)
+            if new_reserve < 0:
+                return jsonify({'error': 'Response reserve cannot be negative.'}), 400
+            response_token_reserve = new_reserve
+        except ValueError:
+            return jsonify({'error': 'Invalid response reserve value.'}), 400
+    if 'keep_reasoning' in data:
+        # Off drops <think> blocks from the model's memory (they stay in the
+        # displayed history), which saves context on reasoning models.
+        if not isinstance(data['keep_reasoning'], bool):
+            return jsonify({'error': 'keep_reasoning must be true or false.'}), 400
+        keep_reasoning_in_memory = data['keep_reasoning']
     return jsonify({
         'message': 'Settings updated successfully.',
         'model_accuracy': model_accuracy_threshold,
-        'context_size': current_context_size
+        'context_size': current_context_size,
+        'context_budget': context_token_budget or current_context_size,
+        'response_reserve': response_token_reserve,
+        'keep_reasoning': keep_reasoning_in_memory
     })
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    if os.environ.get("QUESTDM_DEV") or "--dev" in sys.argv:
+        app.run(debug=True)
+    else:
+        try:
+            from waitress import serve
+        except ImportError:
+            logger.warning("waitress is not installed, using the threaded development server")
+            app.run(threaded=True)
+        else:
+            # Every streaming turn holds a worker thread for its whole reply.
+            serve(
+                app,
+                host=os.environ.get("QUESTDM_HOST", "127.0.0.1"),
+                port=int(os.environ.get("QUESTDM_PORT", 5000)),
+                threads=int(os.environ.get("QUESTDM_THREADS", 8)),
+                # Lets a streaming turn notice that its client went away.
+                channel_request_lookahead=1
+            )
\ No newline at end of file
@@ -0,0 +1,279 @@
+"""
+Asyncio serving mode for QuestDM: ``/chat`` runs on the event loop with
+``ollama.AsyncClient``, every other route is the Flask app in a thread pool.
+Needs the optional ``uvicorn`` package:
+
+    pip install uvicorn
+    python asgi.py              # or: uvicorn asgi:application
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+import ollama
+
+from app import (
+    app as flask_app, finish_turn, frame_coalescer, prepare_turn, queue_poll_interval, trace_recorder
+)
+
+logger = logging.getLogger(__name__)
+
+
+_async_client = None
+
+def async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = ollama.AsyncClient()
+    return _async_client
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+def wsgi_environ(scope, body):
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "SERVER_NAME": (scope.get("server") or ("localhost", 80))[0],
+        "SERVER_PORT": str((scope.get("server") or ("localhost", 80))[1]),
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        value = value.decode("latin-1")
+        environ[name] = environ[name] + "," + value if name in environ else value
+    # The body is already read and de-chunked.
+    environ.pop("HTTP_TRANSFER_ENCODING", None)
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+def run_wsgi(environ):
+    """Runs one request through the Flask app and returns (status, headers, body)."""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+
+    result = flask_app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return started["status"], started["headers"], body
+
+
+async def wsgi_application(scope, receive, send):
+    # Every route but /chat answers in one piece, so the whole response is
+    # built on a worker thread and sent from the loop.
+    body = await read_body(receive)
+    if body is None:
+        return
+    status, headers, payload = await asyncio.to_thread(run_wsgi, wsgi_environ(scope, body))
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+def response_headers(content_type, extra=()):
+    # Same origin policy as CORS(app) on the Flask side.
+    return [
+        (b"content-type", content_type),
+        (b"cache-control", b"no-cache"),
+        (b"access-control-allow-origin", b"*"),
+        *extra,
+    ]
+
+
+async def send_json(send, status, payload):
+    extra = [(b"retry-after", b"5")] if status in (409, 429) else []
+    await send({"type": "http.response.start", "status": status, "headers": response_headers(b"application/json", extra)})
+    await send({"type": "http.response.body", "body": json.dumps(payload).encode("utf-8")})
+
+
+async def send_frames(send, frames):
+    for frame in frames:
+        await send({"type": "http.response.body", "body": frame.encode("utf-8"), "more_body": True})
+
+
+async def stream_turn(turn, send, coalescer):
+    logger.debug("Starting async stream for story: %s", turn.story_name)
+    while not await turn.ticket.wait_async(queue_poll_interval):
+        await send_frames(send, [turn.queue_frame()])
+    turn.started_at = time.perf_counter()
+    stream = await async_client().chat(
+        model=turn.model,
+        messages=turn.context_window,
+        stream=True,
+        options=turn.options,
+        keep_alive=turn.keep_alive
+    )
+    if trace_recorder:
+        stream = trace_recorder.record_async_stream(stream, turn.model, turn.context_window, turn.options)
+    chunks = aiter(stream)
+    next_chunk = asyncio.ensure_future(anext(chunks, None))
+    try:
+        while True:
+            # Unlike the WSGI route, buffered text goes out when it is due
+            # even if the model pauses between tokens.
+            done, _ = await asyncio.wait({next_chunk}, timeout=coalescer.remaining())
+            if not done:
+                await send_frames(send, coalescer.flush())
+                continue
+            chunk = next_chunk.result()
+            if chunk is None:
+                break
+            next_chunk = asyncio.ensure_future(anext(chunks, None))
+            for event, text in turn.feed(chunk):
+                await send_frames(send, coalescer.add(text, event))
+    finally:
+        # Close the generator explicitly so the HTTP stream to Ollama ends
+        # now rather than whenever the generator is garbage-collected.
+        next_chunk.cancel()
+        await asyncio.wait({next_chunk})
+        await chunks.aclose()
+    await send_frames(send, coalescer.flush())
+    if turn.stats:
+        await send_frames(send, [turn.stats_frame()])
+
+
+async def start_turn(story_name, user_input):
+    """Runs prepare_turn() off the event loop; it may briefly wait for the story's lock."""
+    pending = asyncio.ensure_future(asyncio.to_thread(prepare_turn, story_name, user_input))
+    try:
+        return await asyncio.shield(pending)
+    except asyncio.CancelledError:
+        # The request went away while waiting; release the turn once it is ready.
+        def release(future):
+            if not future.cancelled() and future.exception() is None and future.result()[0]:
+                future.result()[0].close()
+        pending.add_done_callback(release)
+        raise
+
+
+def trace_chat(data, status, started):
+    # The Flask routes are traced by app.trace_request; this one bypasses Flask.
+    if trace_recorder:
+        trace_recorder.http("POST", "/chat", {}, data, status, started)
+
+
+async def chat(scope, receive, send):
+    started = time.perf_counter()
+    body = await read_body(receive)
+    if body is None:
+        return
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        await send_json(send, 400, {"error": "Invalid JSON body."})
+        trace_chat(None, 400, started)
+        return
+
+    turn, error = await start_turn(data.get("story_name"), data.get("message"))
+    coalescer = frame_coalescer(data)
+    if error:
+        await send_json(send, error[1], error[0])
+        trace_chat(data, error[1], started)
+        return
+
+    try:
+        await send({"type": "http.response.start", "status": 200, "headers": response_headers(b"text/event-stream")})
+    except BaseException:
+        turn.close()
+        raise
+    streaming = asyncio.ensure_future(stream_turn(turn, send, coalescer))
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    loop = asyncio.get_running_loop()
+    # /chat/cancel runs on a WSGI worker thread.
+    turn.on_cancel(lambda: loop.call_soon_threadsafe(streaming.cancel))
+    try:
+        done, _ = await asyncio.wait({streaming, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        if disconnect in done and not streaming.done():
+            logger.debug("Client disconnected; cancelling stream for story: %s", turn.story_name)
+            turn.aborted = True
+            # Cancelling closes the HTTP stream to Ollama, which stops generating.
+            streaming.cancel()
+        try:
+            await streaming
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning("Exception in async stream: %s", e)
+    finally:
+        streaming.cancel()
+        disconnect.cancel()
+        finish_turn(turn)
+
+    if not turn.aborted:
+        if turn.cancelled.is_set() and not turn.stats:
+            await send_frames(send, coalescer.flush() + [turn.interrupted_frame()])
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    trace_chat(data, 200, started)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http" and scope["path"] == "/chat" and scope["method"] == "POST":
+        await chat(scope, receive, send)
+    else:
+        await wsgi_application(scope, receive, send)
+
+
+if __name__ == "__main__":
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("The ASGI serving mode needs uvicorn: pip install uvicorn")
+    uvicorn.run(
+        application,
+        host=os.environ.get("QUESTDM_HOST", "127.0.0.1"),
+        port=int(os.environ.get("QUESTDM_PORT", 5000))
+    )
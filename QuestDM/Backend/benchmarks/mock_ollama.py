@@ -0,0 +1,291 @@
+"""
+Deterministic stand-in for the parts of the Ollama HTTP API QuestDM uses.
+
+Streamed replies are words at a configurable token rate; summaries are JSON,
+a configurable share of it malformed. Replies depend only on the seed and
+the request body.
+
+Run it on its own to point a real backend at it:
+
+    python benchmarks/mock_ollama.py --port 11500 --token-rate 200
+    OLLAMA_HOST=127.0.0.1:11500 python app.py
+"""
+import argparse
+import json
+import random
+import re
+import select
+import socket
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+WORDS = (
+    "the", "dragon", "circles", "above", "ancient", "ruins", "while", "you", "draw", "your",
+    "blade", "and", "torchlight", "flickers", "across", "wet", "stone", "a", "voice", "echoes",
+    "from", "deep", "below", "promising", "gold", "or", "ruin", "to", "any", "who", "dare",
+)
+
+MARKER = re.compile(r"\[bench:([\w-]+)\]")
+
+
+def summary_reply(rng, malformed_rate):
+    summary = {
+        "summary": " ".join(rng.choice(WORDS) for _ in range(60)),
+        "character_creation": {
+            "Aria": {"name": "Aria", "race": "Half-Elf", "class": "Mage",
+                     "backstory": "A scholar of lost magic.", "status": "Healthy, in the ruins"},
+        },
+    }
+    text = json.dumps(summary)
+    if rng.random() >= malformed_rate:
+        return text
+    # The usual ways models break JSON.
+    breakage = rng.choice(("trailing_comma", "single_quotes", "truncated", "prose", "unquoted_keys"))
+    if breakage == "trailing_comma":
+        return text[:-1] + ",}"
+    if breakage == "single_quotes":
+        return text.replace('"', "'")
+    if breakage == "truncated":
+        return text[:int(len(text) * 0.8)]
+    if breakage == "prose":
+        return "Here's the summary:\n```json\n" + text + "\n```\nLet me know if you need changes."
+    return re.sub(r'"(\w+)":', r"\1:", text)
+
+
+class MockOllama(ThreadingHTTPServer):
+    """
+    The mock server. ``calls`` records every /api/chat request with its
+    perf_counter timestamps; ``call_for(id)`` finds a streamed request whose
+    last message carries ``[bench:<id>]``.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), token_rate=200.0, reply_tokens=40,
+                 first_token_ms=20.0, summary_ms=50.0, malformed_rate=0.0, seed=0, load_ms=0.0):
+        super().__init__(address, MockHandler)
+        self.token_rate = token_rate
+        self.reply_tokens = reply_tokens
+        self.first_token_ms = first_token_ms
+        self.summary_ms = summary_ms
+        self.malformed_rate = malformed_rate
+        self.seed = seed
+        self.load_ms = load_ms
+        self.loaded = {}    # model -> keep_alive it was last used with
+        self.calls = []
+        self._by_marker = {}
+        self._lock = threading.Lock()
+
+    @property
+    def host(self):
+        return f"{self.server_address[0]}:{self.server_address[1]}"
+
+    def reply(self, request, raw):
+        """
+        Makes up the reply to one /api/chat request.
+
+        Returns:
+            tuple: (pieces, stats), pieces being (delay, text) pairs and stats
+            the final counters (None to derive them from the pieces)
+        """
+        rng = random.Random(self.seed ^ zlib.crc32(raw))
+        if not request.get("stream", True):
+            return [(self.summary_ms / 1000.0, summary_reply(rng, self.malformed_rate))], None
+        interval = 1.0 / self.token_rate if self.token_rate else 0.0
+        return [
+            (self.first_token_ms / 1000.0 if i == 0 else interval, rng.choice(WORDS) + " ")
+            for i in range(self.reply_tokens)
+        ], None
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections or cancelled streams are expected.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def record(self, call):
+        with self._lock:
+            self.calls.append(call)
+            if call["stream"] and call["marker"]:
+                self._by_marker[call["marker"]] = call
+
+    def call_for(self, marker):
+        with self._lock:
+            return self._by_marker.get(marker)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="mock-ollama", daemon=True)
+        thread.start()
+        return thread
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _pause(self, delay):
+        """Waits like a busy model; False if the backend hung up meanwhile, as Ollama notices."""
+        deadline = time.monotonic() + delay
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            readable, _, _ = select.select([self.connection], [], [], remaining)
+            if readable:
+                if not self.connection.recv(1, socket.MSG_PEEK):
+                    return False
+                time.sleep(max(0.0, deadline - time.monotonic()))
+                return True
+
+    def _write_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{
+                "name": "mock:latest", "model": "mock:latest",
+                "modified_at": "2024-01-01T00:00:00Z", "size": 1, "digest": "0" * 64,
+                "details": {"format": "gguf", "family": "mock", "parameter_size": "1B",
+                            "quantization_level": "Q4_0"},
+            }]})
+        elif self.path == "/api/ps":
+            self._send_json({"models": [
+                {"name": model, "model": model, "size": 1, "size_vram": 1, "digest": "0" * 64,
+                 "expires_at": "2099-01-01T00:00:00Z"}
+                for model in list(self.server.loaded)
+            ]})
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-mock"})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        if self.path == "/api/show":
+            self._send_json({
+                "modelfile": "", "parameters": "", "template": "{{ .Prompt }}",
+                "details": {"format": "gguf", "family": "mock", "parameter_size": "1B",
+                            "quantization_level": "Q4_0"},
+                "model_info": {"general.architecture": "mock", "mock.context_length": 8192},
+            })
+            return
+        request = json.loads(raw or b"{}")
+        server = self.server
+        if self.path == "/api/generate":
+            # Only the prompt-less requests that load or unload a model.
+            model = request.get("model")
+            if request.get("keep_alive") == 0:
+                server.loaded.pop(model, None)
+                reason = "unload"
+            else:
+                if model not in server.loaded:
+                    time.sleep(server.load_ms / 1000.0)
+                server.loaded[model] = request.get("keep_alive")
+                reason = "load"
+            self._send_json({"model": model, "created_at": "2024-01-01T00:00:00Z", "response": "",
+                             "done": True, "done_reason": reason})
+            return
+        if self.path != "/api/chat":
+            self._send_json({"error": "not found"}, 404)
+            return
+        received = time.perf_counter()
+        if request.get("model") not in server.loaded:
+            time.sleep(server.load_ms / 1000.0)
+        server.loaded[request.get("model")] = request.get("keep_alive")
+        messages = request.get("messages") or []
+        prompt_chars = sum(len(m.get("content") or "") for m in messages)
+        marker = None
+        for message in reversed(messages):
+            match = MARKER.search(message.get("content") or "")
+            if match:
+                marker = match.group(1)
+                break
+        call = {"stream": request.get("stream", True), "marker": marker, "received": received,
+                "prompt_chars": prompt_chars}
+        server.record(call)
+        pieces, stats = server.reply(request, raw)
+        stats = dict(stats or {"prompt_eval_count": prompt_chars // 4})
+
+        if not call["stream"]:
+            time.sleep(sum(delay for delay, _ in pieces))
+            content = "".join(text for _, text in pieces)
+            call["first_chunk"] = call["finished"] = time.perf_counter()
+            stats.setdefault("eval_count", len(content) // 4)
+            self._send_json({
+                "model": request.get("model"), "created_at": "2024-01-01T00:00:00Z",
+                "message": {"role": "assistant", "content": content},
+                "done": True, "done_reason": "stop", **stats,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for delay, text in pieces:
+                if not self._pause(delay):
+                    raise ConnectionResetError("The backend closed the stream.")
+                self._write_chunk({"model": request.get("model"), "created_at": "2024-01-01T00:00:00Z",
+                                   "message": {"role": "assistant", "content": text},
+                                   "done": False})
+                call.setdefault("first_chunk", time.perf_counter())
+            if "total_duration" not in stats:
+                first_delay = pieces[0][0] if pieces else 0.0
+                stats.update({
+                    "total_duration": int((time.perf_counter() - received) * 1e9),
+                    "load_duration": 0,
+                    "prompt_eval_duration": int(first_delay * 1e9),
+                    "eval_count": len(pieces),
+                    "eval_duration": int((sum(delay for delay, _ in pieces) - first_delay) * 1e9),
+                })
+            self._write_chunk({
+                "model": request.get("model"), "created_at": "2024-01-01T00:00:00Z",
+                "message": {"role": "assistant", "content": ""},
+                "done": True, "done_reason": "stop", **stats,
+            })
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The backend closed the stream (a cancelled turn).
+            call["cancelled"] = True
+            self.close_connection = True
+        call["finished"] = time.perf_counter()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--token-rate", type=float, default=200.0, help="streamed tokens per second (0: no delay)")
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    parser.add_argument("--first-token-ms", type=float, default=20.0)
+    parser.add_argument("--summary-ms", type=float, default=50.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of summaries with broken JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--load-ms", type=float, default=0.0, help="time to load a model that is not loaded")
+    args = parser.parse_args()
+    server = MockOllama((args.host, args.port), args.token_rate, args.reply_tokens,
+                        args.first_token_ms, args.summary_ms, args.malformed_rate, args.seed, args.load_ms)
+    print(f"Mock Ollama listening on {server.host}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Replays a recorded session against the backend.
+
+Record a session by starting the backend with QUESTDM_TRACE set:
+
+    QUESTDM_TRACE=campaign.trace.gz python app.py
+
+then, from QuestDM/Backend, replay it:
+
+    python benchmarks/replay.py campaign.trace.gz              # original pacing
+    python benchmarks/replay.py campaign.trace.gz --speed 0    # as fast as possible
+    python benchmarks/replay.py campaign.trace.gz --data ~/questdm-data --json replay.json
+
+The backend runs in this process on a fresh data directory or a copy of
+--data, against a mock Ollama that answers each model call with the reply
+recorded for the same request. Requests keep their recorded order and
+offsets, scaled by --speed.
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from urllib.parse import urlencode
+
+from run import ms, percentile, serve
+from mock_ollama import MockOllama
+from llm_cache import request_key
+from session_trace import read_trace
+
+
+class TraceOllama(MockOllama):
+    """Mock Ollama that answers with the replies recorded in a trace."""
+
+    def __init__(self, records, speed=1.0, strict=False, **kwargs):
+        super().__init__(**kwargs)
+        self.scale = 1.0 / speed if speed else 0.0
+        self.strict = strict
+        self.matched = 0
+        self.reordered = 0
+        self.synthetic = 0
+        self._replies_lock = threading.Lock()
+        self._by_key = defaultdict(deque)
+        self._in_order = defaultdict(deque)   # (stream, format) -> records
+        self._used = set()
+        for record in records:
+            self._by_key[record["key"]].append(record)
+            self._in_order[(record["stream"], record["format"])].append(record)
+
+    def _take(self, key, kind):
+        with self._replies_lock:
+            for queue, counter in ((self._by_key[key], "matched"), (self._in_order[kind], "reordered")):
+                if counter == "reordered" and self.strict:
+                    break
+                while queue and id(queue[0]) in self._used:
+                    queue.popleft()
+                if queue:
+                    record = queue.popleft()
+                    self._used.add(id(record))
+                    setattr(self, counter, getattr(self, counter) + 1)
+                    return record
+            self.synthetic += 1
+            return None
+
+    def reply(self, request, raw):
+        stream = request.get("stream", True)
+        key = request_key(request.get("model"), request.get("messages") or [],
+                          request.get("options"), request.get("format"))
+        record = self._take(key, (stream, request.get("format") is not None))
+        if record is None:
+            return super().reply(request, raw)
+        if not stream:
+            return [(record["duration"] * self.scale, record["content"])], record.get("stats")
+        pieces, previous = [], 0.0
+        for at, text in record["chunks"]:
+            pieces.append(((at - previous) * self.scale, text))
+            previous = at
+        return pieces, record.get("stats")
+
+
+def lane_of(record):
+    """Requests in one lane run one after another, like a single player's."""
+    body = record.get("body") or {}
+    if record["path"] == "/chat/cancel":
+        return None
+    if record["path"] in ("/chat", "/load_story", "/load_history", "/edit_story", "/delete_story",
+                          "/create_story"):
+        return "story:" + str(body.get("story_name") or body.get("originalName") or body.get("name") or "")
+    return "global"
+
+
+class Replay:
+    def __init__(self, requests, port, scale):
+        self.requests = requests
+        self.port = port
+        self.scale = scale
+        self.results = [None] * len(requests)
+        self._turn = threading.Condition()
+        self._next_start = 0
+
+    def send(self, record):
+        path = record["path"]
+        if record.get("query"):
+            path += "?" + urlencode(record["query"])
+        body = record.get("body")
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=600)
+        started = time.perf_counter()
+        conn.request(record["method"], path, json.dumps(body) if body is not None else None,
+                     {"Content-Type": "application/json"} if body is not None else {})
+        response = conn.getresponse()
+        response.read()
+        elapsed = time.perf_counter() - started
+        conn.close()
+        return response.status, elapsed
+
+    def run_one(self, index, origin):
+        record = self.requests[index]
+        delay = origin + record["t"] * self.scale - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        # Requests start in their recorded order.
+        with self._turn:
+            self._turn.wait_for(lambda: self._next_start == index)
+            self._next_start += 1
+            self._turn.notify_all()
+        try:
+            status, elapsed = self.send(record)
+        except OSError as e:
+            status, elapsed = f"error: {e}", None
+        self.results[index] = {"status": status, "duration": elapsed}
+
+    def run(self):
+        lanes = defaultdict(list)
+        for index, record in enumerate(self.requests):
+            lanes[lane_of(record) or f"cancel:{index}"].append(index)
+        origin = time.perf_counter()
+
+        def lane(indexes):
+            for index in indexes:
+                self.run_one(index, origin)
+
+        threads = [threading.Thread(target=lane, args=(indexes,), daemon=True) for indexes in lanes.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - origin
+
+
+def report(requests, results):
+    by_route = defaultdict(lambda: {"recorded": [], "replayed": [], "status_changed": 0})
+    for record, result in zip(requests, results):
+        route = by_route[f"{record['method']} {record['path']}"]
+        route["recorded"].append(record["duration"])
+        if result["duration"] is not None:
+            route["replayed"].append(result["duration"])
+        if result["status"] != record["status"]:
+            route["status_changed"] += 1
+    rows = []
+    for name, route in sorted(by_route.items()):
+        rows.append({
+            "route": name,
+            "count": len(route["recorded"]),
+            "recorded_p50_ms": ms(percentile(route["recorded"], 50)),
+            "replayed_p50_ms": ms(percentile(route["replayed"], 50)),
+            "recorded_p95_ms": ms(percentile(route["recorded"], 95)),
+            "replayed_p95_ms": ms(percentile(route["replayed"], 95)),
+            "status_changed": route["status_changed"],
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="trace file written with QUESTDM_TRACE")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="pacing relative to the recording (2: twice as fast, 0: no waiting)")
+    parser.add_argument("--data", help="data directory to start from (copied, never modified)")
+    parser.add_argument("--strict", action="store_true",
+                        help="only serve recorded replies to identical requests")
+    parser.add_argument("--model-parallel", type=int, default=1, help="OLLAMA_NUM_PARALLEL the backend assumes")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+    trace_path = os.path.abspath(args.trace)
+
+    records = list(read_trace(trace_path))
+    requests = sorted((r for r in records if r["type"] == "http"), key=lambda r: r["t"])
+    replies = [r for r in records if r["type"] == "model"]
+    if not requests:
+        sys.exit(f"{args.trace} has no recorded requests.")
+
+    mock = TraceOllama(replies, speed=args.speed, strict=args.strict)
+    mock.start()
+
+    data_dir = tempfile.mkdtemp(prefix="questdm-replay-")
+    if args.data:
+        for name in ("stories.json", "story_logs", "llm_cache"):
+            source = os.path.join(args.data, name)
+            if os.path.isdir(source):
+                shutil.copytree(source, os.path.join(data_dir, name))
+            elif os.path.isfile(source):
+                shutil.copy2(source, data_dir)
+    os.chdir(data_dir)
+    os.environ.pop("QUESTDM_TRACE", None)
+    os.environ["OLLAMA_HOST"] = mock.host
+    os.environ["OLLAMA_NUM_PARALLEL"] = str(args.model_parallel)
+    import app as backend
+
+    replay = Replay(requests, serve(backend.app), mock.scale)
+    elapsed = replay.run()
+    # Summaries still running in the background made model calls in the
+    # recording too.
+    while any(not job["future"].done() for job in list(backend.summary_jobs.values())):
+        time.sleep(0.01)
+    rows = report(requests, replay.results)
+
+    recorded_span = max(r["t"] + r["duration"] for r in requests) - requests[0]["t"]
+    columns = list(rows[0])
+    widths = [max(len(c), *(len(str(row[c])) for row in rows)) for c in columns]
+    print("  ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[c]).rjust(w) for c, w in zip(columns, widths)))
+    print(f"\n{len(requests)} requests, {len(replies)} recorded model replies: "
+          f"{mock.matched} matched, {mock.reordered} served out of order, {mock.synthetic} synthetic")
+    print(f"Recorded span {recorded_span:.2f}s, replayed in {elapsed:.2f}s at speed {args.speed}")
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({
+                "trace": trace_path,
+                "speed": args.speed,
+                "routes": rows,
+                "replies": {"recorded": len(replies), "matched": mock.matched,
+                            "reordered": mock.reordered, "synthetic": mock.synthetic},
+                "recorded_seconds": round(recorded_span, 3),
+                "replayed_seconds": round(elapsed, 3),
+            }, f, indent=2)
+    print(f"Data left in {data_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""
+End-to-end benchmarks of the backend against a mock Ollama server.
+
+Runs the mock and the Flask app (under waitress) in this process on a
+throwaway data directory, and measures what the backend adds on top of
+model time: chat turns, story loading and listing, summarization, storage
+writes and memory.
+
+Usage, from QuestDM/Backend:
+
+    python benchmarks/run.py                 # 10 to 10,000 turn stories
+    python benchmarks/run.py --quick         # small sizes, a few turns each
+    python benchmarks/run.py --json bench.json
+
+Neither the real stories.json nor an Ollama install is touched.
+"""
+import argparse
+import gc
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from mock_ollama import MockOllama, WORDS
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def rss_bytes():
+    """Resident set size of this process (peak RSS where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def write_totals(app):
+    """Count, seconds and bytes of storage writes so far, per store."""
+    snapshot = app.metrics.registry.snapshot()
+    totals = {}
+    for metric, field in (("questdm_db_write_seconds", "seconds"), ("questdm_db_write_bytes", "bytes")):
+        for series in snapshot[metric]["series"]:
+            store = totals.setdefault(series["labels"]["store"], {"writes": 0, "seconds": 0.0, "bytes": 0})
+            if field == "seconds":
+                store["writes"] += series["count"]
+            store[field] += series["sum"]
+    return totals
+
+
+def write_delta(before, after):
+    delta = {}
+    for store, values in after.items():
+        old = before.get(store, {"writes": 0, "seconds": 0.0, "bytes": 0})
+        writes = values["writes"] - old["writes"]
+        if writes:
+            delta[store] = {
+                "writes": writes,
+                "total_ms": ms(values["seconds"] - old["seconds"]),
+                "bytes": int(values["bytes"] - old["bytes"]),
+            }
+    return delta
+
+
+def repair_calls(app):
+    series = app.metrics.registry.snapshot()["questdm_repair_attempts"]["series"]
+    return int(sum(s["sum"] for s in series))
+
+
+class Client:
+    """Minimal HTTP client; a new connection per request, like the frontend's fetch."""
+
+    def __init__(self, port):
+        self.port = port
+
+    def request(self, method, path, body=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=600)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        started = time.perf_counter()
+        conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = conn.getresponse()
+        data = response.read()
+        elapsed = time.perf_counter() - started
+        conn.close()
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path} -> {response.status}: {data[:200]!r}")
+        return json.loads(data), len(data), elapsed
+
+    def chat(self, story_name, message):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=600)
+        sent = time.perf_counter()
+        conn.request("POST", "/chat", json.dumps({"story_name": story_name, "message": message}),
+                     {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        data = response.read()
+        done = time.perf_counter()
+        conn.close()
+        if response.status >= 400:
+            raise RuntimeError(f"/chat -> {response.status}: {data[:200]!r}")
+        return sent, done, data
+
+
+class Bench:
+    def __init__(self, args, app, mock, client):
+        self.args = args
+        self.app = app
+        self.mock = mock
+        self.client = client
+        self.rng = random.Random(args.seed)
+        self._turn_ids = iter(range(1 << 62))
+        self._id_lock = threading.Lock()
+
+    def sentence(self, words):
+        return " ".join(self.rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+    def create_story(self, name, turns):
+        """Creates a story through the API and gives it ``turns`` synthetic exchanges."""
+        self.client.request("POST", "/create_story", {
+            "name": name, "description": self.sentence(20), "genre": "Fantasy", "mode": "dnd",
+            "characters": [],
+        })
+        prompts = [{"role": "system", "content": self.sentence(30)} for _ in range(3)]
+        history = []
+        for _ in range(turns):
+            history.append({"role": "user", "content": self.sentence(self.args.message_words // 2)})
+            history.append({"role": "assistant", "content": self.sentence(self.args.message_words)})
+        app = self.app
+        app.story_index.update(
+            {"conversation_history": prompts + history, "llm_memory": prompts + history},
+            app.story_index.doc_id(name)
+        )
+        app.conversations.pop(name, None)
+        app.llm_conversations.pop(name, None)
+        app.context_windows.pop(name, None)
+
+    def wait_for_summaries(self):
+        while any(not job["future"].done() for job in list(self.app.summary_jobs.values())):
+            time.sleep(0.01)
+
+    def chat_turn(self, story_name):
+        """Runs one /chat turn; returns (wall, dispatch, backend-added) seconds."""
+        with self._id_lock:
+            marker = f"{story_name}-{next(self._turn_ids)}"
+        sent, done, _ = self.client.chat(story_name, f"{self.sentence(8)} [bench:{marker}]")
+        call = self.mock.call_for(marker)
+        if call is None:
+            raise RuntimeError(f"The model was never called for turn {marker}")
+        deadline = time.perf_counter() + 5
+        while "finished" not in call and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        model_time = call["finished"] - call["received"]
+        return done - sent, call["received"] - sent, (done - sent) - model_time
+
+    def history_phase(self, sizes):
+        results = []
+        for size in sizes:
+            name = f"bench-history-{size}"
+            self.create_story(name, size)
+            gc.collect()
+            rss_before, writes_before = rss_bytes(), write_totals(self.app)
+
+            load_times, load_bytes = [], 0
+            for _ in range(3):
+                body, load_bytes, elapsed = self.client.request("POST", "/load_story", {"name": name})
+                load_times.append(elapsed)
+            history_bytes = history_time = None
+            if body.get("history_cursor") is not None:
+                _, history_bytes, history_time = self.client.request(
+                    "POST", "/load_history", {"name": name, "cursor": body["history_cursor"]}
+                )
+
+            turns = []
+            for _ in range(self.args.turns):
+                self.wait_for_summaries()
+                turns.append(self.chat_turn(name))
+            self.wait_for_summaries()
+            gc.collect()
+            cold, warm = turns[0], turns[1:] or turns
+            results.append({
+                "turns": size,
+                "load_story_ms": ms(percentile(load_times, 50)),
+                "load_story_bytes": load_bytes,
+                "load_history_ms": ms(history_time),
+                "load_history_bytes": history_bytes,
+                "chat_cold_added_ms": ms(cold[2]),
+                "chat_dispatch_p50_ms": ms(percentile([t[1] for t in warm], 50)),
+                "chat_added_p50_ms": ms(percentile([t[2] for t in warm], 50)),
+                "chat_added_p95_ms": ms(percentile([t[2] for t in warm], 95)),
+                "chat_wall_p50_ms": ms(percentile([t[0] for t in warm], 50)),
+                "db_writes": write_delta(writes_before, write_totals(self.app)),
+                "rss_growth_bytes": rss_bytes() - rss_before if rss_before is not None else None,
+                "session_cache_bytes": self.app.sessions.stats()["bytes"],
+            })
+        return results
+
+    def listing_phase(self):
+        count = len(self.app.story_creation_table)
+        _, get_bytes, get_time = self.client.request("GET", "/get_stories")
+        _, list_bytes, list_time = self.client.request("GET", "/list_stories")
+        return {
+            "stories": count,
+            "get_stories_ms": ms(get_time), "get_stories_bytes": get_bytes,
+            "list_stories_ms": ms(list_time), "list_stories_bytes": list_bytes,
+        }
+
+    def summarization_phase(self, sizes):
+        app = self.app
+        results = []
+        for size in sizes:
+            name = f"bench-summary-{size}"
+            self.create_story(name, size)
+            snapshot = app.turn_log.materialize(app.story_index.get(name))["llm_memory"]
+            row = {"turns": size}
+            for label in ("cold", "cached"):
+                calls_before, repairs_before = len(self.mock.calls), repair_calls(app)
+                started = time.perf_counter()
+                result = app.summarize_and_save(name, None, list(snapshot))
+                row[f"{label}_ms"] = ms(time.perf_counter() - started)
+                row[f"{label}_model_calls"] = len(self.mock.calls) - calls_before
+                row[f"{label}_repair_calls"] = repair_calls(app) - repairs_before
+            row["summarized"] = result is not None
+            results.append(row)
+        return results
+
+    def concurrency_phase(self, counts):
+        results = []
+        for count in counts:
+            names = [f"bench-concurrent-{count}-{i}" for i in range(count)]
+            for name in names:
+                self.create_story(name, self.args.concurrent_history)
+            # A first turn per story brings it into memory and lets its
+            # summary (if any) finish, so the measured turns are steady state.
+            for name in names:
+                self.chat_turn(name)
+            self.wait_for_summaries()
+            gc.collect()
+            rss_before, writes_before = rss_bytes(), write_totals(self.app)
+
+            timings, errors = [], []
+            barrier = threading.Barrier(count)
+
+            def player(name):
+                barrier.wait()
+                try:
+                    for _ in range(self.args.turns):
+                        timings.append(self.chat_turn(name))
+                except Exception as e:
+                    errors.append(str(e))
+
+            threads = [threading.Thread(target=player, args=(name,)) for name in names]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            self.wait_for_summaries()
+            gc.collect()
+            results.append({
+                "sessions": count,
+                "turns_per_second": round(len(timings) / elapsed, 2),
+                "chat_dispatch_p50_ms": ms(percentile([t[1] for t in timings], 50)),
+                "chat_added_p50_ms": ms(percentile([t[2] for t in timings], 50)),
+                "chat_added_p95_ms": ms(percentile([t[2] for t in timings], 95)),
+                "chat_wall_p95_ms": ms(percentile([t[0] for t in timings], 95)),
+                "errors": len(errors),
+                "db_writes": write_delta(writes_before, write_totals(self.app)),
+                "rss_growth_bytes": rss_bytes() - rss_before if rss_before is not None else None,
+                "session_cache_bytes": self.app.sessions.stats()["bytes"],
+            })
+        return results
+
+
+def serve(app):
+    """Serves the Flask app on a free port in a daemon thread; returns the port."""
+    try:
+        from waitress import create_server
+    except ImportError:
+        from werkzeug.serving import make_server
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        port = server.server_port
+    else:
+        server = create_server(app, host="127.0.0.1", port=0, threads=64, channel_request_lookahead=1)
+        port = server.effective_port
+    threading.Thread(target=server.serve_forever if hasattr(server, "serve_forever") else server.run,
+                     name="backend", daemon=True).start()
+    return port
+
+
+def print_table(title, rows):
+    if not rows:
+        return
+    columns = [key for key in rows[0] if not isinstance(rows[0][key], dict)]
+    table = [[str(row.get(c, "")) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(r[i]) for r in table)) for i, c in enumerate(columns)]
+    print(f"\n{title}")
+    print("  ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    for r in table:
+        print("  ".join(v.rjust(w) for v, w in zip(r, widths)))
+    for row in rows:
+        for key, value in row.items():
+            if isinstance(value, dict) and value:
+                print(f"  {columns[0]}={row[columns[0]]} {key}: {json.dumps(value)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="small sizes and few turns, for a smoke run")
+    parser.add_argument("--sizes", help="history lengths, in turns (default 10,100,1000,10000; quick: 10,100,1000)")
+    parser.add_argument("--sessions", help="concurrent session counts (default 1,4,16; quick: 1,4)")
+    parser.add_argument("--turns", type=int, help="measured chat turns per story (default 10; quick: 3)")
+    parser.add_argument("--concurrent-history", type=int, default=100, help="turns per story in the concurrency phase")
+    parser.add_argument("--message-words", type=int, default=40)
+    parser.add_argument("--token-rate", type=float, default=200.0)
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    parser.add_argument("--first-token-ms", type=float, default=20.0)
+    parser.add_argument("--summary-ms", type=float, default=20.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.2)
+    parser.add_argument("--model-parallel", type=int, default=4, help="OLLAMA_NUM_PARALLEL the backend assumes")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON")
+    args = parser.parse_args()
+    # --quick only picks the defaults; explicit options still win.
+    if args.quick:
+        defaults = {"sizes": "10,100,1000", "sessions": "1,4", "turns": 3}
+    else:
+        defaults = {"sizes": "10,100,1000,10000", "sessions": "1,4,16", "turns": 10}
+    for name, value in defaults.items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    session_counts = [int(s) for s in args.sessions.split(",") if s]
+
+    mock = MockOllama(token_rate=args.token_rate, reply_tokens=args.reply_tokens,
+                      first_token_ms=args.first_token_ms, summary_ms=args.summary_ms,
+                      malformed_rate=args.malformed_rate, seed=args.seed)
+    mock.start()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    # app.py opens its storage relative to the working directory and builds
+    # its Ollama client at import, so both are set up before importing it.
+    data_dir = tempfile.mkdtemp(prefix="questdm-bench-")
+    os.chdir(data_dir)
+    os.environ["OLLAMA_HOST"] = mock.host
+    os.environ["OLLAMA_NUM_PARALLEL"] = str(args.model_parallel)
+    os.environ["QUESTDM_MAX_QUEUE"] = str(max(session_counts + [1]) * 4)
+    rss_start = rss_bytes()
+    import app as backend
+
+    bench = Bench(args, backend, mock, Client(serve(backend.app)))
+    results = {
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "data_dir": data_dir,
+        "rss_at_start_bytes": rss_start,
+    }
+    results["summarization"] = bench.summarization_phase(sizes)
+    print_table("Summarization (malformed rate %s)" % args.malformed_rate, results["summarization"])
+    results["history"] = bench.history_phase(sizes)
+    print_table("History length", results["history"])
+    results["listing"] = bench.listing_phase()
+    print_table("Story listing", [results["listing"]])
+    results["concurrency"] = bench.concurrency_phase(session_counts)
+    print_table("Concurrent sessions", results["concurrency"])
+    results["rss_at_end_bytes"] = rss_bytes()
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+    print(f"\nData left in {data_dir}")
+
+
+if __name__ == "__main__":
+    main()
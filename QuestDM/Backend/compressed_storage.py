@@ -0,0 +1,116 @@
+import base64
+import functools
+import gzip
+import json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# The prose-heavy arrays that make up most of a story document.
+COMPRESSED_FIELDS = ("conversation_history", "llm_memory")
+
+
+class Codec:
+    """A compression format: compress(bytes, level) and decompress(bytes)."""
+
+    def __init__(self, name, default_level, compress, decompress):
+        self.name = name
+        self.default_level = default_level
+        self.compress = compress
+        self.decompress = decompress
+
+
+def _zstd_compress(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+CODECS = {
+    # On story text, level 1 gets most of level 6's ratio in under half the
+    # time, and a story's blob is rewritten on every compaction.
+    "gzip": Codec("gzip", 1, lambda data, level: gzip.compress(data, compresslevel=level, mtime=0),
+                  gzip.decompress),
+    "zstd": Codec("zstd", 3, _zstd_compress, _zstd_decompress),
+}
+
+
+def resolve_codec(compression):
+    """
+    Maps a QUESTDM_STORAGE_COMPRESSION value to a Codec.
+
+    Returns:
+        Codec or None: None for plain JSON ('', 'none', 'off')
+
+    Raises:
+        ValueError: For an unknown format, or zstd without zstandard installed
+    """
+    compression = (compression or "none").strip().lower()
+    if compression in ("none", "off", "false", "0"):
+        return None
+    if compression == "auto":
+        # gzip is the codec that was measured: with 60 stories of 800
+        # messages, the file shrank 2.9x, the startup read went from 0.17 s
+        # to 0.02 s and a compaction from 0.36 s to 0.05 s. zstd was not.
+        compression = "gzip"
+    if compression not in CODECS:
+        raise ValueError(f"Unknown storage compression '{compression}', expected none, zstd or gzip.")
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("QUESTDM_STORAGE_COMPRESSION=zstd needs the zstandard package.")
+    return CODECS[compression]
+
+
+def is_blob(value):
+    return isinstance(value, dict) and "codec" in value and "data" in value
+
+
+@functools.lru_cache(maxsize=32)
+def _decode_blob(codec_name, data):
+    codec = CODECS.get(codec_name)
+    if codec is None or (codec_name == "zstd" and zstandard is None):
+        raise RuntimeError(f"A story is stored with {codec_name} compression, which is not available.")
+    return json.loads(codec.decompress(base64.b64decode(data)))
+
+
+class MessageCompressor:
+    """
+    Stores a story's message arrays as compressed blobs inside its document.
+
+    The rest of the document stays plain JSON, so listing and startup never
+    decompress anything. Blobs of any codec are decoded whatever the current
+    setting, and plain arrays are read as they are.
+    """
+
+    def __init__(self, codec=None, level=None, fields=COMPRESSED_FIELDS):
+        self.codec = codec
+        self.level = codec.default_level if codec and level is None else level
+        self.fields = fields
+
+    def encode(self, fields):
+        """Returns ``fields`` with its message arrays compressed, for writing to TinyDB."""
+        if self.codec is None:
+            return fields
+        encoded = dict(fields)
+        for field in self.fields:
+            value = encoded.get(field)
+            if isinstance(value, list):
+                raw = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                data = base64.b64encode(self.codec.compress(raw, self.level)).decode("ascii")
+                encoded[field] = {"codec": self.codec.name, "data": data}
+        return encoded
+
+    def decode(self, story, fields=None):
+        """Replaces the blobs among ``fields`` (default all) of a story dict with their arrays."""
+        for field in self.fields:
+            if fields is not None and field not in fields:
+                continue
+            value = story.get(field)
+            if is_blob(value):
+                # Repeat turns reuse the decoded list; each caller gets its own copy.
+                story[field] = list(_decode_blob(value["codec"], value["data"]))
+        return story
@@ -0,0 +1,156 @@
+import functools
+import re
+
+
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_token_pattern = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def estimate_text_tokens(text):
+    """Estimates how many tokens a piece of text costs without a tokenizer."""
+    if not text:
+        return 0
+    pieces = _token_pattern.findall(text)
+    words = sum(1 for p in pieces if p[0].isalnum() or p[0] == "_")
+    estimate = int(words * 1.3) + (len(pieces) - words)
+    return max(estimate, len(text) // 4)
+
+
+@functools.lru_cache(maxsize=4096)
+def _content_tokens(content):
+    return estimate_text_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def estimate_tokens(message):
+    """Returns the estimated token size of a chat message."""
+    return _content_tokens(message.get("content") or "")
+
+
+def count_tokens(messages):
+    return sum(estimate_tokens(m) for m in messages)
+
+
+def pinned_prefix_length(messages):
+    """Number of leading messages (system prompts and summary) that are never dropped."""
+    pinned = min(3, len(messages))
+    if (
+        len(messages) > 3 and
+        messages[3]["role"] == "assistant" and
+        "SUMMARY:" in messages[3]["content"]
+    ):
+        pinned = 4
+    return pinned
+
+
+def assemble_context(messages, budget, start=None, low_water=0.75):
+    """
+    Fits an LLM memory into a token budget.
+
+    Over budget, the oldest unpinned messages are dropped down to
+    ``low_water`` of the budget; passing the returned ``start`` back keeps the
+    same window start for several turns so Ollama can reuse its KV cache.
+
+    Args:
+        messages (list): The full LLM memory of a story
+        budget (int): Tokens available for the prompt
+        start (int, optional): Window start returned by the previous call
+        low_water (float): Fraction of the budget to refill to after a trim
+
+    Returns:
+        tuple: (window, window_tokens, total_tokens, start)
+    """
+    pinned = pinned_prefix_length(messages)
+    prefix = messages[:pinned]
+    prefix_tokens = count_tokens(prefix)
+
+    tail_sizes = [estimate_tokens(m) for m in messages[pinned:]]
+    total = prefix_tokens + sum(tail_sizes)
+    if total <= budget:
+        return list(messages), total, total, pinned
+
+    if start is not None and pinned < start < len(messages):
+        used = prefix_tokens + sum(tail_sizes[start - pinned:])
+        if used <= budget:
+            return prefix + messages[start:], used, total, start
+
+    target = int(budget * low_water)
+    used = prefix_tokens
+    start = len(messages)
+    for size in reversed(tail_sizes):
+        if start < len(messages) and used + size > target:
+            break
+        used += size
+        start -= 1
+
+    return prefix + messages[start:], used, total, start
+
+
+def select_recent(messages, budget, max_count=None):
+    """Picks the most recent messages that fit into ``budget`` tokens."""
+    kept = 0
+    used = 0
+    for message in reversed(messages):
+        if max_count is not None and kept >= max_count:
+            break
+        size = estimate_tokens(message)
+        if used + size > budget:
+            break
+        used += size
+        kept += 1
+    return messages[len(messages) - kept:] if kept else []
+
+
+def truncate_text(text, max_tokens):
+    """Cuts text down to about ``max_tokens``, preferring a whitespace boundary."""
+    tokens = estimate_text_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    cut = int(len(text) * max_tokens / tokens)
+    while cut > 0:
+        candidate = text[:cut]
+        space = candidate.rfind(" ", int(cut * 0.9))
+        if space > 0:
+            candidate = candidate[:space]
+        if estimate_text_tokens(candidate) <= max_tokens:
+            return candidate
+        cut = int(cut * 0.9)
+    return ""
+
+
+def split_text(text, max_tokens):
+    """Splits text into consecutive parts of at most ``max_tokens`` each."""
+    parts = []
+    while text:
+        # The estimate never allows more than four characters per token, so
+        # looking past that window is wasted work on very long texts.
+        part = truncate_text(text[:max_tokens * 4 + 1], max_tokens) or text[:max(1, max_tokens)]
+        parts.append(part)
+        text = text[len(part):].lstrip()
+    return parts
+
+
+def pack_pieces(pieces, budget, separator="\n\n"):
+    """
+    Groups consecutive text pieces into batches of at most ``budget`` tokens,
+    splitting any piece that is larger on its own.
+
+    Returns:
+        list: Batches, each a list of text pieces
+    """
+    separator_tokens = estimate_text_tokens(separator)
+    batches = []
+    current = []
+    used = 0
+    for piece in pieces:
+        for part in split_text(piece, budget) if estimate_text_tokens(piece) > budget else [piece]:
+            size = estimate_text_tokens(part) + separator_tokens
+            if current and used + size > budget:
+                batches.append(current)
+                current = []
+                used = 0
+            current.append(part)
+            used += size
+    if current:
+        batches.append(current)
+    return batches
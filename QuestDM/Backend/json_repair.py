@@ -0,0 +1,233 @@
+import json
+
+
+class _Parser:
+    """
+    Single-pass parser for the almost-JSON an LLM writes: trailing or missing
+    commas, single quotes, unquoted keys, Python literals, comments and
+    truncated input.
+    """
+
+    LOOKAHEAD = 64
+    MAX_DEPTH = 128
+    LITERALS = {
+        "true": True, "false": False, "null": None,
+        "True": True, "False": False, "None": None,
+    }
+    ESCAPES = {'"': '"', "'": "'", "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.depth = 0
+
+    def skip(self):
+        text = self.text
+        n = len(text)
+        while self.pos < n:
+            c = text[self.pos]
+            if c.isspace():
+                self.pos += 1
+            elif text.startswith("//", self.pos):
+                end = text.find("\n", self.pos)
+                self.pos = n if end == -1 else end + 1
+            elif text.startswith("/*", self.pos):
+                end = text.find("*/", self.pos + 2)
+                self.pos = n if end == -1 else end + 2
+            else:
+                break
+
+    def peek(self):
+        self.skip()
+        return self.text[self.pos] if self.pos < len(self.text) else ""
+
+    def value(self):
+        c = self.peek()
+        if c == "{":
+            return self.container(self.object_body)
+        if c == "[":
+            return self.container(self.array_body)
+        if c in "\"'":
+            return self.string(c)
+        if c == "":
+            raise ValueError("Unexpected end of input.")
+        return self.bareword()
+
+    def container(self, body):
+        self.depth += 1
+        if self.depth > self.MAX_DEPTH:
+            raise ValueError("JSON is nested too deeply.")
+        self.pos += 1
+        result = body()
+        self.depth -= 1
+        return result
+
+    def object_body(self):
+        obj = {}
+        while True:
+            c = self.peek()
+            if c == "":
+                return obj
+            if c == "}":
+                self.pos += 1
+                return obj
+            if c in ",;":
+                self.pos += 1
+                continue
+            if c == "]":
+                # Mismatched bracket: treat it as the end of this object.
+                self.pos += 1
+                return obj
+            key = self.string(c, key=True) if c in "\"'" else self.bareword(key=True)
+            if key is None:
+                continue
+            if self.peek() in ":=":
+                self.pos += 1
+            if self.peek() in ",}":
+                obj[str(key)] = None
+                continue
+            if self.peek() == "":
+                obj[str(key)] = None
+                return obj
+            obj[str(key)] = self.value()
+
+    def array_body(self):
+        arr = []
+        while True:
+            c = self.peek()
+            if c == "":
+                return arr
+            if c == "]":
+                self.pos += 1
+                return arr
+            if c == ",":
+                self.pos += 1
+                continue
+            if c == "}":
+                self.pos += 1
+                return arr
+            arr.append(self.value())
+
+    def closes_string(self, after, key):
+        """Decides whether a quote at ``after - 1`` ends the string or is part of it."""
+        text = self.text
+        end = min(len(text), after + self.LOOKAHEAD)
+        i = after
+        while i < end and text[i].isspace():
+            i += 1
+        if i >= end:
+            return True
+        c = text[i]
+        if key:
+            return c in ":=,}"
+        if c in "}]:":
+            return True
+        if c in "\"'":
+            # A missing comma: the next token is a quoted key.
+            j = text.find(c, i + 1, end)
+            if j == -1:
+                return False
+            j += 1
+            while j < end and text[j].isspace():
+                j += 1
+            return j < end and text[j] == ":"
+        if c != ",":
+            return False
+        # A comma only ends the string if what follows looks like the next
+        # key or value rather than the rest of a sentence.
+        i += 1
+        while i < end and text[i].isspace():
+            i += 1
+        if i >= end:
+            return True
+        c = text[i]
+        if c in "\"'{[}]-/" or c.isdigit():
+            return True
+        j = i
+        while j < end and (text[j].isalnum() or text[j] == "_"):
+            j += 1
+        while j < end and text[j].isspace():
+            j += 1
+        return j < end and j > i and text[j] == ":"
+
+    def string(self, quote, key=False):
+        text = self.text
+        n = len(text)
+        self.pos += 1
+        parts = []
+        start = self.pos
+        while self.pos < n:
+            c = text[self.pos]
+            if c == "\\":
+                parts.append(text[start:self.pos])
+                self.pos += 1
+                if self.pos >= n:
+                    break
+                e = text[self.pos]
+                if e == "u" and self.pos + 4 < n:
+                    try:
+                        parts.append(chr(int(text[self.pos + 1:self.pos + 5], 16)))
+                        self.pos += 5
+                        start = self.pos
+                        continue
+                    except ValueError:
+                        pass
+                parts.append(self.ESCAPES.get(e, "\\" + e))
+                self.pos += 1
+                start = self.pos
+            elif c == quote:
+                if self.closes_string(self.pos + 1, key):
+                    parts.append(text[start:self.pos])
+                    self.pos += 1
+                    return "".join(parts)
+                self.pos += 1
+            else:
+                self.pos += 1
+        parts.append(text[start:self.pos])
+        return "".join(parts)
+
+    def bareword(self, key=False):
+        text = self.text
+        n = len(text)
+        start = self.pos
+        stops = ":=,}]{[" if key else ",}]"
+        while self.pos < n and text[self.pos] not in stops and text[self.pos] != "\n":
+            self.pos += 1
+        if self.pos == start:
+            # A stray structural character; skip it so parsing always advances.
+            self.pos += 1
+            return None
+        word = text[start:self.pos].strip()
+        if key:
+            return word.strip("\"'")
+        if word in self.LITERALS:
+            return self.LITERALS[word]
+        try:
+            return json.loads(word)
+        except ValueError:
+            return word
+
+
+def repair_json(text):
+    """
+    Parses the first JSON object or array in ``text``, repairing common damage.
+
+    Args:
+        text (str): Raw model output
+
+    Returns:
+        dict or list: The parsed value
+
+    Raises:
+        ValueError: If the text contains no object or array at all
+    """
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        raise ValueError("No JSON object or array found.")
+    start = min(starts)
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text, start)
+        return value
+    except (ValueError, RecursionError):
+        pass
+    return _Parser(text[start:]).value()
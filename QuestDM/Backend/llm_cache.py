@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import threading
+
+
+def request_key(model, messages, options=None, format=None):
+    """
+    Hash identifying one model request, shared with the session trace. Only
+    the role and content of each message count.
+    """
+    request = json.dumps({
+        "model": model,
+        "messages": [{"role": m.get("role"), "content": m.get("content")} for m in messages],
+        "options": options,
+        "format": format,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Persistent cache of non-streaming model replies, one ``<sha256>.json``
+    file per request. Past ``max_entries`` or ``max_bytes`` the least
+    recently used files are evicted.
+    """
+
+    def __init__(self, directory, max_entries=512, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._entries = {}       # key -> (mtime, size)
+        self._size = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        for file_name in os.listdir(self.directory):
+            key, ext = os.path.splitext(file_name)
+            if ext != ".json":
+                continue
+            stat = os.stat(os.path.join(self.directory, file_name))
+            self._entries[key] = (stat.st_mtime, stat.st_size)
+            self._size += stat.st_size
+        with self._lock:
+            self._evict()
+
+    key = staticmethod(request_key)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Returns the cached reply for a request key, or None on a miss."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    content = json.load(f)["content"]
+                os.utime(path)
+            except (OSError, ValueError, KeyError):
+                # Removed behind our back or torn by a crash; treat as a miss.
+                self._forget(key)
+                self.misses += 1
+                return None
+            self._entries[key] = (os.path.getmtime(path), self._entries[key][1])
+            self.hits += 1
+            return content
+
+    def put(self, key, content):
+        """Stores a reply and evicts the least recently used entries over budget."""
+        data = json.dumps({"content": content}, ensure_ascii=False).encode("utf-8")
+        path = self._path(key)
+        with self._lock:
+            temp_path = path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            if key in self._entries:
+                self._size -= self._entries[key][1]
+            self._entries[key] = (os.path.getmtime(path), len(data))
+            self._size += len(data)
+            self._evict()
+
+    def _forget(self, key):
+        mtime, size = self._entries.pop(key)
+        self._size -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        # Caller holds self._lock.
+        if len(self._entries) <= self.max_entries and self._size <= self.max_bytes:
+            return
+        for key in sorted(self._entries, key=lambda k: self._entries[k][0]):
+            if len(self._entries) <= self.max_entries and self._size <= self.max_bytes:
+                break
+            self._forget(key)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
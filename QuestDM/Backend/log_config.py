@@ -0,0 +1,44 @@
+import json
+import logging
+import os
+import sys
+
+
+# Attributes every LogRecord has; anything else was passed through ``extra``.
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any ``extra`` fields as top-level keys."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def configure_logging():
+    """
+    Sets up logging from ``QUESTDM_LOG_LEVEL`` (default WARNING) and
+    ``QUESTDM_LOG_FORMAT=json``. Logs go to stdout because the Electron shell
+    treats some stderr output as a missing Python install.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    if os.environ.get("QUESTDM_LOG_FORMAT", "").lower() == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(os.environ.get("QUESTDM_LOG_LEVEL", "WARNING").upper())
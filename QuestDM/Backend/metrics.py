@@ -0,0 +1,131 @@
+import bisect
+import threading
+from contextlib import contextmanager
+
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+WRITE_SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    """Cumulative-bucket histogram of one metric, one series per label set."""
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}   # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def snapshot(self):
+        series = []
+        for key, counts in self._series.items():
+            cumulative, total = [], 0
+            for count in counts[:-1]:
+                total += count
+                cumulative.append(total)
+            series.append({
+                "labels": dict(zip(self.labels, key)),
+                "count": total,
+                "sum": counts[-1],
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], cumulative)),
+            })
+        return {"help": self.help, "type": "histogram", "series": series}
+
+
+_context = threading.local()
+
+
+@contextmanager
+def labels(**values):
+    """Label values for the observations made on this thread inside the block."""
+    previous = getattr(_context, "labels", {})
+    _context.labels = {**previous, **values}
+    try:
+        yield
+    finally:
+        _context.labels = previous
+
+
+class MetricsRegistry:
+    """The set of histograms the backend records, safe to update from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def histogram(self, name, help_text, buckets, labels=()):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(name, help_text, buckets, labels)
+            return self._histograms[name]
+
+    def observe(self, name, value, **values):
+        # Labels not passed explicitly come from an enclosing labels() block.
+        values = {**getattr(_context, "labels", {}), **values}
+        with self._lock:
+            self._histograms[name].observe(value, **values)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: histogram.snapshot() for name, histogram in self._histograms.items()}
+
+    def prometheus(self):
+        """Renders every histogram in the Prometheus text exposition format."""
+        lines = []
+        for name, data in self.snapshot().items():
+            lines.append(f"# HELP {name} {data['help']}")
+            lines.append(f"# TYPE {name} histogram")
+            for series in data["series"]:
+                labels = [f'{k}="{_escape(v)}"' for k, v in series["labels"].items()]
+                for bound, count in series["buckets"].items():
+                    bucket_labels = ",".join(labels + ['le="%s"' % bound])
+                    lines.append(f"{name}_bucket{{{bucket_labels}}} {count}")
+                suffix = "{" + ",".join(labels) + "}" if labels else ""
+                lines.append(f"{name}_sum{suffix} {series['sum']}")
+                lines.append(f"{name}_count{suffix} {series['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+registry = MetricsRegistry()
+
+# story is the story's doc_id rather than its name on every metric, so renames
+# do not start a new series.
+registry.histogram(
+    "questdm_time_to_first_token_seconds", "Time from the model call to the first streamed token.",
+    SECONDS_BUCKETS, ("model", "story"))
+registry.histogram(
+    "questdm_tokens_per_second", "Generation speed reported by Ollama for a chat turn.",
+    RATE_BUCKETS, ("model", "story"))
+registry.histogram(
+    "questdm_prompt_eval_tokens", "Prompt tokens Ollama evaluated (not served from its cache) per turn.",
+    TOKEN_BUCKETS, ("model", "story"))
+registry.histogram(
+    "questdm_summarization_seconds", "Wall time of one background summarization.",
+    SECONDS_BUCKETS, ("model", "story"))
+registry.histogram(
+    "questdm_repair_attempts", "LLM JSON repair calls needed per summary that failed to parse.",
+    COUNT_BUCKETS, ("model",))
+# model is the model of the turn that made the write, if any.
+registry.histogram(
+    "questdm_db_write_seconds", "Latency of one write to storage.",
+    WRITE_SECONDS_BUCKETS, ("store", "model", "story"))
+registry.histogram(
+    "questdm_db_write_bytes", "Bytes written to storage per write.",
+    BYTES_BUCKETS, ("store", "model", "story"))
@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class ModelCatalog:
+    """
+    In-memory catalog of the models installed in Ollama, reloaded in the
+    background every ``ttl`` seconds so routes never wait on ``ollama.list()``.
+
+    Args:
+        client: Anything with Ollama's ``list()`` and ``show()`` (the
+            ``ollama`` module itself, or an ``ollama.Client``)
+        ttl (float): Seconds a loaded catalog stays fresh
+    """
+
+    def __init__(self, client, ttl=300.0):
+        self.client = client
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._models = None          # name -> entry, in Ollama's order
+        self._loaded_at = 0.0
+        self._context_lengths = {}   # digest -> context length
+        self._wakeup = threading.Event()
+        self._refresher = None
+
+    def _context_length(self, name, digest):
+        if digest and digest in self._context_lengths:
+            return self._context_lengths[digest]
+        try:
+            info = getattr(self.client.show(name), "modelinfo", None) or {}
+        except Exception as e:
+            logger.warning("Could not read the details of model '%s': %s", name, e)
+            return None
+        context_length = next(
+            (value for key, value in info.items() if key.endswith(".context_length")), None
+        )
+        if digest:
+            self._context_lengths[digest] = context_length
+        return context_length
+
+    def refresh(self):
+        """
+        Reloads the catalog from Ollama.
+
+        Returns:
+            list: The model entries
+
+        Raises:
+            ValueError: If Ollama's reply has an unexpected shape
+        """
+        models = getattr(self.client.list(), "models", None)
+        if not isinstance(models, list):
+            raise ValueError("Unexpected response format from ollama.list().")
+        entries = {}
+        for model in models:
+            name = getattr(model, "model", None)
+            if not name:
+                continue
+            details = getattr(model, "details", None)
+            entries[name] = {
+                "model_name": name,
+                "parameter_size": getattr(details, "parameter_size", None) or "N/A",
+                "quantization_level": getattr(details, "quantization_level", None) or "N/A",
+                "family": getattr(details, "family", None),
+                "size": getattr(model, "size", None),
+                "context_length": self._context_length(name, getattr(model, "digest", None)),
+            }
+        with self._lock:
+            self._models = entries
+            self._loaded_at = time.monotonic()
+        logger.debug("Model catalog refreshed: %s models", len(entries))
+        return list(entries.values())
+
+    def models(self):
+        """The catalog's entries, loaded on first use."""
+        with self._lock:
+            models = self._models
+            stale = time.monotonic() - self._loaded_at > self.ttl
+        if models is None or (stale and self._refresher is None):
+            return self.refresh()
+        if stale:
+            self._wakeup.set()
+        return list(models.values())
+
+    def names(self):
+        return [entry["model_name"] for entry in self.models()]
+
+    def get(self, name):
+        """The entry of one model, or None if it is not installed."""
+        for entry in self.models():
+            if entry["model_name"] == name:
+                return entry
+        return None
+
+    def invalidate(self):
+        """Forgets the catalog; the next read asks Ollama again."""
+        with self._lock:
+            self._models = None
+
+    def start_refresher(self):
+        """Starts the background thread that reloads the catalog every ``ttl`` seconds."""
+        if self._refresher is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.warning("Model catalog refresh failed: %s", e)
+                self._wakeup.wait(self.ttl)
+                self._wakeup.clear()
+
+        self._refresher = threading.Thread(target=run, name="model-catalog", daemon=True)
+        self._refresher.start()
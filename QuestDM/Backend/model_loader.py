@@ -0,0 +1,113 @@
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+# What Ollama accepts as keep_alive: seconds, or a duration such as "10m".
+# Negative keeps the model loaded indefinitely, 0 unloads it right away.
+_DURATION = re.compile(r"^-?\d+(\.\d+)?(ms|s|m|h)?$")
+
+
+def parse_keep_alive(value):
+    """
+    Validates a keep_alive setting.
+
+    Returns:
+        The value to pass to Ollama, or None for the server's default
+
+    Raises:
+        ValueError: If the value is not a number or a duration string
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise ValueError("keep_alive must be a number of seconds or a duration such as '10m'.")
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str) and _DURATION.match(value.strip()):
+        return value.strip()
+    raise ValueError("keep_alive must be a number of seconds or a duration such as '10m'.")
+
+
+class ModelLoader:
+    """
+    Unloads the previous model and preloads the new one in the background,
+    one job at a time. The preload must use the chat calls' ``num_ctx`` or
+    Ollama loads the model again on the first turn.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+        self._lock = threading.Lock()
+        self._states = {}     # model -> status dict
+        self._target = None
+
+    def _set(self, model, state, **fields):
+        with self._lock:
+            self._states[model] = {"state": state, "since": time.time(), **fields}
+
+    def switch(self, model, previous=None, keep_alive=None, options=None):
+        """Queues unloading ``previous`` and preloading ``model``; returns at once."""
+        with self._lock:
+            self._target = model
+        self._set(model, "loading")
+        if previous and previous != model:
+            self._set(previous, "unloading")
+        self._executor.submit(self._run, model, previous, keep_alive, options)
+
+    def _run(self, model, previous, keep_alive, options):
+        with self._lock:
+            # Switched back to it meanwhile: keep it rather than reload it.
+            keep_previous = previous == self._target
+        if previous and previous != model and not keep_previous:
+            try:
+                self.client.generate(model=previous, keep_alive=0)
+                self._set(previous, "unloaded")
+            except Exception as e:
+                logger.warning("Could not unload model '%s': %s", previous, e)
+                self._set(previous, "failed", error=str(e))
+
+        with self._lock:
+            superseded = self._target != model
+        if superseded:
+            logger.debug("Skipping preload of '%s', another model was selected", model)
+            self._set(model, "skipped")
+            return
+
+        started = time.perf_counter()
+        try:
+            self.client.generate(model=model, keep_alive=keep_alive, options=options)
+        except Exception as e:
+            logger.warning("Could not preload model '%s': %s", model, e)
+            self._set(model, "failed", error=str(e))
+            return
+        seconds = round(time.perf_counter() - started, 2)
+        logger.info("Model loaded", extra={"model": model, "load_seconds": seconds})
+        self._set(model, "ready", load_seconds=seconds)
+
+    def status(self, model):
+        """What the loader last did with ``model`` (state "unknown" if nothing)."""
+        with self._lock:
+            return dict(self._states.get(model) or {"state": "unknown"})
+
+    def resident(self):
+        """The models Ollama currently holds in memory, or None if it cannot be asked."""
+        try:
+            models = getattr(self.client.ps(), "models", None) or []
+        except Exception as e:
+            logger.debug("Could not list the loaded models: %s", e)
+            return None
+        resident = []
+        for model in models:
+            expires_at = getattr(model, "expires_at", None)
+            resident.append({
+                "model": getattr(model, "model", None),
+                "size_vram": getattr(model, "size_vram", None),
+                "expires_at": expires_at.isoformat() if hasattr(expires_at, "isoformat") else expires_at,
+            })
+        return resident
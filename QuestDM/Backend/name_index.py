@@ -0,0 +1,171 @@
+import threading
+import time
+
+from tinydb import TinyDB
+from tinydb.middlewares import CachingMiddleware
+from tinydb.table import Table
+
+import metrics
+
+
+class WriteThroughCachingMiddleware(CachingMiddleware):
+    """
+    Serves reads from the parsed database in memory but flushes every write,
+    so lookups stop re-reading the whole file without losing durability.
+    """
+
+    WRITE_CACHE_SIZE = 1
+
+    def flush(self):
+        if not self._cache_modified_count:
+            return
+        started = time.perf_counter()
+        super().flush()
+        metrics.registry.observe("questdm_db_write_seconds", time.perf_counter() - started, store="tinydb")
+        # JSONStorage rewrites the whole file, so its position is the bytes written.
+        handle = getattr(self.storage, "_handle", None)
+        if handle is not None:
+            metrics.registry.observe("questdm_db_write_bytes", handle.tell(), store="tinydb")
+
+
+class LockedTable(Table):
+    """
+    TinyDB table whose reads and writes share one lock; request threads, the
+    summarizer and the turn-log compactor all use the same tables.
+    """
+
+    lock = threading.RLock()
+
+    def _update_table(self, updater):
+        with self.lock:
+            super()._update_table(updater)
+
+    def get(self, *args, **kwargs):
+        with self.lock:
+            return super().get(*args, **kwargs)
+
+    def all(self):
+        with self.lock:
+            return super().all()
+
+    def search(self, cond):
+        with self.lock:
+            return super().search(cond)
+
+    def contains(self, *args, **kwargs):
+        with self.lock:
+            return super().contains(*args, **kwargs)
+
+    def __len__(self):
+        with self.lock:
+            return super().__len__()
+
+
+class LockedTinyDB(TinyDB):
+    table_class = LockedTable
+
+
+class NameIndex:
+    """
+    In-memory ``name -> doc_id`` index over one TinyDB table. Writes to the
+    table go through it; a duplicate name resolves to the oldest document.
+    """
+
+    def __init__(self, table, field="name"):
+        self.table = table
+        self.field = field
+        self._ids = {}
+        self._lock = threading.RLock()
+        self.rebuild()
+
+    def rebuild(self):
+        ids = {}
+        for doc in self.table.all():
+            ids.setdefault(doc.get(self.field), []).append(doc.doc_id)
+        with self._lock:
+            self._ids = ids
+
+    def _add(self, name, doc_id):
+        ids = self._ids.setdefault(name, [])
+        ids.append(doc_id)
+        ids.sort()
+
+    def _discard(self, name, doc_id):
+        ids = self._ids.get(name)
+        if ids and doc_id in ids:
+            ids.remove(doc_id)
+            if not ids:
+                del self._ids[name]
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def doc_id(self, name):
+        ids = self._ids.get(name)
+        return ids[0] if ids else None
+
+    def get(self, name):
+        """Returns the document with the given name, or None."""
+        doc_id = self.doc_id(name)
+        if doc_id is None:
+            return None
+        return self.table.get(doc_id=doc_id)
+
+    def insert(self, document):
+        with self._lock:
+            doc_id = self.table.insert(document)
+            self._add(document.get(self.field), doc_id)
+            return doc_id
+
+    def update(self, fields, doc_id):
+        """Updates one document, moving its index entry if it was renamed."""
+        with self._lock:
+            old = self.table.get(doc_id=doc_id)
+            self.table.update(fields, doc_ids=[doc_id])
+            if old is not None and self.field in fields and fields[self.field] != old.get(self.field):
+                self._discard(old.get(self.field), doc_id)
+                self._add(fields[self.field], doc_id)
+
+    def remove(self, doc_id):
+        with self._lock:
+            old = self.table.get(doc_id=doc_id)
+            self.table.remove(doc_ids=[doc_id])
+            if old is not None:
+                self._discard(old.get(self.field), doc_id)
+
+
+class TemplateIndex:
+    """Maps a character template's name to the stories holding a copy of it."""
+
+    def __init__(self):
+        self._stories = {}     # template name -> set of doc_ids
+        self._templates = {}   # doc_id -> set of template names
+        self._lock = threading.Lock()
+
+    def track(self, doc_id, characters):
+        """Records the templates behind a story's current characters."""
+        if isinstance(characters, dict):
+            characters = characters.values()
+        templates = {
+            char["template_origin"] for char in characters or ()
+            if isinstance(char, dict) and char.get("template_origin")
+        }
+        with self._lock:
+            for name in self._templates.pop(doc_id, set()) - templates:
+                self._stories[name].discard(doc_id)
+                if not self._stories[name]:
+                    del self._stories[name]
+            for name in templates:
+                self._stories.setdefault(name, set()).add(doc_id)
+            if templates:
+                self._templates[doc_id] = templates
+
+    def remove(self, doc_id):
+        self.track(doc_id, ())
+
+    def doc_ids(self, template):
+        with self._lock:
+            return sorted(self._stories.get(template, ()))
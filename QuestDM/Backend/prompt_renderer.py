@@ -0,0 +1,104 @@
+import threading
+
+
+def normalize_characters(characters):
+    """Returns a story's characters as a name -> character dict (older stories store a list)."""
+    if isinstance(characters, dict):
+        return dict(characters)
+    char_dict = {}
+    if isinstance(characters, list):
+        for char in characters:
+            if isinstance(char, dict) and 'name' in char:
+                char_dict[char['name']] = char
+    return char_dict
+
+
+def render_story_details(story):
+    return {
+        "role": "system",
+        "content": (
+            f"Story Details:\n"
+            f"Name: {story.get('name', 'Unknown')}\n"
+            f"Description: {story.get('description', 'No description')}\n"
+            f"Genre: {story.get('genre', 'N/A')}\n"
+        )
+    }
+
+
+def render_characters(characters):
+    character_details = "Story Characters:\n"
+    for char_name, char in normalize_characters(characters).items():
+        if isinstance(char, dict):
+            details = f"{char.get('name', 'Unknown')} (Race: {char.get('race', 'Unknown')}, Class: {char.get('class', 'Unknown')})\n"
+            if char.get('backstory'):
+                details += f"Backstory: {char.get('backstory')}\n"
+            if char.get('status'):
+                details += f"Status: {char.get('status')}\n"
+
+            advanced_info = []
+            for key, value in char.items():
+                if key not in ['name', 'race', 'class', 'backstory', 'status', 'template_origin'] and value:
+                    advanced_info.append(f"{key}: {value}")
+            if advanced_info:
+                details += "Advanced: " + ", ".join(advanced_info) + "\n"
+
+            character_details += details + "\n"
+
+    return {
+        "role": "system",
+        "content": character_details
+    }
+
+
+class PromptRenderer:
+    """
+    Caches a story's three system prompts until ``bump()`` marks them stale.
+    """
+
+    def __init__(self, mode_prompts):
+        self.mode_prompts = mode_prompts
+        self._versions = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def version(self, story_key):
+        return self._versions.get(story_key, 0)
+
+    def bump(self, story_key):
+        """Marks a story's prompts as stale."""
+        with self._lock:
+            self._versions[story_key] = self._versions.get(story_key, 0) + 1
+            self._cache.pop(story_key, None)
+
+    def forget(self, story_key):
+        with self._lock:
+            self._versions.pop(story_key, None)
+            self._cache.pop(story_key, None)
+
+    def render(self, story_key, story):
+        """
+        Returns the prompts for a story, rendering them only if its version changed.
+
+        Args:
+            story_key: Stable key of the story (its TinyDB doc_id)
+            story (dict): The materialized story
+
+        Returns:
+            tuple: (mode prompt or None for an unknown mode, story details prompt, character prompt)
+        """
+        with self._lock:
+            version = self._versions.get(story_key, 0)
+            cached = self._cache.get(story_key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+        prompts = (
+            self.mode_prompts.get(story.get('mode')),
+            render_story_details(story),
+            render_characters(story.get('characters', {}))
+        )
+
+        with self._lock:
+            if self._versions.get(story_key, 0) == version:
+                self._cache[story_key] = (version, prompts)
+        return prompts
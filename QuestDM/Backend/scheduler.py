@@ -0,0 +1,172 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+
+INTERACTIVE = 0
+SUMMARIZATION = 1
+REPAIR = 2
+
+
+class QueueFull(Exception):
+    """Raised when a call is submitted while the scheduler's queue is full."""
+
+    def __init__(self, queued):
+        super().__init__(f"{queued} model calls are already waiting.")
+        self.queued = queued
+
+
+class Ticket:
+    """A queued model call; ``release()`` frees its slot or leaves the queue."""
+
+    def __init__(self, scheduler, priority, seq):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.seq = seq
+        self.queued_at = time.monotonic()
+        self._granted = threading.Event()
+        self._callbacks = []
+        self._released = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    @property
+    def granted(self):
+        return self._granted.is_set()
+
+    def wait(self, timeout=None):
+        """Blocks until the call may run; returns False if ``timeout`` expired first."""
+        return self._granted.wait(timeout)
+
+    async def wait_async(self, timeout=None):
+        """Awaits the slot without tying up a thread; returns False on timeout."""
+        if self.granted:
+            return True
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        self.scheduler._on_grant(self, wake)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.scheduler._drop_callback(self, wake)
+
+    def position(self):
+        """1-based position in the queue, or 0 once the call is running."""
+        return self.scheduler._position(self)
+
+    def release(self):
+        self.scheduler._release(self)
+
+
+class ModelScheduler:
+    """
+    Orders Ollama calls by priority and caps how many run at once.
+
+    ``limit`` should match the server's ``OLLAMA_NUM_PARALLEL``. A call queued
+    longer than ``max_wait`` seconds goes next whatever its priority, and
+    past ``max_queue`` waiting calls ``submit()`` raises QueueFull.
+    """
+
+    def __init__(self, limit=1, max_queue=32, max_wait=30.0):
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._queue = []
+        self._running = 0
+        self._seq = itertools.count()
+
+    def submit(self, priority, admit=True):
+        """
+        Queues a call and returns its Ticket.
+
+        Args:
+            priority (int): INTERACTIVE, SUMMARIZATION or REPAIR
+            admit (bool): Apply admission control; background work that has
+                nowhere to report a 429 passes False and always queues
+
+        Raises:
+            QueueFull: If ``admit`` and ``max_queue`` calls are already waiting
+        """
+        with self._lock:
+            if admit and len(self._queue) >= self.max_queue:
+                raise QueueFull(len(self._queue))
+            ticket = Ticket(self, priority, next(self._seq))
+            heapq.heappush(self._queue, ticket)
+            self._dispatch()
+        return ticket
+
+    @contextmanager
+    def slot(self, priority):
+        """Runs the body of the ``with`` block once a slot is free (for background calls)."""
+        ticket = self.submit(priority, admit=False)
+        try:
+            ticket.wait()
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self):
+        with self._lock:
+            return {"running": self._running, "queued": len(self._queue), "limit": self.limit}
+
+    def _next(self):
+        # Caller holds self._lock.
+        overdue = time.monotonic() - self.max_wait
+        starved = [t for t in self._queue if t.queued_at <= overdue]
+        ticket = min(starved, key=lambda t: t.seq) if starved else None
+        if ticket is None or ticket is self._queue[0]:
+            return heapq.heappop(self._queue)
+        self._queue.remove(ticket)
+        heapq.heapify(self._queue)
+        return ticket
+
+    def _dispatch(self):
+        # Caller holds self._lock.
+        while self._queue and self._running < self.limit:
+            ticket = self._next()
+            self._running += 1
+            ticket._granted.set()
+            for callback in ticket._callbacks:
+                callback()
+            ticket._callbacks = []
+
+    def _on_grant(self, ticket, callback):
+        with self._lock:
+            if ticket.granted:
+                callback()
+            else:
+                ticket._callbacks.append(callback)
+
+    def _drop_callback(self, ticket, callback):
+        with self._lock:
+            if callback in ticket._callbacks:
+                ticket._callbacks.remove(callback)
+
+    def _position(self, ticket):
+        with self._lock:
+            if ticket.granted or ticket._released:
+                return 0
+            return 1 + sum(1 for other in self._queue if other < ticket)
+
+    def _release(self, ticket):
+        with self._lock:
+            if ticket._released:
+                return
+            ticket._released = True
+            if ticket.granted:
+                self._running -= 1
+            else:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+            self._dispatch()
@@ -0,0 +1,159 @@
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+
+# Rough per-message overhead of a {"role": ..., "content": ...} dict.
+MESSAGE_OVERHEAD = 200
+
+
+def message_size(message):
+    content = message.get("content") if isinstance(message, dict) else None
+    return MESSAGE_OVERHEAD + (len(content) if isinstance(content, str) else 0)
+
+
+class SessionCache:
+    """
+    LRU cache of the in-memory state of open stories, one dict-like ``view``
+    per field. Past ``max_entries`` sessions or ``max_bytes`` of messages the
+    least recently used unpinned sessions are dropped; the turn log already
+    holds their changes, so they reload on the next turn.
+    """
+
+    def __init__(self, max_entries=64, max_bytes=256 * 1024 * 1024, pinned=None, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.pinned = pinned or (lambda key: False)
+        self.on_evict = on_evict
+        self.evictions = 0
+
+        self._lock = threading.RLock()
+        self._sessions = OrderedDict()   # key -> {field: value}
+        self._sizes = {}                 # (key, field) -> (list id, messages measured, bytes)
+        self._dirty = set()
+        self._size = 0
+
+    def view(self, field):
+        return SessionField(self, field)
+
+    def _touch(self, key):
+        # Caller holds self._lock. The caller may be about to append to the
+        # value it fetched, so it is measured again at the next eviction check.
+        self._sessions.move_to_end(key)
+        self._dirty.add(key)
+
+    def _measure(self, key):
+        # Caller holds self._lock. Lists that only grew since the last check
+        # are measured from where that check stopped.
+        for field, value in self._sessions.get(key, {}).items():
+            old_id, counted, size = self._sizes.get((key, field), (None, 0, 0))
+            if not isinstance(value, list):
+                continue
+            if id(value) == old_id and len(value) >= counted:
+                new_size = size + sum(message_size(m) for m in value[counted:])
+            else:
+                new_size = sum(message_size(m) for m in value)
+            self._size += new_size - size
+            self._sizes[(key, field)] = (id(value), len(value), new_size)
+
+    def _forget_size(self, key, field):
+        _, _, size = self._sizes.pop((key, field), (None, 0, 0))
+        self._size -= size
+
+    def _over_budget(self):
+        return len(self._sessions) > self.max_entries or self._size > self.max_bytes
+
+    def evict(self):
+        """Drops least recently used sessions until the cache is within budget."""
+        evicted = []
+        with self._lock:
+            for key in self._dirty:
+                self._measure(key)
+            self._dirty.clear()
+            if self._over_budget():
+                for key in list(self._sessions):
+                    if not self._over_budget():
+                        break
+                    if self.pinned(key):
+                        continue
+                    self._drop(key)
+                    self.evictions += 1
+                    evicted.append(key)
+        if self.on_evict:
+            for key in evicted:
+                self.on_evict(key)
+        return evicted
+
+    def _drop(self, key):
+        for field in self._sessions.pop(key, {}):
+            self._forget_size(key, field)
+        self._dirty.discard(key)
+
+    def _get(self, key, field):
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None or field not in session:
+                raise KeyError(key)
+            self._touch(key)
+            return session[field]
+
+    def _set(self, key, field, value):
+        with self._lock:
+            self._sessions.setdefault(key, {})[field] = value
+            self._touch(key)
+        self.evict()
+
+    def _delete(self, key, field):
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None or field not in session:
+                raise KeyError(key)
+            del session[field]
+            self._forget_size(key, field)
+            if not session:
+                self._drop(key)
+
+    def _keys(self, field):
+        with self._lock:
+            return [key for key, session in self._sessions.items() if field in session]
+
+    def stats(self):
+        with self._lock:
+            for key in self._dirty:
+                self._measure(key)
+            self._dirty.clear()
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._size,
+                "evictions": self.evictions,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class SessionField(MutableMapping):
+    """Dict-like view of one field of every session in a SessionCache."""
+
+    def __init__(self, cache, field):
+        self.cache = cache
+        self.field = field
+
+    def __getitem__(self, key):
+        return self.cache._get(key, self.field)
+
+    def __setitem__(self, key, value):
+        self.cache._set(key, self.field, value)
+
+    def __delitem__(self, key):
+        self.cache._delete(key, self.field)
+
+    def __contains__(self, key):
+        # Unlike __getitem__, a membership test does not count as a use.
+        with self.cache._lock:
+            return self.field in self.cache._sessions.get(key, {})
+
+    def __iter__(self):
+        return iter(self.cache._keys(self.field))
+
+    def __len__(self):
+        return len(self.cache._keys(self.field))
@@ -0,0 +1,61 @@
+import threading
+
+
+class StoryLocks:
+    """
+    One lock per story, held by a chat turn until its reply is persisted.
+    ``acquire()`` returns an idempotent release function for that reason;
+    ``on_release(key)`` runs after every release.
+    """
+
+    def __init__(self, on_release=None):
+        self.on_release = on_release
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def acquire(self, key, timeout=None):
+        """
+        Waits for a story's lock.
+
+        Args:
+            key: Stable key of the story (its TinyDB doc_id)
+            timeout (float, optional): Seconds to wait; None waits forever
+
+        Returns:
+            callable or None: Function releasing the lock (extra calls are no-ops),
+            or None if the timeout expired
+        """
+        lock = self._get(key)
+        if not lock.acquire(timeout=-1 if timeout is None else timeout):
+            return None
+
+        state = {"held": True}
+        guard = threading.Lock()
+
+        def release():
+            with guard:
+                if not state["held"]:
+                    return
+                state["held"] = False
+            lock.release()
+            if self.on_release is not None:
+                self.on_release(key)
+
+        return release
+
+    def locked(self, key):
+        with self._lock:
+            lock = self._locks.get(key)
+        return lock is not None and lock.locked()
+
+    def forget(self, key):
+        """Drops the lock of a deleted story."""
+        with self._lock:
+            self._locks.pop(key, None)
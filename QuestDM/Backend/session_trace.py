@@ -0,0 +1,145 @@
+import gzip
+import json
+import threading
+import time
+
+from llm_cache import request_key
+
+
+TRACE_VERSION = 1
+
+# Counters of a reply's final chunk worth keeping for replay.
+STAT_FIELDS = (
+    "done_reason", "total_duration", "load_duration", "prompt_eval_count",
+    "prompt_eval_duration", "eval_count", "eval_duration",
+)
+
+
+def reply_stats(chunk):
+    return {field: chunk.get(field) for field in STAT_FIELDS if chunk.get(field) is not None}
+
+
+class TraceRecorder:
+    """
+    Opt-in recorder of a backend session for benchmarks/replay.py, one JSON
+    record per line in a gzip file: ``start``, ``http`` requests and
+    ``model`` calls. Prompts are stored only as their hash; request bodies
+    and replies, and so the story text, are stored in full.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._origin = time.perf_counter()
+        self._write({"type": "start", "version": TRACE_VERSION, "time": time.time()})
+
+    def offset(self, moment=None):
+        """Seconds from the start of the trace to ``moment`` (a perf_counter value, default now)."""
+        return round((time.perf_counter() if moment is None else moment) - self._origin, 4)
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def http(self, method, path, query, body, status, started):
+        self._write({
+            "type": "http", "t": self.offset(started), "duration": round(time.perf_counter() - started, 4),
+            "method": method, "path": path, "query": query, "body": body, "status": status,
+        })
+
+    def _model_record(self, started, model, messages, options, format, stream):
+        return {
+            "type": "model", "t": self.offset(started), "stream": stream, "model": model,
+            "key": request_key(model, messages, options, format),
+            "messages": len(messages),
+            "prompt_chars": sum(len(m.get("content") or "") for m in messages),
+            "format": format is not None,
+        }
+
+    def model_call(self, started, model, messages, options, format, response):
+        """Records a finished non-streaming call."""
+        record = self._model_record(started, model, messages, options, format, False)
+        record["duration"] = round(time.perf_counter() - started, 4)
+        record["content"] = (response.get("message") or {}).get("content") or ""
+        record["stats"] = reply_stats(response)
+        self._write(record)
+
+    def _stream_record(self, model, messages, options):
+        started = time.perf_counter()
+        record = self._model_record(started, model, messages, options, None, True)
+        record["chunks"] = []
+        return started, record
+
+    def _stream_chunk(self, started, record, chunk):
+        content = (chunk.get("message") or {}).get("content") or ""
+        if content:
+            record["chunks"].append([round(time.perf_counter() - started, 4), content])
+        if chunk.get("done"):
+            record["stats"] = reply_stats(chunk)
+
+    def _stream_end(self, started, record):
+        record["duration"] = round(time.perf_counter() - started, 4)
+        if "stats" not in record:
+            record["interrupted"] = True
+        self._write(record)
+
+    def record_stream(self, stream, model, messages, options):
+        """Passes a streaming reply through, recording it once it ends or is closed."""
+        started, record = self._stream_record(model, messages, options)
+        try:
+            for chunk in stream:
+                self._stream_chunk(started, record, chunk)
+                yield chunk
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+            self._stream_end(started, record)
+
+    async def record_async_stream(self, stream, model, messages, options):
+        """Async counterpart of record_stream()."""
+        started, record = self._stream_record(model, messages, options)
+        try:
+            async for chunk in stream:
+                self._stream_chunk(started, record, chunk)
+                yield chunk
+        finally:
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+            self._stream_end(started, record)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_trace(path):
+    """
+    Yields the records of a trace file, putting several recording sessions on
+    one timeline and skipping a torn last line.
+    """
+    base = 0.0
+    last = 0.0
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        lines = iter(f)
+        while True:
+            try:
+                line = next(lines)
+            except (StopIteration, EOFError):
+                return
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return
+            if record.get("type") == "start":
+                base = last
+            elif "t" in record:
+                record["t"] += base
+                last = max(last, record["t"] + record.get("duration", 0))
+            yield record
@@ -0,0 +1,64 @@
+import json
+import time
+
+
+def sse_frame(payload, event=None):
+    """Encodes one SSE frame; ``event`` names its type (default "message")."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload)}\n\n"
+
+
+class FrameCoalescer:
+    """
+    Batches streamed reply text into fewer, larger SSE frames, flushed after
+    ``flush_ms`` or ``flush_bytes``, whichever comes first (0 ms disables it).
+    Text arriving after ``flush_ms`` without a frame is sent at once, so a
+    slow model's tokens are not held back. Text of different event types is
+    never merged into one frame.
+    """
+
+    def __init__(self, flush_ms=30, flush_bytes=1024):
+        self.flush_interval = flush_ms / 1000.0
+        self.flush_bytes = flush_bytes
+        self._parts = []
+        self._size = 0
+        self._started = None
+        self._event = None
+        self._sent = None
+
+    def add(self, text, event=None):
+        """Buffers reply text of one event type; returns the frames that are due now."""
+        if not text:
+            return []
+        frames = self.flush() if self._parts and event != self._event else []
+        if not self._parts and self._idle():
+            self._sent = time.monotonic()
+            return frames + [sse_frame({'content': text}, event)]
+        if not self._parts:
+            self._started = time.monotonic()
+            self._event = event
+        self._parts.append(text)
+        self._size += len(text.encode("utf-8"))
+        if self._size >= self.flush_bytes or self.remaining() == 0:
+            frames += self.flush()
+        return frames
+
+    def _idle(self):
+        return self._sent is None or time.monotonic() - self._sent >= self.flush_interval
+
+    def remaining(self):
+        """Seconds until the buffered text is due, or None when nothing is buffered."""
+        if not self._parts:
+            return None
+        return max(0.0, self.flush_interval - (time.monotonic() - self._started))
+
+    def flush(self):
+        """Returns the buffered text as a frame (if any) and empties the buffer."""
+        if not self._parts:
+            return []
+        text = "".join(self._parts)
+        self._parts = []
+        self._size = 0
+        self._started = None
+        self._sent = time.monotonic()
+        return [sse_frame({'content': text}, self._event)]
@@ -0,0 +1,119 @@
+import base64
+import bisect
+import json
+import threading
+
+
+class SortedIndex:
+    """
+    Keeps ``(key, doc_id)`` entries sorted so pages are cut without sorting;
+    the doc_id breaks ties, so a cursor resumes exactly after its entry.
+    """
+
+    def __init__(self):
+        self._keys = {}
+        self._entries = []
+        self._lock = threading.Lock()
+
+    def __contains__(self, doc_id):
+        return doc_id in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def set(self, doc_id, key):
+        with self._lock:
+            old = self._keys.get(doc_id)
+            if old == key:
+                return
+            if old is not None:
+                i = bisect.bisect_left(self._entries, (old, doc_id))
+                if i < len(self._entries) and self._entries[i] == (old, doc_id):
+                    del self._entries[i]
+            self._keys[doc_id] = key
+            bisect.insort(self._entries, (key, doc_id))
+
+    def remove(self, doc_id):
+        with self._lock:
+            old = self._keys.pop(doc_id, None)
+            if old is not None:
+                i = bisect.bisect_left(self._entries, (old, doc_id))
+                if i < len(self._entries) and self._entries[i] == (old, doc_id):
+                    del self._entries[i]
+
+    def page(self, after=None, limit=50):
+        """
+        Returns up to ``limit`` doc_ids following the entry ``after``.
+
+        Returns:
+            tuple: (doc_ids, last entry of the page or None if nothing follows)
+        """
+        with self._lock:
+            start = bisect.bisect_right(self._entries, tuple(after)) if after else 0
+            entries = self._entries[start:start + limit]
+            has_more = start + limit < len(self._entries)
+        return [doc_id for _, doc_id in entries], (entries[-1] if entries and has_more else None)
+
+
+def encode_cursor(sort, entry):
+    raw = json.dumps([sort, list(entry)], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """
+    Returns ``(sort, entry)`` from a cursor made by encode_cursor().
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        sort, entry = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        key, doc_id = entry
+        return sort, (key, int(doc_id))
+    except Exception:
+        raise ValueError("Invalid cursor.")
+
+
+class StoryListing:
+    """Sorted story indexes for /list_stories, most recently played first."""
+
+    SORTS = ("last_activity", "name")
+
+    def __init__(self):
+        self.indexes = {sort: SortedIndex() for sort in self.SORTS}
+
+    def track(self, doc_id, story):
+        """Indexes the ``name`` and ``last_activity`` present in ``story``."""
+        if "name" in story:
+            self.indexes["name"].set(doc_id, str(story["name"]).casefold())
+        activity = self.indexes["last_activity"]
+        if "last_activity" in story:
+            activity.set(doc_id, -float(story["last_activity"] or 0))
+        elif doc_id not in activity:
+            # Stories from before activity tracking sort after every played one.
+            activity.set(doc_id, 0.0)
+
+    def touch(self, doc_id, timestamp):
+        self.indexes["last_activity"].set(doc_id, -float(timestamp))
+
+    def remove(self, doc_id):
+        for index in self.indexes.values():
+            index.remove(doc_id)
+
+    def page(self, sort, cursor=None, limit=50):
+        """
+        Returns one page of doc_ids and the cursor of the next page.
+
+        Raises:
+            ValueError: For an unknown sort or a cursor from another sort
+        """
+        if sort not in self.indexes:
+            raise ValueError(f"Unknown sort '{sort}'.")
+        after = None
+        if cursor:
+            cursor_sort, after = decode_cursor(cursor)
+            if cursor_sort != sort:
+                raise ValueError("Cursor does not belong to this sort order.")
+        doc_ids, last = self.indexes[sort].page(after, limit)
+        return doc_ids, (encode_cursor(sort, last) if last else None)
@@ -0,0 +1,49 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# For the mock Ollama server in benchmarks/mock_ollama.py.
+sys.path.insert(1, os.path.join(BACKEND_DIR, "benchmarks"))
+
+
+@pytest.fixture(scope="session")
+def backend(tmp_path_factory):
+    """The app module, imported in a scratch data directory with no Ollama behind it."""
+    data_dir = tmp_path_factory.mktemp("data")
+    previous = os.getcwd()
+    os.environ["OLLAMA_HOST"] = "127.0.0.1:9"
+    os.chdir(data_dir)
+    try:
+        yield importlib.import_module("app")
+    finally:
+        os.chdir(previous)
+
+
+@pytest.fixture
+def client(backend):
+    return backend.app.test_client()
+
+
+@pytest.fixture
+def mock_ollama(monkeypatch):
+    """Starts a mock Ollama server that streamed turns are sent to; returns a function taking its settings."""
+    from mock_ollama import MockOllama
+
+    servers = []
+
+    def start(**settings):
+        server = MockOllama(**settings)
+        server.start()
+        servers.append(server)
+        monkeypatch.setenv("OLLAMA_HOST", server.host)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
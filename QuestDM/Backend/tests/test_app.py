@@ -0,0 +1,147 @@
+import threading
+import time
+
+
+def create_story(client, name, characters=()):
+    response = client.post('/create_story', json={
+        'name': name, 'description': 'A test story.', 'genre': 'Fantasy', 'mode': 'dnd',
+        'characters': list(characters)
+    })
+    assert response.status_code == 200
+    return response.get_json()['story']
+
+
+def test_edit_after_summary_keeps_the_edit(backend, client):
+    create_story(client, 'Edit after summary')
+    doc_id = backend.story_index.doc_id('Edit after summary')
+    # What apply_pending_summary() writes for a summary that found a new character.
+    backend.turn_log.set(doc_id, characters={
+        'Bob': {'name': 'Bob', 'race': 'Human', 'class': 'Rogue'},
+        'Goblin': {'name': 'Goblin', 'race': 'Goblin', 'class': 'Warrior'},
+    })
+
+    response = client.put('/edit_story', json={
+        'originalName': 'Edit after summary',
+        'characters': {'Bob': {'name': 'Bob', 'race': 'Human', 'class': 'Rogue'}},
+    })
+    assert response.status_code == 200
+    assert list(response.get_json()['characters']) == ['Bob']
+
+    loaded = client.post('/load_story', json={'name': 'Edit after summary'}).get_json()
+    assert list(loaded['story']['characters']) == ['Bob']
+
+    backend.turn_log.compact(doc_id)
+    stored = backend.story_creation_table.get(doc_id=doc_id)
+    assert list(stored['characters']) == ['Bob']
+
+
+
+def test_edit_story_returns_the_light_fields_of_load_story(backend, client):
+    create_story(client, 'Light edit')
+    backend.turn_log.set(backend.story_index.doc_id('Light edit'),
+                         conversation_history=[{'role': 'user', 'content': 'Hi'}], current_summary='So far.')
+
+    edited = client.put('/edit_story', json={'originalName': 'Light edit', 'genre': 'Horror'}).get_json()
+    loaded = client.post('/load_story', json={'name': 'Light edit'}).get_json()['story']
+    assert edited == loaded
+    assert edited['genre'] == 'Horror' and edited['current_summary'] == 'So far.'
+    assert 'conversation_history' not in edited and 'llm_memory' not in edited
+
+def test_rename_onto_an_existing_story_is_refused(client):
+    create_story(client, 'Rename source')
+    create_story(client, 'Rename target')
+    response = client.put('/edit_story', json={'originalName': 'Rename source', 'name': 'Rename target'})
+    assert response.status_code == 409
+    assert client.post('/load_story', json={'name': 'Rename source'}).status_code == 200
+
+
+def test_rename_drops_the_sessions_of_the_old_name(backend, client):
+    create_story(client, 'Old name')
+    assert client.post('/load_story', json={'name': 'Old name'}).status_code == 200
+    assert 'Old name' in backend.llm_conversations
+
+    response = client.put('/edit_story', json={'originalName': 'Old name', 'name': 'New name'})
+    assert response.status_code == 200
+    assert 'Old name' not in backend.llm_conversations
+    assert 'Old name' not in backend.story_index
+    loaded = client.post('/load_story', json={'name': 'New name'}).get_json()
+    assert loaded['story']['name'] == 'New name'
+
+
+def test_story_routes_do_not_wait_for_a_running_turn(backend, client, monkeypatch):
+    monkeypatch.setattr(backend, 'story_busy_timeout', 0)
+    create_story(client, 'Busy story')
+    release = backend.story_locks.acquire(backend.story_index.doc_id('Busy story'))
+    try:
+        for method, path in (('post', '/load_story'), ('put', '/edit_story'), ('delete', '/delete_story'),
+                             ('post', '/chat')):
+            response = getattr(client, method)(path, json={
+                'name': 'Busy story', 'story_name': 'Busy story', 'message': 'Hello'})
+            assert response.status_code == 409
+            assert response.headers['Retry-After']
+    finally:
+        release()
+
+
+def test_character_edits_reach_story_copies_in_the_turn_log(client):
+    client.post('/create_character', json={'name': 'Aria', 'race': 'Elf', 'class': 'Mage'})
+    create_story(client, 'Template story')
+    # Added by an edit, so the copy exists only as a pending turn-log record.
+    client.put('/edit_story', json={'originalName': 'Template story', 'characters': {'Aria': {}}})
+
+    response = client.put('/edit_character', json={'originalName': 'Aria', 'name': 'Aria', 'race': 'Half-Elf'})
+    assert response.status_code == 200
+
+    characters = client.post('/load_story', json={'name': 'Template story'}).get_json()['story']['characters']
+    assert characters['Aria']['race'] == 'Half-Elf'
+    assert characters['Aria']['template_origin'] == 'Aria'
+
+
+
+def test_edits_of_a_busy_story_template_apply_latest_once_the_turn_ends(backend, client):
+    client.post('/create_character', json={'name': 'Bram', 'race': 'Dwarf', 'class': 'Cleric'})
+    create_story(client, 'Busy template story', characters=['Bram'])
+    doc_id = backend.story_index.doc_id('Busy template story')
+    release = backend.story_locks.acquire(doc_id)
+    try:
+        client.put('/edit_character', json={'originalName': 'Bram', 'name': 'Bran', 'race': 'Human'})
+        client.put('/edit_character', json={'originalName': 'Bran', 'name': 'Bran', 'race': 'Gnome'})
+        story = backend.turn_log.project(backend.story_creation_table.get(doc_id=doc_id), ('characters',))
+        assert list(story['characters']) == ['Bram']
+    finally:
+        release()
+
+    story = backend.turn_log.project(backend.story_creation_table.get(doc_id=doc_id), ('characters',))
+    assert list(story['characters']) == ['Bran']
+    assert story['characters']['Bran']['race'] == 'Gnome'
+    assert story['characters']['Bran']['template_origin'] == 'Bran'
+    assert doc_id not in backend.template_updates
+
+def test_cancel_before_the_first_chunk_drops_the_model_connection(backend, client, mock_ollama):
+    mock = mock_ollama(first_token_ms=5000)
+    create_story(client, 'Cancel during prompt eval')
+    frames = []
+
+    def chat():
+        # The test client waits for the first chunk before returning.
+        response = backend.app.test_client().post(
+            '/chat', json={'story_name': 'Cancel during prompt eval', 'message': 'Hello'}, buffered=False)
+        frames.extend(response.response)
+        response.close()
+
+    reader = threading.Thread(target=chat)
+    reader.start()
+    deadline = time.monotonic() + 5
+    while not mock.calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert mock.calls and 'first_chunk' not in mock.calls[0]
+
+    cancelled_at = time.monotonic()
+    assert client.post('/chat/cancel', json={'story_name': 'Cancel during prompt eval'}).status_code == 200
+    reader.join(timeout=5)
+    assert not reader.is_alive()
+
+    while 'finished' not in mock.calls[0] and time.monotonic() < cancelled_at + 2:
+        time.sleep(0.01)
+    assert mock.calls[0].get('cancelled') and 'first_chunk' not in mock.calls[0]
+    assert any(b'"interrupted": true' in frame for frame in frames)
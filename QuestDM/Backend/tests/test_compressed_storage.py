@@ -0,0 +1,60 @@
+import pytest
+from tinydb.storages import MemoryStorage
+
+from compressed_storage import CODECS, MessageCompressor, is_blob, resolve_codec
+from name_index import LockedTinyDB
+from turn_log import TurnLogStore
+
+
+@pytest.fixture
+def table():
+    return LockedTinyDB(storage=MemoryStorage).table('story_creation')
+
+
+def messages(count):
+    return [{'role': 'user', 'content': f'The party walks on, day {i}. Ünïcode.'} for i in range(count)]
+
+
+def test_unset_leaves_storage_plain_and_auto_is_the_measured_codec():
+    assert resolve_codec(None) is None
+    assert resolve_codec('auto') is CODECS['gzip']
+    assert resolve_codec('gzip') is CODECS['gzip']
+    with pytest.raises(ValueError):
+        resolve_codec('brotli')
+
+
+def test_message_arrays_round_trip_and_other_fields_stay_plain():
+    compressor = MessageCompressor(CODECS['gzip'])
+    encoded = compressor.encode({'conversation_history': messages(50), 'last_activity': 5})
+    assert is_blob(encoded['conversation_history'])
+    assert encoded['last_activity'] == 5
+    assert compressor.decode(encoded)['conversation_history'] == messages(50)
+
+
+def test_compaction_compresses_and_reads_decode(table, tmp_path):
+    log = TurnLogStore(table, str(tmp_path), compressor=MessageCompressor(CODECS['gzip']))
+    doc_id = table.insert({'name': 'Story', 'conversation_history': [], 'llm_memory': []})
+    log.append(doc_id, 'conversation_history', *messages(20))
+    log.compact(doc_id)
+    assert is_blob(table.get(doc_id=doc_id)['conversation_history'])
+    # Untouched fields are left as they were until a record changes them.
+    assert table.get(doc_id=doc_id)['llm_memory'] == []
+
+    log.append(doc_id, 'conversation_history', {'role': 'assistant', 'content': 'On.'})
+    expected = messages(20) + [{'role': 'assistant', 'content': 'On.'}]
+    assert log.materialize(table.get(doc_id=doc_id))['conversation_history'] == expected
+    assert log.project(table.get(doc_id=doc_id), ('conversation_history',)) == {'conversation_history': expected}
+
+    log.compact(doc_id)
+    plain = TurnLogStore(table, str(tmp_path))
+    assert plain.materialize(table.get(doc_id=doc_id))['conversation_history'] == expected
+
+
+def test_decoded_lists_are_not_shared(table, tmp_path):
+    log = TurnLogStore(table, str(tmp_path), compressor=MessageCompressor(CODECS['gzip']))
+    doc_id = table.insert({'name': 'Story', 'conversation_history': []})
+    log.append(doc_id, 'conversation_history', *messages(3))
+    log.compact(doc_id)
+    first = log.materialize(table.get(doc_id=doc_id))['conversation_history']
+    first.append('mutated')
+    assert log.materialize(table.get(doc_id=doc_id))['conversation_history'] == messages(3)
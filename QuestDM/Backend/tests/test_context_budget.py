@@ -0,0 +1,27 @@
+from context_budget import assemble_context, estimate_tokens
+
+
+def message(role, content):
+    return {'role': role, 'content': content}
+
+
+def test_estimate_tokens_leaves_the_message_alone():
+    msg = message('user', 'The dragon circles above the ruins.')
+    assert estimate_tokens(msg) > 0
+    assert msg == message('user', 'The dragon circles above the ruins.')
+
+
+def test_estimate_tokens_follows_content_changes():
+    msg = message('assistant', 'short')
+    before = estimate_tokens(msg)
+    msg['content'] += ' and then a much longer continuation of the reply'
+    assert estimate_tokens(msg) > before
+
+
+def test_assemble_context_keeps_the_prefix_and_the_newest_message():
+    memory = [message('system', 'prompt')] * 3 + [message('user', 'word ' * 100) for _ in range(10)]
+    window, used, total, start = assemble_context(memory, budget=300)
+    assert window[:3] == memory[:3]
+    assert window[-1] is memory[-1]
+    assert used <= 300 < total
+    assert all(set(m) == {'role', 'content'} for m in memory)
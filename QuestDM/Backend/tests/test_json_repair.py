@@ -0,0 +1,47 @@
+import pytest
+
+from json_repair import repair_json
+
+
+EXPECTED = {"summary": "The party, weary, rests.", "characters": ["Aria", "Bob"]}
+
+
+@pytest.mark.parametrize("text", [
+    '{"summary": "The party, weary, rests.", "characters": ["Aria", "Bob"]}',
+    '{"summary": "The party, weary, rests.", "characters": ["Aria", "Bob",],}',
+    "{'summary': 'The party, weary, rests.', 'characters': ['Aria', 'Bob']}",
+    '{summary: "The party, weary, rests.", characters: ["Aria", "Bob"]}',
+    '{"summary": "The party, weary, rests."\n "characters": ["Aria", "Bob"]}',
+    'Here is the summary:\n```json\n{"summary": "The party, weary, rests.", "characters": ["Aria", "Bob"]}\n```',
+    '{"summary": "The party, weary, rests.", // the story so far\n "characters": ["Aria", "Bob"]}',
+])
+def test_common_damage_is_repaired(text):
+    assert repair_json(text) == EXPECTED
+
+
+def test_truncated_input_is_closed():
+    assert repair_json('{"summary": "The party rests", "characters": ["Aria", "Bo') == {
+        "summary": "The party rests", "characters": ["Aria", "Bo"]
+    }
+
+
+def test_unescaped_quotes_stay_in_the_string():
+    assert repair_json('{"summary": "She said "run" and fled."}') == {"summary": 'She said "run" and fled.'}
+
+
+def test_python_literals_and_numbers():
+    assert repair_json("{'alive': True, 'gold': 12, 'title': None}") == {"alive": True, "gold": 12, "title": None}
+
+
+def test_missing_value_becomes_null():
+    assert repair_json('{"summary": , "characters": []}') == {"summary": None, "characters": []}
+
+
+def test_text_without_json_is_an_error():
+    with pytest.raises(ValueError):
+        repair_json("I could not summarize this story.")
+
+
+def test_deep_nesting_is_an_error_not_a_crash():
+    with pytest.raises(ValueError):
+        repair_json("[" * 10000)
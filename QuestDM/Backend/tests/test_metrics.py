@@ -0,0 +1,17 @@
+from metrics import BYTES_BUCKETS, MetricsRegistry, labels
+
+
+def test_labels_block_fills_labels_not_passed_explicitly():
+    registry = MetricsRegistry()
+    registry.histogram("writes", "Writes.", BYTES_BUCKETS, ("store", "model", "story"))
+    with labels(model="llama3", story=7):
+        registry.observe("writes", 100, store="turn_log")
+        registry.observe("writes", 100, store="turn_log", story=8)
+    registry.observe("writes", 100, store="tinydb")
+
+    series = [s["labels"] for s in registry.snapshot()["writes"]["series"]]
+    assert series == [
+        {"store": "turn_log", "model": "llama3", "story": "7"},
+        {"store": "turn_log", "model": "llama3", "story": "8"},
+        {"store": "tinydb", "model": "", "story": ""},
+    ]
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from scheduler import INTERACTIVE, REPAIR, SUMMARIZATION, ModelScheduler, QueueFull
+
+
+def test_higher_priority_runs_first_and_ties_keep_arrival_order():
+    scheduler = ModelScheduler(limit=1)
+    running = scheduler.submit(INTERACTIVE)
+    repair = scheduler.submit(REPAIR)
+    summary = scheduler.submit(SUMMARIZATION)
+    first_turn = scheduler.submit(INTERACTIVE)
+    second_turn = scheduler.submit(INTERACTIVE)
+    assert running.granted
+    assert [t.position() for t in (first_turn, second_turn, summary, repair)] == [1, 2, 3, 4]
+
+    running.release()
+    assert first_turn.granted and not second_turn.granted
+    first_turn.release()
+    assert second_turn.granted and not summary.granted
+    second_turn.release()
+    assert summary.granted and not repair.granted
+    summary.release()
+    assert repair.granted
+
+
+def test_limit_caps_concurrent_calls():
+    scheduler = ModelScheduler(limit=2)
+    tickets = [scheduler.submit(INTERACTIVE) for _ in range(3)]
+    assert [t.granted for t in tickets] == [True, True, False]
+    tickets[0].release()
+    assert tickets[2].granted
+    assert scheduler.stats() == {"running": 2, "queued": 0, "limit": 2}
+
+
+def test_queue_full_is_raised_only_for_admitted_calls():
+    scheduler = ModelScheduler(limit=1, max_queue=1)
+    scheduler.submit(INTERACTIVE)
+    scheduler.submit(INTERACTIVE)
+    with pytest.raises(QueueFull) as error:
+        scheduler.submit(INTERACTIVE)
+    assert error.value.queued == 1
+    assert not scheduler.submit(SUMMARIZATION, admit=False).granted
+
+
+def test_release_is_idempotent_and_leaves_the_queue():
+    scheduler = ModelScheduler(limit=1)
+    running = scheduler.submit(INTERACTIVE)
+    waiting = scheduler.submit(INTERACTIVE)
+    waiting.release()
+    waiting.release()
+    assert waiting.position() == 0
+    running.release()
+    running.release()
+    assert scheduler.stats() == {"running": 0, "queued": 0, "limit": 1}
+
+
+def test_a_call_waiting_past_max_wait_goes_before_newer_turns():
+    scheduler = ModelScheduler(limit=1, max_wait=30.0)
+    running = scheduler.submit(INTERACTIVE)
+    summary = scheduler.submit(SUMMARIZATION)
+    turn = scheduler.submit(INTERACTIVE)
+
+    summary.queued_at -= 31
+    running.release()
+    assert summary.granted and not turn.granted
+
+
+def test_wait_async_times_out_without_leaving_callbacks_behind():
+    scheduler = ModelScheduler(limit=1)
+    scheduler.submit(INTERACTIVE)
+    waiting = scheduler.submit(INTERACTIVE)
+
+    async def poll():
+        return [await waiting.wait_async(0.01) for _ in range(5)]
+
+    assert asyncio.run(poll()) == [False] * 5
+    assert waiting._callbacks == []
+
+
+def test_wait_async_wakes_up_when_the_slot_is_granted():
+    scheduler = ModelScheduler(limit=1)
+    running = scheduler.submit(INTERACTIVE)
+    waiting = scheduler.submit(INTERACTIVE)
+
+    async def wait():
+        asyncio.get_running_loop().call_later(0.01, running.release)
+        return await waiting.wait_async(5)
+
+    assert asyncio.run(wait()) is True
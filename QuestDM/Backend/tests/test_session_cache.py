@@ -0,0 +1,58 @@
+from session_cache import MESSAGE_OVERHEAD, SessionCache
+
+
+def messages(count, size=100):
+    return [{"role": "user", "content": "x" * size} for _ in range(count)]
+
+
+def test_views_behave_like_dicts():
+    cache = SessionCache()
+    history = cache.view("history")
+    history["story"] = messages(1)
+    assert "story" in history and len(history) == 1
+    assert list(history) == ["story"]
+    del history["story"]
+    assert "story" not in history
+
+
+def test_least_recently_used_session_is_evicted_by_count():
+    evicted = []
+    cache = SessionCache(max_entries=2, on_evict=evicted.append)
+    history = cache.view("history")
+    history["a"] = messages(1)
+    history["b"] = messages(1)
+    history["a"]
+    history["c"] = messages(1)
+    assert evicted == ["b"]
+    assert set(history) == {"a", "c"}
+
+
+def test_eviction_by_bytes_counts_messages_appended_in_place():
+    cache = SessionCache(max_bytes=10 * (MESSAGE_OVERHEAD + 100))
+    history = cache.view("history")
+    history["a"] = messages(2)
+    history["b"] = messages(2)
+    history["b"].extend(messages(5))
+    assert cache.stats()["bytes"] == 9 * (MESSAGE_OVERHEAD + 100)
+
+    history["a"].extend(messages(2))
+    cache.evict()
+    assert "b" not in history and "a" in history
+
+
+def test_pinned_sessions_are_never_evicted():
+    cache = SessionCache(max_entries=1, pinned=lambda key: key == "busy")
+    history = cache.view("history")
+    history["busy"] = messages(1)
+    history["idle"] = messages(1)
+    assert list(history) == ["busy"]
+
+
+def test_fields_of_one_session_are_evicted_together():
+    cache = SessionCache(max_entries=1)
+    history, memory = cache.view("history"), cache.view("memory")
+    history["a"] = messages(1)
+    memory["a"] = messages(1)
+    history["b"] = messages(1)
+    assert "a" not in memory and "a" not in history
+    assert cache.stats()["sessions"] == 1
@@ -0,0 +1,53 @@
+import json
+import time
+
+from sse import FrameCoalescer, sse_frame
+
+
+def contents(frames):
+    return [json.loads(frame.split("data: ", 1)[1])["content"] for frame in frames]
+
+
+def test_frames_name_their_event():
+    assert sse_frame({"content": "hi"}) == 'data: {"content": "hi"}\n\n'
+    assert sse_frame({"content": "hi"}, "reasoning").startswith("event: reasoning\n")
+
+
+def test_pieces_after_a_frame_are_held_until_flushed():
+    coalescer = FrameCoalescer(flush_ms=10000, flush_bytes=1024)
+    assert contents(coalescer.add("Once")) == ["Once"]
+    assert coalescer.add(" upon") == []
+    assert coalescer.add(" a time") == []
+    assert 0 < coalescer.remaining() <= 10
+    assert contents(coalescer.flush()) == [" upon a time"]
+    assert coalescer.remaining() is None and coalescer.flush() == []
+
+
+def test_a_full_buffer_is_sent_at_once():
+    coalescer = FrameCoalescer(flush_ms=10000, flush_bytes=8)
+    coalescer.add("first")
+    assert coalescer.add("abcd") == []
+    assert contents(coalescer.add("efgh")) == ["abcdefgh"]
+
+
+def test_zero_interval_sends_every_piece():
+    coalescer = FrameCoalescer(flush_ms=0)
+    assert contents(coalescer.add("a")) == ["a"]
+    assert contents(coalescer.add("b")) == ["b"]
+
+
+def test_a_slow_token_source_is_not_held_back():
+    coalescer = FrameCoalescer(flush_ms=20)
+    for token in ["The", " door", " opens"]:
+        time.sleep(0.03)
+        assert contents(coalescer.add(token)) == [token]
+
+
+def test_event_types_are_not_merged():
+    coalescer = FrameCoalescer(flush_ms=10000)
+    coalescer.add("Intro")
+    coalescer.add("plan", "reasoning")
+    frames = coalescer.add("The door opens.")
+    assert len(frames) == 1 and frames[0].startswith("event: reasoning\n")
+    assert contents(frames) == ["plan"]
+    assert contents(coalescer.flush()) == ["The door opens."]
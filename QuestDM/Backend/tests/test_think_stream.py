@@ -0,0 +1,42 @@
+from think_stream import ANSWER, REASONING, ThinkTagSplitter
+
+
+def split(pieces):
+    splitter = ThinkTagSplitter()
+    parts = []
+    for piece in pieces:
+        parts += splitter.feed(piece)
+    parts += splitter.finish()
+    merged = []
+    for kind, text in parts:
+        if merged and merged[-1][0] == kind:
+            merged[-1] = (kind, merged[-1][1] + text)
+        else:
+            merged.append((kind, text))
+    return merged
+
+
+def test_reasoning_and_answer_are_separated():
+    assert split(["<think>plan</think>Answer"]) == [(REASONING, "plan"), (ANSWER, "Answer")]
+
+
+def test_tags_split_across_every_chunk_boundary():
+    reply = "Intro <think>weigh the options</think> The door opens."
+    expected = [(ANSWER, "Intro "), (REASONING, "weigh the options"), (ANSWER, " The door opens.")]
+    for cut in range(1, len(reply)):
+        assert split([reply[:cut], reply[cut:]]) == expected
+    assert split(list(reply)) == expected
+
+
+def test_a_held_back_partial_tag_is_released_when_it_does_not_complete():
+    splitter = ThinkTagSplitter()
+    assert splitter.feed("a <thi") == [(ANSWER, "a ")]
+    assert splitter.feed("ng") == [(ANSWER, "<thing")]
+
+
+def test_a_partial_tag_at_the_end_of_the_stream_is_kept():
+    assert split(["The end <th"]) == [(ANSWER, "The end <th")]
+
+
+def test_unclosed_reasoning_stays_reasoning():
+    assert split(["<think>still thinking"]) == [(REASONING, "still thinking")]
@@ -0,0 +1,170 @@
+import os
+import random
+import threading
+import time
+
+import pytest
+from tinydb.storages import MemoryStorage
+
+from name_index import LockedTinyDB
+from turn_log import TurnLogStore
+
+
+@pytest.fixture
+def table():
+    return LockedTinyDB(storage=MemoryStorage).table('story_creation')
+
+
+def story(table, **fields):
+    return table.insert({'name': 'Story', 'conversation_history': [], 'characters': {}, **fields})
+
+
+def test_materialize_applies_pending_records(table, tmp_path):
+    log = TurnLogStore(table, str(tmp_path))
+    doc_id = story(table)
+    log.append(doc_id, 'conversation_history', {'role': 'user', 'content': 'hi'})
+    log.set(doc_id, current_summary='A summary.')
+
+    materialized = log.materialize(table.get(doc_id=doc_id))
+    assert materialized['conversation_history'] == [{'role': 'user', 'content': 'hi'}]
+    assert materialized['current_summary'] == 'A summary.'
+    # TinyDB is untouched until compaction.
+    assert table.get(doc_id=doc_id)['conversation_history'] == []
+
+
+def test_later_set_wins_over_earlier_appends(table, tmp_path):
+    log = TurnLogStore(table, str(tmp_path))
+    doc_id = story(table)
+    log.append(doc_id, 'conversation_history', 'a', 'b')
+    log.set(doc_id, conversation_history=['summary'])
+    log.append(doc_id, 'conversation_history', 'c')
+    assert log.materialize(table.get(doc_id=doc_id))['conversation_history'] == ['summary', 'c']
+
+
+def test_set_snapshots_the_value(table, tmp_path):
+    log = TurnLogStore(table, str(tmp_path))
+    doc_id = story(table)
+    memory = ['a']
+    log.set(doc_id, llm_memory=memory)
+    memory.append('b')
+    assert log.materialize(table.get(doc_id=doc_id))['llm_memory'] == ['a']
+
+
+def test_project_returns_only_the_requested_fields(table, tmp_path):
+    log = TurnLogStore(table, str(tmp_path))
+    doc_id = story(table)
+    log.append(doc_id, 'conversation_history', 'a')
+    log.set(doc_id, last_activity=5)
+    assert log.project(table.get(doc_id=doc_id), ('name', 'last_activity')) == {'name': 'Story', 'last_activity': 5}
+
+
+def test_compact_folds_the_log_into_tinydb(table, tmp_path):
+    log = TurnLogStore(table, str(tmp_path))
+    doc_id = story(table)
+    log.append(doc_id, 'conversation_history', 'a', 'b')
+    log.compact(doc_id)
+
+    stored = table.get(doc_id=doc_id)
+    assert stored['conversation_history'] == ['a', 'b']
+    assert stored['log_segment'] == 1
+    assert os.listdir(tmp_path) == []
+    assert log.materialize(stored)['conversation_history'] == ['a', 'b']
+
+
+def test_replay_restores_pending_records_and_skips_a_torn_line(table, tmp_path):
+    log = TurnLogStore(table, str(tmp_path))
+    doc_id = story(table)
+    log.append(doc_id, 'conversation_history', 'a', 'b')
+    with open(tmp_path / f'{doc_id}.0.log', 'a', encoding='utf-8') as f:
+        f.write('{"op": "append", "field": "conversation_hi')
+
+    replayed = TurnLogStore(table, str(tmp_path))
+    assert replayed.materialize(table.get(doc_id=doc_id))['conversation_history'] == ['a', 'b']
+
+
+def test_replay_removes_segments_already_folded_in(table, tmp_path):
+    doc_id = story(table, conversation_history=['a'], log_segment=1)
+    # Left behind by a crash between the TinyDB update and the file removal.
+    with open(tmp_path / f'{doc_id}.0.log', 'w', encoding='utf-8') as f:
+        f.write('{"op": "append", "field": "conversation_history", "value": "a"}\n')
+
+    log = TurnLogStore(table, str(tmp_path))
+    assert log.materialize(table.get(doc_id=doc_id))['conversation_history'] == ['a']
+    assert not (tmp_path / f'{doc_id}.0.log').exists()
+
+
+def test_drop_forgets_a_deleted_story(table, tmp_path):
+    log = TurnLogStore(table, str(tmp_path))
+    doc_id = story(table)
+    log.append(doc_id, 'conversation_history', 'a')
+    log.drop(doc_id)
+    assert os.listdir(tmp_path) == []
+    assert log.materialize(table.get(doc_id=doc_id))['conversation_history'] == []
+
+
+def test_compaction_racing_appends_loses_nothing(table, tmp_path):
+    log = TurnLogStore(table, str(tmp_path))
+    doc_id = story(table)
+    done = threading.Event()
+
+    def compact():
+        while not done.is_set():
+            log.compact(doc_id)
+
+    compactor = threading.Thread(target=compact)
+    compactor.start()
+    try:
+        for i in range(500):
+            log.append(doc_id, 'conversation_history', i)
+    finally:
+        done.set()
+        compactor.join()
+
+    assert log.materialize(table.get(doc_id=doc_id))['conversation_history'] == list(range(500))
+    log.compact(doc_id)
+    assert TurnLogStore(table, str(tmp_path)).materialize(
+        table.get(doc_id=doc_id))['conversation_history'] == list(range(500))
+
+
+def test_concurrent_compactions_lose_nothing(table, tmp_path, monkeypatch):
+    log = TurnLogStore(table, str(tmp_path))
+    doc_id = story(table)
+    done = threading.Event()
+
+    update = table.update
+
+    def slow_update(*args, **kwargs):
+        # Lets one compaction's read and write straddle another's.
+        time.sleep(random.random() / 500)
+        return update(*args, **kwargs)
+
+    monkeypatch.setattr(table, 'update', slow_update)
+
+    def compact():
+        while not done.is_set():
+            log.compact(doc_id)
+
+    compactors = [threading.Thread(target=compact) for _ in range(2)]
+    for compactor in compactors:
+        compactor.start()
+    try:
+        for i in range(300):
+            log.append(doc_id, 'conversation_history', i)
+    finally:
+        done.set()
+        for compactor in compactors:
+            compactor.join()
+
+    log.compact(doc_id)
+    assert table.get(doc_id=doc_id)['conversation_history'] == list(range(300))
+
+
+def test_requested_compaction_runs_on_the_next_wake_up(table, tmp_path):
+    log = TurnLogStore(table, str(tmp_path))
+    doc_id = story(table)
+    log.append(doc_id, 'conversation_history', 'a')
+    log.request_compaction(doc_id)
+    assert table.get(doc_id=doc_id)['conversation_history'] == []
+
+    log.compact_all()
+    assert table.get(doc_id=doc_id)['conversation_history'] == ['a']
@@ -0,0 +1,55 @@
+REASONING = "reasoning"
+ANSWER = "answer"
+
+
+class ThinkTagSplitter:
+    """
+    Splits a streamed reply into reasoning (``<think>...</think>``) and answer
+    text, holding back only a tail that may be the start of a split tag.
+    """
+
+    def __init__(self, open_tag="<think>", close_tag="</think>"):
+        self.open_tag = open_tag
+        self.close_tag = close_tag
+        self.kind = ANSWER
+        self._pending = ""
+
+    @staticmethod
+    def _partial_tag(text, tag):
+        """Length of the longest suffix of ``text`` that is a proper prefix of ``tag``."""
+        for size in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:size]):
+                return size
+        return 0
+
+    def feed(self, text):
+        """
+        Takes the next piece of the stream.
+
+        Returns:
+            list: (kind, text) pairs, kind being REASONING or ANSWER, in stream order
+        """
+        text = self._pending + text
+        self._pending = ""
+        parts = []
+        while text:
+            tag = self.open_tag if self.kind == ANSWER else self.close_tag
+            index = text.find(tag)
+            if index == -1:
+                held = self._partial_tag(text, tag)
+                if held:
+                    self._pending = text[-held:]
+                    text = text[:-held]
+                if text:
+                    parts.append((self.kind, text))
+                break
+            if index:
+                parts.append((self.kind, text[:index]))
+            self.kind = REASONING if self.kind == ANSWER else ANSWER
+            text = text[index + len(tag):]
+        return parts
+
+    def finish(self):
+        """Returns whatever was held back once the stream has ended."""
+        pending, self._pending = self._pending, ""
+        return [(self.kind, pending)] if pending else []
@@ -0,0 +1,260 @@
+import os
+import json
+import logging
+import threading
+import time
+
+import metrics
+from compressed_storage import MessageCompressor
+
+
+logger = logging.getLogger(__name__)
+
+
+class TurnLogStore:
+    """
+    Append-only per-story log in front of the TinyDB story table.
+
+    Turns append records to ``<doc_id>.<seq>.log`` instead of rewriting
+    ``stories.json``; a background compactor folds them back in. Segments
+    below the story's ``log_segment`` are already folded and are dropped on
+    replay. ``compressor`` stores the message arrays as compressed blobs.
+    """
+
+    def __init__(self, table, directory, compact_after=64, compressor=None):
+        self.table = table
+        self.directory = directory
+        self.compact_after = compact_after
+        self.compressor = compressor or MessageCompressor()
+
+        self._lock = threading.RLock()
+        self._segments = {}      # doc_id -> {seq: [records]}
+        self._active = {}        # doc_id -> active seq
+        self._handles = {}       # doc_id -> open file of the active segment
+        self._compacting = {}    # doc_id -> lock held for a whole compaction
+        self._requested = set()  # doc_ids to compact on the next wake-up
+        self._wakeup = threading.Event()
+        self._compactor = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._replay()
+
+    def _segment_path(self, doc_id, seq):
+        return os.path.join(self.directory, f"{doc_id}.{seq}.log")
+
+    def _replay(self):
+        """Loads the pending segments left on disk by a previous run."""
+        for file_name in os.listdir(self.directory):
+            parts = file_name.split(".")
+            if len(parts) != 3 or parts[2] != "log":
+                continue
+            try:
+                doc_id, seq = int(parts[0]), int(parts[1])
+            except ValueError:
+                continue
+
+            path = os.path.join(self.directory, file_name)
+            doc = self.table.get(doc_id=doc_id)
+            if not doc or seq < doc.get("log_segment", 0):
+                os.remove(path)
+                continue
+
+            records = []
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # A torn final line from a crash mid-write; everything
+                        # before it is intact.
+                        break
+
+            self._segments.setdefault(doc_id, {})[seq] = records
+            self._active[doc_id] = max(self._active.get(doc_id, seq), seq)
+
+    def _handle(self, doc_id):
+        handle = self._handles.get(doc_id)
+        if handle is None:
+            if doc_id not in self._active:
+                doc = self.table.get(doc_id=doc_id)
+                self._active[doc_id] = doc.get("log_segment", 0) if doc else 0
+            seq = self._active[doc_id]
+            self._segments.setdefault(doc_id, {}).setdefault(seq, [])
+            handle = open(self._segment_path(doc_id, seq), "a", encoding="utf-8")
+            self._handles[doc_id] = handle
+        return handle
+
+    def _write(self, doc_id, records):
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        with self._lock:
+            started = time.perf_counter()
+            handle = self._handle(doc_id)
+            handle.write(data)
+            handle.flush()
+            metrics.registry.observe(
+                "questdm_db_write_seconds", time.perf_counter() - started, store="turn_log", story=doc_id
+            )
+            metrics.registry.observe("questdm_db_write_bytes", len(data.encode("utf-8")), store="turn_log", story=doc_id)
+            pending = self._segments[doc_id][self._active[doc_id]]
+            pending.extend(records)
+            if len(pending) >= self.compact_after:
+                self._wakeup.set()
+
+    def append(self, doc_id, field, *messages):
+        """Appends one or more messages to a list field of the story."""
+        if messages:
+            self._write(doc_id, [{"op": "append", "field": field, "value": m} for m in messages])
+
+    def set(self, doc_id, **fields):
+        """Replaces whole fields of the story (summaries, rebuilt memory)."""
+        if fields:
+            # Snapshot containers: callers keep mutating their in-memory lists.
+            self._write(doc_id, [
+                {"op": "set", "field": k, "value": v.copy() if isinstance(v, (list, dict)) else v}
+                for k, v in fields.items()
+            ])
+
+    @staticmethod
+    def _apply(story, records):
+        copied = set()
+        for record in records:
+            field = record["field"]
+            if record["op"] == "set":
+                story[field] = record["value"]
+                copied.discard(field)
+            elif record["op"] == "append":
+                if field not in copied:
+                    story[field] = list(story.get(field) or [])
+                    copied.add(field)
+                story[field].append(record["value"])
+        return story
+
+    def _pending_records(self, doc, seqs=None):
+        segments = self._segments.get(doc.doc_id) or {}
+        base_seq = doc.get("log_segment", 0)
+        if seqs is None:
+            seqs = sorted(segments)
+        return [r for seq in seqs if seq >= base_seq for r in segments.get(seq, [])]
+
+    def _current(self, doc):
+        """Re-reads a document that a compaction folded into after the caller fetched it."""
+        current = self.table.get(doc_id=doc.doc_id)
+        if current is not None and current.get("log_segment", 0) != doc.get("log_segment", 0):
+            return current
+        return doc
+
+    def materialize(self, doc):
+        """
+        Returns a copy of a story document with its pending log applied.
+
+        Args:
+            doc (Document): The story as stored in TinyDB
+
+        Returns:
+            dict: The story as the rest of the app should see it
+        """
+        if doc is None:
+            return None
+        with self._lock:
+            doc = self._current(doc)
+            records = self._pending_records(doc)
+        return self._apply(self.compressor.decode(dict(doc)), records)
+
+    def project(self, doc, fields):
+        """Like materialize(), but copies only the given fields."""
+        if doc is None:
+            return None
+        with self._lock:
+            doc = self._current(doc)
+            records = [r for r in self._pending_records(doc) if r["field"] in fields]
+        story = self.compressor.decode({f: doc[f] for f in fields if f in doc})
+        return self._apply(story, records)
+
+    def compact(self, doc_id):
+        """Folds the pending segments of one story back into TinyDB."""
+        with self._lock:
+            compacting = self._compacting.setdefault(doc_id, threading.Lock())
+        with compacting:
+            self._compact(doc_id)
+
+    def _compact(self, doc_id):
+        # Caller holds the story's compaction lock.
+        with self._lock:
+            segments = self._segments.get(doc_id)
+            if not segments or not any(segments.values()):
+                return
+            handle = self._handles.pop(doc_id, None)
+            if handle:
+                handle.close()
+            folded_seqs = sorted(segments)
+            next_seq = folded_seqs[-1] + 1
+            self._active[doc_id] = next_seq
+            segments.setdefault(next_seq, [])
+
+        doc = self.table.get(doc_id=doc_id)
+        if doc is not None:
+            with self._lock:
+                records = self._pending_records(doc, folded_seqs)
+            touched = {r["field"] for r in records}
+            story = self._apply(self.compressor.decode(dict(doc), touched), records)
+            fields = self.compressor.encode({field: story[field] for field in touched})
+            fields["log_segment"] = next_seq
+            with metrics.labels(story=doc_id):
+                self.table.update(fields, doc_ids=[doc_id])
+
+        with self._lock:
+            for seq in folded_seqs:
+                segments.pop(seq, None)
+                path = self._segment_path(doc_id, seq)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def request_compaction(self, doc_id):
+        """Has the background compactor fold one story in on its next wake-up."""
+        with self._lock:
+            self._requested.add(doc_id)
+        self._wakeup.set()
+
+    def compact_all(self, force=False):
+        with self._lock:
+            requested, self._requested = self._requested, set()
+            doc_ids = [
+                doc_id for doc_id, segments in self._segments.items()
+                if force or doc_id in requested or sum(len(r) for r in segments.values()) >= self.compact_after
+            ]
+        for doc_id in doc_ids:
+            try:
+                self.compact(doc_id)
+            except Exception as e:
+                logger.warning("Compaction failed for story %s: %s", doc_id, e)
+
+    def drop(self, doc_id):
+        """Forgets every pending record of a deleted story."""
+        with self._lock:
+            handle = self._handles.pop(doc_id, None)
+            if handle:
+                handle.close()
+            for seq in self._segments.pop(doc_id, {}):
+                path = self._segment_path(doc_id, seq)
+                if os.path.exists(path):
+                    os.remove(path)
+            self._active.pop(doc_id, None)
+            self._compacting.pop(doc_id, None)
+            self._requested.discard(doc_id)
+
+    def start_compactor(self, interval=30.0):
+        """Starts the background thread that folds full segments into TinyDB."""
+        if self._compactor is not None:
+            return
+
+        def run():
+            while True:
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+                self.compact_all()
+
+        self._compactor = threading.Thread(target=run, name="turn-log-compactor", daemon=True)
+        self._compactor.start()